@@ -4,13 +4,25 @@ import json
 import logging
 import uuid
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 import ovh
-import re
 import traceback
 import requests
+import purchase_journal
+import debug_capture
+import hardware_parser
+import catalog_parser
+import catalog_refresher
+import server_index
+import response_cache
+import availability_matrix
+import availability_history
+import poll_scheduler
+import event_stream
+import fast_json
 
 # Configure logging
 logging.basicConfig(
@@ -31,6 +43,12 @@ LOGS_FILE = "logs.json"
 QUEUE_FILE = "queue.json"
 HISTORY_FILE = "history.json"
 SERVERS_FILE = "servers.json"
+PURCHASE_JOURNAL_FILE = "purchase_journal.jsonl"
+DEBUG_CAPTURE_DIR = "api_data"
+HARDWARE_CACHE_FILE = "hardware_cache.json"
+CATALOG_STATE_FILE = "catalog_state.json"
+AVAILABILITY_MATRIX_FILE = "availability_matrix.bin"
+AVAILABILITY_HISTORY_FILE = "availability_history.jsonl"
 
 config = {
     "appKey": "",
@@ -41,12 +59,57 @@ config = {
     "tgChatId": "",
     "iam": "go-ovh-ie",
     "zone": "IE",
+    # 统计计数一致性检查间隔（秒），0表示关闭
+    "statsCheckInterval": 0,
+    # 批量可用性查询缺失时，逐个查询的最大并发数
+    "availabilityConcurrency": 8,
+    # 目录刷新时的调试采集开关及保留的采集包数量
+    "debugCapture": False,
+    "debugCaptureRetention": 5,
+    # 目录解析的进程数（0为CPU核心数，1为串行）、每块型号数，以及少于多少个型号时直接串行
+    "parseWorkers": 0,
+    "parseChunkSize": 50,
+    "parseParallelThreshold": 2000,
+    # 后台刷新服务器目录的间隔（秒），0表示只在启动和手动触发时刷新
+    "catalogRefreshInterval": 1800,
+    # 可用性历史的保留天数，以及保留原始精度（不降采样）的天数
+    "historyRetentionDays": 90,
+    "historyRawDays": 7,
+    # 自适应轮询（队列项 scheduleMode 为 adaptive）：到货高发时段的快速间隔、其余时段的慢速间隔（秒），
+    # 视为高发时段的每周到货次数阈值、统计历史的天数，以及自适应任务每分钟的总请求预算（0为不限制）
+    "adaptiveFastInterval": 2,
+    "adaptiveSlowInterval": 300,
+    "adaptiveHotThreshold": 0.25,
+    "adaptiveLookbackDays": 28,
+    "pollBudgetPerMinute": 60,
+    # 单个购物车最多放入的服务器数量，任务需要购买更多时拆成多个购物车并行下单（0表示不限制）
+    "maxQuantityPerCart": 0,
 }
 
 logs = []
-queue = []
+# id -> 队列项，按加入顺序排列（dict保持插入顺序，按id查找和删除都是O(1)），保存为列表
+queue = {}
 purchase_history = []
 server_plans = []
+# 目录增量刷新的状态：条件请求的ETag和各型号原始数据的内容哈希
+catalog_state = {"zone": None, "etag": None, "fingerprints": {}}
+# 最近一次目录刷新的变化
+catalog_diff = {"added": [], "removed": [], "changed": [], "availabilityChanged": [], "availabilityCells": []}
+# catalog_diff 中最多保留的可用性单元格变化
+MAX_AVAILABILITY_CELL_CHANGES = 500
+# 最近一次目录刷新时的 FQN × 数据中心 可用性矩阵，用于和下一次刷新比较
+availability_snapshot = availability_matrix.AvailabilityMatrix()
+# /api/servers 的查询索引，服务器列表变化时重建
+server_plan_index = server_index.ServerIndex([])
+# 日志、队列、购买历史和服务器列表的响应缓存，数据变化时按集合失效
+responses = response_cache.ResponseCache()
+# /api/events 推送的事件
+events = event_stream.EventStream()
+# 按taskId/订单号建立的历史记录索引，与上面的有序列表同步维护
+history_by_task = {}
+history_by_order = {}
+# 购物车ID -> 该购物车的历史记录（一次购买拆成多个购物车时每个购物车一条记录）
+history_by_cart = {}
 stats = {
     "activeQueues": 0,
     "totalServers": 0,
@@ -54,80 +117,185 @@ stats = {
     "purchaseSuccess": 0,
     "purchaseFailed": 0
 }
+# 保护stats计数器，队列线程和请求线程都会修改
+stats_lock = threading.Lock()
+# (型号, 数据中心) 可用性变化的时间序列
+availability_store = availability_history.AvailabilityHistory(
+    AVAILABILITY_HISTORY_FILE,
+    retention_days=lambda: config.get("historyRetentionDays", 90),
+    raw_days=lambda: config.get("historyRawDays", 7)
+)
+# 自适应轮询的间隔计算和全局请求预算
+scheduler = poll_scheduler.PollScheduler(
+    availability_store,
+    fast_interval=lambda: config.get("adaptiveFastInterval", 2),
+    slow_interval=lambda: config.get("adaptiveSlowInterval", 300),
+    hot_threshold=lambda: config.get("adaptiveHotThreshold", 0.25),
+    lookback_days=lambda: config.get("adaptiveLookbackDays", 28),
+    budget_per_minute=lambda: config.get("pollBudgetPerMinute", 60)
+)
+# 购买步骤预写日志，防止结账后崩溃导致重复下单
+journal = purchase_journal.PurchaseJournal(PURCHASE_JOURNAL_FILE)
 
 # Load data from files if they exist
 def load_data():
     global config, logs, queue, purchase_history, server_plans, stats
     
+    # 数据文件都是UTF-8编码（fast_json写入时不转义非ASCII字符），按字节读取，不依赖系统默认编码
     if os.path.exists(CONFIG_FILE):
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                config = json.load(f)
-        except json.JSONDecodeError:
+            with open(CONFIG_FILE, 'rb') as f:
+                config.update(json.load(f))
+        except (json.JSONDecodeError, UnicodeDecodeError):
             print(f"警告: {CONFIG_FILE}文件格式不正确，使用默认值")
     
     if os.path.exists(LOGS_FILE):
         try:
-            with open(LOGS_FILE, 'r') as f:
+            with open(LOGS_FILE, 'rb') as f:
                 content = f.read().strip()
                 if content:  # 确保文件不是空的
-                    logs = json.loads(content)
+                    logs = fast_json.loads(content)
                 else:
                     print(f"警告: {LOGS_FILE}文件为空，使用空列表")
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
             print(f"警告: {LOGS_FILE}文件格式不正确，使用空列表")
     
     if os.path.exists(QUEUE_FILE):
         try:
-            with open(QUEUE_FILE, 'r') as f:
+            with open(QUEUE_FILE, 'rb') as f:
                 content = f.read().strip()
                 if content:  # 确保文件不是空的
-                    queue = json.loads(content)
+                    queue = {item["id"]: item for item in fast_json.loads(content)}
                 else:
                     print(f"警告: {QUEUE_FILE}文件为空，使用空列表")
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
             print(f"警告: {QUEUE_FILE}文件格式不正确，使用空列表")
     
     if os.path.exists(HISTORY_FILE):
         try:
-            with open(HISTORY_FILE, 'r') as f:
+            with open(HISTORY_FILE, 'rb') as f:
                 content = f.read().strip()
                 if content:  # 确保文件不是空的
-                    purchase_history = json.loads(content)
+                    purchase_history = fast_json.loads(content)
                 else:
                     print(f"警告: {HISTORY_FILE}文件为空，使用空列表")
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
             print(f"警告: {HISTORY_FILE}文件格式不正确，使用空列表")
     
     if os.path.exists(SERVERS_FILE):
         try:
-            with open(SERVERS_FILE, 'r') as f:
+            with open(SERVERS_FILE, 'rb') as f:
                 content = f.read().strip()
                 if content:  # 确保文件不是空的
-                    server_plans = json.loads(content)
+                    server_plans = fast_json.loads(content)
                 else:
                     print(f"警告: {SERVERS_FILE}文件为空，使用空列表")
-        except json.JSONDecodeError:
+        except (json.JSONDecodeError, UnicodeDecodeError):
             print(f"警告: {SERVERS_FILE}文件格式不正确，使用空列表")
     
+    # 重建索引
+    rebuild_indexes()
+    rebuild_server_index()
+    
+    # 回放购买日志，修正崩溃前未保存的购买状态
+    reconcile_purchase_journal()
+    
+    # 加载硬件选项代码的解析缓存和目录增量刷新状态
+    hardware_parser.addon_cache.load(HARDWARE_CACHE_FILE)
+    load_catalog_state()
+    load_availability_snapshot()
+    try:
+        availability_store.load()
+    except OSError as e:
+        logging.warning(f"读取可用性历史失败: {str(e)}")
+    
     # Update stats
-    update_stats()
+    reset_stats()
     
     logging.info("Data loaded from files")
 
+# 根据当前的历史列表重建索引
+def rebuild_indexes():
+    history_by_task.clear()
+    history_by_order.clear()
+    history_by_cart.clear()
+    for entry in purchase_history:
+        if entry.get("taskId"):
+            # 可以购买多台的任务有多条历史，索引指向最新一条
+            history_by_task[entry["taskId"]] = entry
+        if entry.get("orderId"):
+            history_by_order[str(entry["orderId"])] = entry
+        if entry.get("cartId"):
+            history_by_cart[entry["cartId"]] = entry
+
+# 回放购买预写日志，根据崩溃前到达的步骤修正队列和历史
+def reconcile_purchase_journal():
+    try:
+        pending = journal.replay()
+    except Exception as e:
+        logging.error(f"读取购买日志失败: {str(e)}")
+        return
+    if not pending:
+        return
+    
+    for journal_key, state in pending.items():
+        # 拆成多个购物车时日志键为 "任务ID:序号"
+        task_id = journal_key.partition(":")[0]
+        item = queue.get(task_id)
+        # 队列项已被删除时，用日志中记录的信息补全历史
+        queue_item = item or {
+            "id": task_id,
+            "planCode": state.get("planCode", ""),
+            "datacenter": state.get("datacenter", ""),
+            "options": state.get("options", []),
+            "retryCount": state.get("retryCount", 0)
+        }
+        step = state.get("step")
+        if step == purchase_journal.STEP_ORDER_RECEIVED:
+            # 崩溃发生在保存结果之后、结束日志之前时，该订单已经计入数量并写入历史
+            order_id = state.get("orderId")
+            if order_id and (
+                (item and str(order_id) in item.get("creditedOrders", []))
+                or history_by_order.get(str(order_id), {}).get("status") == "success"
+            ):
+                logging.info(f"购买日志中的订单 {order_id} 已记录，跳过恢复")
+                continue
+            if item:
+                if order_id:
+                    item.setdefault("creditedOrders", []).append(str(order_id))
+                item["fulfilledQuantity"] = item.get("fulfilledQuantity", 0) + state.get("quantity", 1)
+                if item["fulfilledQuantity"] >= item.get("quantity", 1):
+                    item["status"] = "completed"
+                item["updatedAt"] = datetime.now().isoformat()
+            record_purchase_history(queue_item, "success", state.get("orderId"), state.get("orderUrl"), None, "日志恢复",
+                                    state.get("datacenter"), state.get("quantity", 1), state.get("cartId"))
+            logging.warning(f"从购买日志恢复已下单任务 {task_id}，订单ID: {state.get('orderId')}")
+        elif step == purchase_journal.STEP_CHECKOUT_ISSUED:
+            # 结账请求已发出但未收到结果，无法确定是否已下单，停止该任务避免重复购买
+            if item:
+                item["status"] = "failed"
+                item["updatedAt"] = datetime.now().isoformat()
+            error_msg = f"进程在结账过程中中断，无法确认是否已下单，请在OVH后台核实 (购物车ID: {state.get('cartId')})"
+            record_purchase_history(queue_item, "failed", None, None, error_msg, "日志恢复",
+                                    state.get("datacenter"), state.get("quantity", 1), state.get("cartId"))
+            logging.warning(f"任务 {task_id} 在结账时中断，已停止该任务: {error_msg}")
+        else:
+            # 尚未结账，不会产生订单，保持原状态继续重试
+            logging.info(f"任务 {task_id} 在 {step} 步骤中断，尚未结账，将继续重试")
+    
+    save_data()
+    journal.checkpoint()
+
 # Save data to files
 def save_data():
+    # 队列和历史的修改之后都会保存，在这里统一使响应缓存失效
+    responses.bump("logs", "queue", "history")
     try:
-        with open(CONFIG_FILE, 'w') as f:
-            json.dump(config, f)
-        with open(LOGS_FILE, 'w') as f:
-            json.dump(logs, f)
-        with open(QUEUE_FILE, 'w') as f:
-            json.dump(queue, f)
-        with open(HISTORY_FILE, 'w') as f:
-            json.dump(purchase_history, f)
-        with open(SERVERS_FILE, 'w') as f:
-            json.dump(server_plans, f)
+        fast_json.dump_file(CONFIG_FILE, config)
+        fast_json.dump_file(LOGS_FILE, logs)
+        fast_json.dump_file(QUEUE_FILE, list(queue.values()))
+        fast_json.dump_file(HISTORY_FILE, purchase_history)
+        fast_json.dump_file(SERVERS_FILE, server_plans)
         logging.info("Data saved to files")
     except Exception as e:
         logging.error(f"保存数据时出错: {str(e)}")
@@ -135,15 +303,14 @@ def save_data():
         # 尝试单独保存每个文件
         try_save_file(CONFIG_FILE, config)
         try_save_file(LOGS_FILE, logs)
-        try_save_file(QUEUE_FILE, queue)
+        try_save_file(QUEUE_FILE, list(queue.values()))
         try_save_file(HISTORY_FILE, purchase_history)
         try_save_file(SERVERS_FILE, server_plans)
 
 # 尝试保存单个文件
 def try_save_file(filename, data):
     try:
-        with open(filename, 'w') as f:
-            json.dump(data, f)
+        fast_json.dump_file(filename, data)
         print(f"成功保存 {filename}")
     except Exception as e:
         print(f"保存 {filename} 时出错: {str(e)}")
@@ -163,10 +330,14 @@ def add_log(level, message, source="system"):
     # Keep logs at a reasonable size (last 1000 entries)
     if len(logs) > 1000:
         logs = logs[-1000:]
+    responses.bump("logs")
+    events.publish("log", log_entry)
     
-    # Save logs to file
-    with open(LOGS_FILE, 'w') as f:
-        json.dump(logs, f)
+    # Save logs to file（写入失败不影响调用方，例如结账成功后记录日志时）
+    try:
+        fast_json.dump_file(LOGS_FILE, logs)
+    except Exception as e:
+        logging.warning(f"保存日志文件失败: {str(e)}")
     
     # Also print to console
     if level == "ERROR":
@@ -176,33 +347,167 @@ def add_log(level, message, source="system"):
     else:
         logging.info(f"[{source}] {message}")
 
-# Update statistics
-def update_stats():
+# 判断型号是否有任一数据中心有货（同一数据中心的多个FQN行任一有货即为有货）
+def plan_has_stock(plan_code):
+    return server_plan_index.has_stock(plan_code)
+
+# 全量重新计算统计信息
+def compute_stats():
+    return {
+        "activeQueues": sum(1 for item in list(queue.values()) if item["status"] == "running"),
+        "totalServers": len(server_plans),
+        "availableServers": sum(1 for server in server_plans if plan_has_stock(server.get("planCode"))),
+        "purchaseSuccess": sum(1 for item in purchase_history if item["status"] == "success"),
+        "purchaseFailed": sum(1 for item in purchase_history if item["status"] == "failed")
+    }
+
+# 用全量计算结果重置计数器（加载数据时使用）
+def reset_stats():
     global stats
-    active_count = sum(1 for item in queue if item["status"] == "running")
-    available_count = 0
+    new_stats = compute_stats()
+    with stats_lock:
+        stats = new_stats
+
+# 按增量调整计数器
+def adjust_stat(key, delta):
+    if delta:
+        with stats_lock:
+            stats[key] += delta
+            value = stats[key]
+        events.publish("stats", {key: value})
+
+# 状态对应的计数器
+QUEUE_STATUS_STATS = {"running": "activeQueues"}
+HISTORY_STATUS_STATS = {"success": "purchaseSuccess", "failed": "purchaseFailed"}
+
+# 统计某个状态变化，old_status为None表示新增，new_status为None表示删除
+def count_status_change(mapping, old_status, new_status):
+    if old_status == new_status:
+        return
+    if old_status in mapping:
+        adjust_stat(mapping[old_status], -1)
+    if new_status in mapping:
+        adjust_stat(mapping[new_status], 1)
+
+# 修改队列项状态并同步计数器
+def set_queue_status(item, status):
+    count_status_change(QUEUE_STATUS_STATS, item.get("status"), status)
+    item["status"] = status
+
+# 推送队列项的变化，action 为 added/updated/removed
+def publish_queue_item(item, action="updated"):
+    events.publish("queue_item", {"action": action, "item": item})
+
+# 服务器列表被整体替换后更新相关计数
+def count_server_plans():
+    total = len(server_plans)
+    available = server_plan_index.available_count()
+    with stats_lock:
+        stats["totalServers"] = total
+        stats["availableServers"] = available
+    events.publish("stats", {"totalServers": total, "availableServers": available})
+
+# 确保返回的服务器对象具有所有必要字段
+def validate_server(server):
+    # 确保每个字段都有合理的默认值
+    validated_server = {
+        "planCode": server.get("planCode", "未知"),
+        "name": server.get("name", "未命名服务器"),
+        "description": server.get("description", ""),
+        "cpu": server.get("cpu", "N/A"),
+        "memory": server.get("memory", "N/A"),
+        "storage": server.get("storage", "N/A"),
+        "bandwidth": server.get("bandwidth", "N/A"),
+        "vrackBandwidth": server.get("vrackBandwidth", "N/A"),
+        "defaultOptions": server.get("defaultOptions", []),
+        "availableOptions": server.get("availableOptions", []),
+        "datacenters": server.get("datacenters", [])
+    }
     
-    # Count available servers
-    for server in server_plans:
-        for dc in server["datacenters"]:
-            if dc["availability"] not in ["unavailable", "unknown"]:
-                available_count += 1
-                break
+    # 确保数组类型的字段是有效的数组
+    if not isinstance(validated_server["defaultOptions"], list):
+        validated_server["defaultOptions"] = []
     
-    success_count = sum(1 for item in purchase_history if item["status"] == "success")
-    failed_count = sum(1 for item in purchase_history if item["status"] == "failed")
+    if not isinstance(validated_server["availableOptions"], list):
+        validated_server["availableOptions"] = []
     
-    stats = {
-        "activeQueues": active_count,
-        "totalServers": len(server_plans),
-        "availableServers": available_count,
-        "purchaseSuccess": success_count,
-        "purchaseFailed": failed_count
-    }
+    if not isinstance(validated_server["datacenters"], list):
+        validated_server["datacenters"] = []
+    
+    return validated_server
+
+# 服务器列表变化后重建查询索引（整体替换，请求线程读到的总是完整的索引）
+def rebuild_server_index():
+    global server_plan_index
+    server_plan_index = server_index.ServerIndex((validate_server(server) for server in server_plans), server_plan_index)
+    responses.bump("servers")
+
+# 单个型号的可用性查询结果写回索引，并更新有货型号的计数
+def apply_availability(plan_code, availability):
+    had_stock = has_stock = None
+    changed = False
+    for datacenter, level in availability.items():
+        change = server_plan_index.update_availability(plan_code, datacenter, level)
+        if change is None:
+            return
+        if had_stock is None:
+            had_stock = change[0]
+        has_stock = change[1]
+        changed = changed or change[2]
+    if changed:
+        responses.bump("servers")
+    if had_stock is not None and had_stock != has_stock:
+        adjust_stat("availableServers", 1 if has_stock else -1)
+
+# 把一次查询到的可用性追加到历史记录（只记录变化）
+def record_availability(plan_code, availability, ts=None):
+    try:
+        changes = availability_store.record(plan_code, availability, ts)
+    except OSError as e:
+        add_log("WARNING", f"写入可用性历史失败: {str(e)}")
+        return
+    for datacenter, old, new in changes:
+        # 首次记录的状态不是变化，不推送
+        if old is not None:
+            events.publish("availability", {"planCode": plan_code, "datacenter": datacenter, "from": old, "to": new})
+
+# 全量重算并与增量计数器比较，报告并修正偏差
+def check_stats_consistency():
+    expected = compute_stats()
+    with stats_lock:
+        drift = {key: stats.get(key, 0) - value for key, value in expected.items() if stats.get(key, 0) != value}
+        if drift:
+            stats.update(expected)
+    if drift:
+        events.publish("stats", expected)
+        add_log("WARNING", f"统计计数器出现偏差，已按全量结果修正: {drift}")
+    return drift
+
+# 后台定期执行一致性检查
+def stats_consistency_loop():
+    while True:
+        interval = config.get("statsCheckInterval", 0)
+        if interval and interval > 0:
+            try:
+                check_stats_consistency()
+            except Exception as e:
+                add_log("ERROR", f"统计一致性检查失败: {str(e)}")
+            time.sleep(interval)
+        else:
+            time.sleep(60)
+
+def start_stats_checker():
+    thread = threading.Thread(target=stats_consistency_loop)
+    thread.daemon = True
+    thread.start()
+
+# 是否已配置OVH API凭据
+def has_api_credentials():
+    return bool(config["appKey"] and config["appSecret"] and config["consumerKey"])
 
 # Initialize OVH client
 def get_ovh_client():
-    if not config["appKey"] or not config["appSecret"] or not config["consumerKey"]:
+    if not has_api_credentials():
         add_log("ERROR", "Missing OVH API credentials")
         return None
     
@@ -226,66 +531,117 @@ def check_server_availability(plan_code):
     
     try:
         availabilities = client.get('/dedicated/server/datacenter/availabilities', planCode=plan_code)
-        result = {}
-        
-        for item in availabilities:
-            datacenters = item.get("datacenters", [])
-            
-            for dc_info in datacenters:
-                availability = dc_info.get("availability", "unknown")
-                datacenter_name = dc_info.get("datacenter")
-                
-                # 确保可用性状态有正确的值
-                if not availability or availability == "unknown":
-                    result[datacenter_name] = "unknown"
-                elif availability == "unavailable":
-                    result[datacenter_name] = "unavailable"
-                else:
-                    # 任何非"unavailable"或"unknown"的状态都被视为"available"
-                    result[datacenter_name] = availability
+        # 同一数据中心有多个FQN行，合并为一个状态：任一行有货即为有货，空状态视为 unknown
+        result = availability_history.item_levels(availabilities)
                 
         add_log("INFO", f"成功检查 {plan_code} 的可用性: {result}")
+        apply_availability(plan_code, result)
+        record_availability(plan_code, result)
         return result
     except Exception as e:
         add_log("ERROR", f"Failed to check availability for {plan_code}: {str(e)}")
         return None
 
-# Purchase server
-def purchase_server(queue_item):
-    client = get_ovh_client()
-    if not client:
-        return False
+# 队列项按偏好顺序排列的数据中心（旧版队列项只有 datacenter）
+def queue_item_datacenters(item):
+    return item.get("datacenters") or [item["datacenter"]]
+
+# 从可用性查询结果中按偏好顺序选出第一个有货的数据中心，都没货时返回None
+def pick_datacenter(candidates, availabilities):
+    in_stock = set()
+    for entry in availabilities:
+        for dc_info in entry.get("datacenters", []):
+            if availability_matrix.is_stock_level(dc_info.get("availability")):
+                in_stock.add(dc_info.get("datacenter"))
+    return next((dc for dc in candidates if dc in in_stock), None)
+
+# 更新或创建某个任务对应的抢购历史记录；datacenter 为实际下单的数据中心，quantity 为该订单的台数
+# 每个购物车一条记录（cart_id 为购物车ID），已成功的记录不会被覆盖，同一任务的下一次购买新建一条记录
+def record_purchase_history(queue_item, status, order_id, order_url, error_msg, label, datacenter=None, quantity=1, cart_id=None):
+    existing_history_entry = history_by_cart.get(cart_id) if cart_id else None
+    if existing_history_entry is None:
+        # 之前尝试中没有关联购物车的失败记录（如查询可用性失败）沿用，重试不会不断新增记录；
+        # 同一次尝试中其他购物车的记录不覆盖
+        latest = history_by_task.get(queue_item["id"])
+        if latest and not latest.get("cartId") and latest.get("attemptCount") != queue_item["retryCount"]:
+            existing_history_entry = latest
+    current_time_iso = datetime.now().isoformat()
+    datacenter = datacenter or queue_item["datacenter"]
+
+    if existing_history_entry and existing_history_entry.get("status") != "success":
+        count_status_change(HISTORY_STATUS_STATS, existing_history_entry.get("status"), status)
+        existing_history_entry["status"] = status
+        existing_history_entry["datacenter"] = datacenter
+        existing_history_entry["quantity"] = quantity
+        existing_history_entry["orderId"] = order_id
+        existing_history_entry["orderUrl"] = order_url
+        existing_history_entry["errorMessage"] = error_msg # 成功时为None，清除之前的错误
+        existing_history_entry["purchaseTime"] = current_time_iso
+        existing_history_entry["attemptCount"] = queue_item["retryCount"]
+        existing_history_entry["options"] = queue_item.get("options", [])
+        if order_id:
+            history_by_order[str(order_id)] = existing_history_entry
+        if cart_id:
+            existing_history_entry["cartId"] = cart_id
+            history_by_cart[cart_id] = existing_history_entry
+        events.publish("history_entry", {"action": "updated", "entry": existing_history_entry})
+        add_log("INFO", f"更新抢购历史({label}) 任务ID: {queue_item['id']}", "purchase")
+        return existing_history_entry
     
+    history_entry = {
+        "id": str(uuid.uuid4()),
+        "taskId": queue_item["id"],
+        "planCode": queue_item["planCode"],
+        "datacenter": datacenter,
+        "quantity": quantity,
+        "options": queue_item.get("options", []),
+        "status": status,
+        "orderId": order_id,
+        "orderUrl": order_url,
+        "errorMessage": error_msg,
+        "purchaseTime": current_time_iso,
+        "attemptCount": queue_item["retryCount"],
+        "cartId": cart_id
+    }
+    purchase_history.append(history_entry)
+    history_by_task[queue_item["id"]] = history_entry
+    if order_id:
+        history_by_order[str(order_id)] = history_entry
+    if cart_id:
+        history_by_cart[cart_id] = history_entry
+    count_status_change(HISTORY_STATUS_STATS, None, status)
+    events.publish("history_entry", {"action": "added", "entry": history_entry})
+    add_log("INFO", f"创建抢购历史({label}) 任务ID: {queue_item['id']}", "purchase")
+    return history_entry
+
+# 按单个购物车的数量上限拆分，cap 为0表示不限制
+def split_quantity(quantity, cap):
+    if quantity <= 0:
+        return []
+    if not cap or cap <= 0:
+        return [quantity]
+    return [cap] * (quantity // cap) + ([quantity % cap] if quantity % cap else [])
+
+# 创建一个包含 quantity 台服务器的购物车并结账，返回结果字典（error 为None表示成功）
+# 可能在工作线程中并行执行，只写购买日志，历史记录和队列状态由调用方在结束后统一更新
+def checkout_cart(client, queue_item, datacenter, quantity, journal_key):
     cart_id = None # Initialize cart_id to None
     item_id = None # Initialize item_id to None
+    result = {"quantity": quantity, "journalKey": journal_key, "cartId": None,
+              "orderId": None, "orderUrl": None, "error": None, "label": None}
     
     try:
-        # Check availability first
-        add_log("INFO", f"开始为 {queue_item['planCode']} 在 {queue_item['datacenter']} 的购买流程，选项: {queue_item.get('options')}", "purchase")
-        availabilities = client.get('/dedicated/server/datacenter/availabilities', planCode=queue_item["planCode"])
-        
-        found_available = False
-        for item in availabilities:
-            datacenters = item.get("datacenters", [])
-            
-            for dc_info in datacenters:
-                if dc_info.get("datacenter") == queue_item["datacenter"] and dc_info.get("availability") not in ["unavailable", "unknown"]:
-                    found_available = True
-                    break
-            
-            if found_available:
-                break
-        
-        if not found_available:
-            add_log("INFO", f"服务器 {queue_item['planCode']} 在数据中心 {queue_item['datacenter']} 当前无货", "purchase")
-            # Even if not available, we might want to record this attempt in history if it's the first one
-            # For now, returning False will prevent history update here, purchase_server is called in a loop by queue processor
-            return False
-        
         # Create cart
-        add_log("INFO", f"为区域 {config['zone']} 创建购物车", "purchase")
+        add_log("INFO", f"为区域 {config['zone']} 创建购物车 (数量: {quantity})", "purchase")
         cart_result = client.post('/order/cart', ovhSubsidiary=config["zone"])
         cart_id = cart_result["cartId"]
+        journal.record(journal_key, purchase_journal.STEP_CART_CREATED,
+                       cartId=cart_id,
+                       quantity=quantity,
+                       planCode=queue_item["planCode"],
+                       datacenter=datacenter,
+                       options=queue_item.get("options", []),
+                       retryCount=queue_item["retryCount"])
         add_log("INFO", f"购物车创建成功，ID: {cart_id}", "purchase")
         
         # Add base item to cart using /eco endpoint
@@ -294,7 +650,7 @@ def purchase_server(queue_item):
             "planCode": queue_item["planCode"],
             "pricingMode": "default",
             "duration": "P1M",  # 1 month
-            "quantity": 1
+            "quantity": quantity
         }
         item_result = client.post(f'/order/cart/{cart_id}/eco', **item_payload)
         item_id = item_result["itemId"] # This is the itemId for the base server
@@ -302,7 +658,7 @@ def purchase_server(queue_item):
         
         # Configure item (datacenter, OS, region)
         add_log("INFO", f"为项目 {item_id} 设置必需配置", "purchase")
-        dc_lower = queue_item["datacenter"].lower()
+        dc_lower = datacenter.lower()
         region = None
         EU_DATACENTERS = ['gra', 'rbx', 'sbg', 'eri', 'lim', 'waw', 'par', 'fra', 'lon']
         CANADA_DATACENTERS = ['bhs']
@@ -315,7 +671,7 @@ def purchase_server(queue_item):
         elif any(dc_lower.startswith(prefix) for prefix in APAC_DATACENTERS): region = "apac"
 
         configurations_to_set = {
-            "dedicated_datacenter": queue_item["datacenter"],
+            "dedicated_datacenter": datacenter,
             "dedicated_os": "none_64.en" 
         }
         if region:
@@ -375,7 +731,7 @@ def purchase_server(queue_item):
                                         "planCode": avail_opt_plan_code, 
                                         "duration": avail_opt.get("duration", "P1M"),
                                         "pricingMode": avail_opt.get("pricingMode", "default"),
-                                        "quantity": 1
+                                        "quantity": quantity
                                     }
                                     add_log("INFO", f"准备添加 Eco 选项: {option_payload_eco}", "purchase")
                                     client.post(f'/order/cart/{cart_id}/eco/options', **option_payload_eco)
@@ -401,6 +757,7 @@ def purchase_server(queue_item):
 
         add_log("INFO", f"绑定购物车 {cart_id}", "purchase")
         client.post(f'/order/cart/{cart_id}/assign')
+        journal.record(journal_key, purchase_journal.STEP_ASSIGNED)
         add_log("INFO", "购物车绑定成功", "purchase")
         
         add_log("INFO", f"对购物车 {cart_id} 执行结账", "purchase")
@@ -408,108 +765,24 @@ def purchase_server(queue_item):
             "autoPayWithPreferredPaymentMethod": False, 
             "waiveRetractationPeriod": True
         }
+        journal.record(journal_key, purchase_journal.STEP_CHECKOUT_ISSUED)
         checkout_result = client.post(f'/order/cart/{cart_id}/checkout', **checkout_payload)
         
         order_id_val = checkout_result.get("orderId", "")
         order_url_val = checkout_result.get("url", "")
+        journal.record(journal_key, purchase_journal.STEP_ORDER_RECEIVED, orderId=order_id_val, orderUrl=order_url_val)
         
-        # Update or create purchase history entry for SUCCESS
-        existing_history_entry = next((h for h in purchase_history if h.get("taskId") == queue_item["id"]), None)
-        current_time_iso = datetime.now().isoformat()
-
-        if existing_history_entry:
-            existing_history_entry["status"] = "success"
-            existing_history_entry["orderId"] = order_id_val
-            existing_history_entry["orderUrl"] = order_url_val
-            existing_history_entry["errorMessage"] = None # Clear previous error on success
-            existing_history_entry["purchaseTime"] = current_time_iso
-            existing_history_entry["attemptCount"] = queue_item["retryCount"]
-            existing_history_entry["options"] = queue_item.get("options", [])
-            add_log("INFO", f"更新抢购历史(成功) 任务ID: {queue_item['id']}", "purchase")
-        else:
-            history_entry = {
-                "id": str(uuid.uuid4()),
-                "taskId": queue_item["id"],
-                "planCode": queue_item["planCode"],
-                "datacenter": queue_item["datacenter"],
-                "options": queue_item.get("options", []),
-                "status": "success",
-                "orderId": order_id_val,
-                "orderUrl": order_url_val,
-                "errorMessage": None,
-                "purchaseTime": current_time_iso,
-                "attemptCount": queue_item["retryCount"]
-            }
-            purchase_history.append(history_entry)
-            add_log("INFO", f"创建抢购历史(成功) 任务ID: {queue_item['id']}", "purchase")
-        
-        save_data()
-        update_stats()
-        
-        add_log("INFO", f"成功购买 {queue_item['planCode']} 在 {queue_item['datacenter']} (订单ID: {order_id_val}, URL: {order_url_val})", "purchase")
-
-        # 发送 Telegram 成功通知
-        if config.get("tgToken") and config.get("tgChatId"):
-            success_message = (
-                f"🎉 OVH 服务器抢购成功！🎉\n\n"
-                f"服务器型号 (Plan Code): {queue_item['planCode']}\n"
-                f"数据中心: {queue_item['datacenter']}\n"
-                f"订单 ID: {order_id_val}\n"
-                f"订单链接: {order_url_val}\n"
-            )
-            options_list = queue_item.get("options", [])
-            if options_list:
-                options_str = ", ".join(options_list)
-                success_message += f"自定义配置: {options_str}\n"
-            
-            success_message += f"\n抢购任务ID: {queue_item['id']}"
-            
-            send_telegram_msg(success_message)
-            add_log("INFO", f"已为订单 {order_id_val} 发送 Telegram 成功通知。", "purchase")
-        else:
-            add_log("INFO", "未配置 Telegram Token 或 Chat ID，跳过成功通知发送。", "purchase")
-
-        return True
+        result.update(cartId=cart_id, orderId=order_id_val, orderUrl=order_url_val)
+        add_log("INFO", f"成功购买 {quantity} 台 {queue_item['planCode']} 在 {datacenter} (订单ID: {order_id_val}, URL: {order_url_val})", "purchase")
+        return result
     
     except ovh.exceptions.APIError as api_e:
         error_msg = str(api_e)
         add_log("ERROR", f"购买 {queue_item['planCode']} 时发生 OVH API 错误: {error_msg}", "purchase")
         if cart_id: add_log("ERROR", f"错误发生时的购物车ID: {cart_id}", "purchase")
         if item_id: add_log("ERROR", f"错误发生时的基础商品ID: {item_id}", "purchase")
-        
-        # Update or create purchase history entry for API FAILURE
-        existing_history_entry = next((h for h in purchase_history if h.get("taskId") == queue_item["id"]), None)
-        current_time_iso = datetime.now().isoformat()
-
-        if existing_history_entry:
-            existing_history_entry["status"] = "failed"
-            existing_history_entry["orderId"] = None
-            existing_history_entry["orderUrl"] = None
-            existing_history_entry["errorMessage"] = error_msg
-            existing_history_entry["purchaseTime"] = current_time_iso
-            existing_history_entry["attemptCount"] = queue_item["retryCount"]
-            existing_history_entry["options"] = queue_item.get("options", [])
-            add_log("INFO", f"更新抢购历史(API失败) 任务ID: {queue_item['id']}", "purchase")
-        else:
-            history_entry = {
-                "id": str(uuid.uuid4()),
-                "taskId": queue_item["id"],
-                "planCode": queue_item["planCode"],
-                "datacenter": queue_item["datacenter"],
-                "options": queue_item.get("options", []),
-                "status": "failed",
-                "orderId": None,
-                "orderUrl": None,
-                "errorMessage": error_msg,
-                "purchaseTime": current_time_iso,
-                "attemptCount": queue_item["retryCount"]
-            }
-            purchase_history.append(history_entry)
-            add_log("INFO", f"创建抢购历史(API失败) 任务ID: {queue_item['id']}", "purchase")
-
-        save_data()
-        update_stats()
-        return False
+        result.update(cartId=cart_id, error=error_msg, label="API失败")
+        return result
 
     except Exception as e:
         error_msg = str(e)
@@ -517,74 +790,171 @@ def purchase_server(queue_item):
         add_log("ERROR", f"完整错误堆栈: {traceback.format_exc()}", "purchase")
         if cart_id: add_log("ERROR", f"错误发生时的购物车ID: {cart_id}", "purchase")
         if item_id: add_log("ERROR", f"错误发生时的基础商品ID: {item_id}", "purchase")
+        result.update(cartId=cart_id, error=error_msg, label="通用失败")
+        return result
 
-        # Update or create purchase history entry for GENERAL FAILURE
-        existing_history_entry = next((h for h in purchase_history if h.get("taskId") == queue_item["id"]), None)
-        current_time_iso = datetime.now().isoformat()
-
-        if existing_history_entry:
-            existing_history_entry["status"] = "failed"
-            existing_history_entry["orderId"] = None
-            existing_history_entry["orderUrl"] = None
-            existing_history_entry["errorMessage"] = error_msg
-            existing_history_entry["purchaseTime"] = current_time_iso
-            existing_history_entry["attemptCount"] = queue_item["retryCount"]
-            existing_history_entry["options"] = queue_item.get("options", [])
-            add_log("INFO", f"更新抢购历史(通用失败) 任务ID: {queue_item['id']}", "purchase")
-        else:
-            history_entry = {
-                "id": str(uuid.uuid4()),
-                "taskId": queue_item["id"],
-                "planCode": queue_item["planCode"],
-                "datacenter": queue_item["datacenter"],
-                "options": queue_item.get("options", []),
-                "status": "failed",
-                "orderId": None,
-                "orderUrl": None,
-                "errorMessage": error_msg,
-                "purchaseTime": current_time_iso,
-                "attemptCount": queue_item["retryCount"]
-            }
-            purchase_history.append(history_entry)
-            add_log("INFO", f"创建抢购历史(通用失败) 任务ID: {queue_item['id']}", "purchase")
+# Purchase server: 在第一个有货的数据中心购买还差的数量；一个购物车放入多台，
+# 超过单个购物车的数量上限时拆成多个购物车并行下单。返回是否至少买到一台
+def purchase_server(queue_item):
+    client = get_ovh_client()
+    if not client:
+        return False
+    
+    datacenter = None # 实际下单的数据中心
+    
+    try:
+        # Check availability first: 一次查询覆盖任务的所有数据中心，按偏好顺序选第一个有货的
+        candidates = queue_item_datacenters(queue_item)
+        add_log("INFO", f"开始为 {queue_item['planCode']} 在 {', '.join(candidates)} 的购买流程，选项: {queue_item.get('options')}", "purchase")
+        availabilities = client.get('/dedicated/server/datacenter/availabilities', planCode=queue_item["planCode"])
         
+        datacenter = pick_datacenter(candidates, availabilities)
+        if not datacenter:
+            add_log("INFO", f"服务器 {queue_item['planCode']} 在数据中心 {', '.join(candidates)} 当前无货", "purchase")
+            # Even if not available, we might want to record this attempt in history if it's the first one
+            # For now, returning False will prevent history update here, purchase_server is called in a loop by queue processor
+            return False
+    except Exception as e:
+        error_msg = str(e)
+        add_log("ERROR", f"查询 {queue_item['planCode']} 的可用性时发生错误: {error_msg}", "purchase")
+        record_purchase_history(queue_item, "failed", None, None, error_msg, "通用失败", datacenter)
         save_data()
-        update_stats()
         return False
+    
+    remaining = queue_item.get("quantity", 1) - queue_item.get("fulfilledQuantity", 0)
+    carts = split_quantity(remaining, int(config.get("maxQuantityPerCart", 0) or 0))
+    if len(carts) == 1:
+        results = [checkout_cart(client, queue_item, datacenter, carts[0], queue_item["id"])]
+    else:
+        add_log("INFO", f"需要购买 {remaining} 台，拆分为 {len(carts)} 个购物车并行下单: {carts}", "purchase")
+        with ThreadPoolExecutor(max_workers=len(carts)) as pool:
+            futures = [
+                pool.submit(checkout_cart, client, queue_item, datacenter, quantity, f"{queue_item['id']}:{index}")
+                for index, quantity in enumerate(carts)
+            ]
+            results = [future.result() for future in futures]
+    
+    # 每个购物车一条历史记录；与历史记录一起保存已购数量和完成状态，避免重启后再次购买
+    fulfilled = 0
+    for result in results:
+        if result["error"] is None:
+            record_purchase_history(queue_item, "success", result["orderId"], result["orderUrl"], None, "成功",
+                                    datacenter, result["quantity"], result["cartId"])
+            fulfilled += result["quantity"]
+            # 已计入数量的订单号，回放购买日志时据此跳过，避免重复计入
+            if result["orderId"]:
+                queue_item.setdefault("creditedOrders", []).append(str(result["orderId"]))
+        else:
+            record_purchase_history(queue_item, "failed", None, None, result["error"], result["label"],
+                                    datacenter, result["quantity"], result["cartId"])
+    queue_item["fulfilledQuantity"] = queue_item.get("fulfilledQuantity", 0) + fulfilled
+    if queue_item["fulfilledQuantity"] >= queue_item.get("quantity", 1):
+        set_queue_status(queue_item, "completed")
+    elif fulfilled:
+        add_log("INFO", f"任务 {queue_item['id']} 部分成交: 本次买到 {fulfilled} 台，"
+                        f"共 {queue_item['fulfilledQuantity']}/{queue_item.get('quantity', 1)} 台，继续监控剩余数量", "purchase")
+    
+    save_data()
+    for result in results:
+        if result["cartId"]:
+            journal.finish(result["journalKey"])
+    
+    succeeded = [result for result in results if result["error"] is None]
+    if not succeeded:
+        return False
+
+    # 发送 Telegram 成功通知
+    if config.get("tgToken") and config.get("tgChatId"):
+        success_message = (
+            f"🎉 OVH 服务器抢购成功！🎉\n\n"
+            f"服务器型号 (Plan Code): {queue_item['planCode']}\n"
+            f"数据中心: {datacenter}\n"
+            f"已购买: {queue_item['fulfilledQuantity']}/{queue_item.get('quantity', 1)} 台\n"
+        )
+        for order in succeeded:
+            success_message += f"订单 ID: {order['orderId']} ({order['quantity']} 台)\n订单链接: {order['orderUrl']}\n"
+        options_list = queue_item.get("options", [])
+        if options_list:
+            options_str = ", ".join(options_list)
+            success_message += f"自定义配置: {options_str}\n"
+        
+        success_message += f"\n抢购任务ID: {queue_item['id']}"
+        
+        send_telegram_msg(success_message)
+        add_log("INFO", f"已为订单 {', '.join(str(order['orderId']) for order in succeeded)} 发送 Telegram 成功通知。", "purchase")
+    else:
+        add_log("INFO", "未配置 Telegram Token 或 Chat ID，跳过成功通知发送。", "purchase")
+
+    return True
 
 # Process queue items
 def process_queue():
     while True:
-        items_to_process = list(queue) # Create a copy to iterate over
-        for item in items_to_process:
-            if item["status"] == "running":
-                current_time = time.time()
-                last_check_time = item.get("lastCheckTime", 0)
+        try:
+            # 自适应任务中到货概率高的先检查，请求预算不足时优先获得令牌
+            items_to_process = sorted(queue.values(), key=lambda item: item.get("restockLikelihood") or 0, reverse=True)
+            for item in items_to_process:
+                if item["status"] == "running":
+                    current_time = time.time()
+                    last_check_time = item.get("lastCheckTime", 0)
                 
-                # 如果是首次尝试 (lastCheckTime为0) 或者到达重试间隔
-                if last_check_time == 0 or (current_time - last_check_time >= item["retryInterval"]):
-                    if last_check_time == 0:
-                        add_log("INFO", f"首次尝试任务 {item['id']}: {item['planCode']} 在 {item['datacenter']}", "queue")
-                    else:
-                        add_log("INFO", f"重试检查任务 {item['id']} (尝试次数: {item['retryCount'] + 1}): {item['planCode']} 在 {item['datacenter']}", "queue")
-                    
-                    # 更新检查时间和重试计数
-                    item["lastCheckTime"] = current_time
-                    item["retryCount"] += 1
-                    item["updatedAt"] = datetime.now().isoformat()
+                    datacenters = queue_item_datacenters(item)
+                    dc_label = ", ".join(datacenters)
+                
+                    # 目录快照显示该型号在任一数据中心到货后，不等重试间隔立即检查
+                    restocked = False
+                    for dc in datacenters:
+                        stock_since = server_plan_index.stock_since_time(item["planCode"], dc)
+                        if stock_since is not None and stock_since > last_check_time:
+                            restocked = True
+                            break
+                
+                    adaptive = item.get("scheduleMode") == "adaptive"
+                    interval = item["retryInterval"]
+                    if adaptive:
+                        # 一次查询覆盖所有数据中心，按到货概率最高的数据中心决定间隔
+                        interval, item["restockLikelihood"] = min(
+                            (scheduler.interval(item["planCode"], dc, item["retryInterval"], current_time) for dc in datacenters),
+                            key=lambda result: result[0]
+                        )
+                        item["pollInterval"] = interval
+                
+                    # 如果是首次尝试 (lastCheckTime为0)、到达重试间隔或刚到货
+                    if last_check_time == 0 or restocked or (current_time - last_check_time >= interval):
+                        # 自适应任务受全局请求预算限制（刚到货时不受限制）
+                        if adaptive and not restocked and not scheduler.acquire():
+                            continue
+                        if last_check_time == 0:
+                            add_log("INFO", f"首次尝试任务 {item['id']}: {item['planCode']} 在 {dc_label}", "queue")
+                        elif restocked and current_time - last_check_time < interval:
+                            add_log("INFO", f"检测到 {item['planCode']} 在 {dc_label} 中到货，立即检查任务 {item['id']}", "queue")
+                        else:
+                            add_log("INFO", f"重试检查任务 {item['id']} (尝试次数: {item['retryCount'] + 1}): {item['planCode']} 在 {dc_label}", "queue")
                     
-                    # 尝试购买
-                    if purchase_server(item):
-                        item["status"] = "completed"
+                        # 更新检查时间和重试计数
+                        item["lastCheckTime"] = current_time
+                        item["retryCount"] += 1
                         item["updatedAt"] = datetime.now().isoformat()
-                        log_message_verb = "首次尝试购买成功" if item["retryCount"] == 1 else f"重试购买成功 (尝试次数: {item['retryCount']})"
-                        add_log("INFO", f"{log_message_verb}: {item['planCode']} 在 {item['datacenter']} (ID: {item['id']})", "queue")
-                    else:
-                        log_message_verb = "首次尝试购买失败或服务器暂无货" if item["retryCount"] == 1 else f"重试购买失败或服务器仍无货 (尝试次数: {item['retryCount']})"
-                        add_log("INFO", f"{log_message_verb}: {item['planCode']} 在 {item['datacenter']} (ID: {item['id']})。将根据重试间隔再次尝试。", "queue")
                     
-                    save_data() # 保存队列状态
-                    update_stats() # 更新统计信息
+                        # 尝试购买（purchase_server 在买够数量时把任务标记为完成）
+                        if purchase_server(item):
+                            item["updatedAt"] = datetime.now().isoformat()
+                            log_message_verb = "首次尝试购买成功" if item["retryCount"] == 1 else f"重试购买成功 (尝试次数: {item['retryCount']})"
+                            add_log("INFO", f"{log_message_verb}: {item['planCode']} 在 {dc_label} (ID: {item['id']})，"
+                                            f"已购买 {item['fulfilledQuantity']}/{item.get('quantity', 1)} 台", "queue")
+                            if item["status"] == "running":
+                                # 还没买够，下一轮立即再检查，可能还有库存
+                                item["lastCheckTime"] = current_time - interval
+                        else:
+                            log_message_verb = "首次尝试购买失败或服务器暂无货" if item["retryCount"] == 1 else f"重试购买失败或服务器仍无货 (尝试次数: {item['retryCount']})"
+                            add_log("INFO", f"{log_message_verb}: {item['planCode']} 在 {dc_label} (ID: {item['id']})。将根据重试间隔再次尝试。", "queue")
+                    
+                        save_data() # 保存队列状态
+                        publish_queue_item(item)
+        except Exception as e:
+            # 单个任务出错不能让队列线程退出
+            add_log("ERROR", f"处理队列时发生错误: {str(e)}", "queue")
+            logging.error(traceback.format_exc())
         
         time.sleep(1) # 每秒检查一次队列
 
@@ -594,924 +964,174 @@ def start_queue_processor():
     thread.daemon = True
     thread.start()
 
+# 获取多个型号的可用性: 先用一次不带planCode的批量请求，
+# 批量结果中缺失的型号再用有限并发逐个查询
+def fetch_availabilities(client, plan_codes):
+    result = {}
+    wanted = set(plan_codes)
+    
+    try:
+        for item in client.get('/dedicated/server/datacenter/availabilities'):
+            plan_code = item.get("planCode")
+            if plan_code in wanted:
+                result.setdefault(plan_code, []).append(item)
+    except Exception as e:
+        add_log("WARNING", f"批量获取可用性失败，改为逐个查询: {str(e)}")
+    
+    missing = [plan_code for plan_code in plan_codes if plan_code not in result]
+    if missing:
+        workers = max(1, min(int(config.get("availabilityConcurrency", 8)), len(missing)))
+        add_log("INFO", f"批量结果中缺少 {len(missing)} 个型号的可用性，使用 {workers} 个并发逐个查询")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(client.get, '/dedicated/server/datacenter/availabilities', planCode=plan_code): plan_code
+                for plan_code in missing
+            }
+            for future in as_completed(futures):
+                plan_code = futures[future]
+                try:
+                    result[plan_code] = future.result()
+                except Exception as e:
+                    add_log("WARNING", f"获取 {plan_code} 的可用性失败: {str(e)}")
+                    result[plan_code] = []
+    
+    return result
+
+# 读取目录增量刷新状态；解析规则版本变化时丢弃
+def load_catalog_state():
+    if not os.path.exists(CATALOG_STATE_FILE):
+        return
+    try:
+        with open(CATALOG_STATE_FILE, 'r') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logging.warning(f"读取目录状态文件失败: {str(e)}")
+        return
+    if data.get("parserVersion") == hardware_parser.PARSER_VERSION:
+        catalog_state.update({
+            "zone": data.get("zone"),
+            "etag": data.get("etag"),
+            "fingerprints": data.get("fingerprints", {})
+        })
+
+def save_catalog_state():
+    with open(CATALOG_STATE_FILE, 'w') as f:
+        json.dump({"parserVersion": hardware_parser.PARSER_VERSION, **catalog_state}, f)
+
+# 读取上次保存的可用性矩阵
+def load_availability_snapshot():
+    global availability_snapshot
+    if not os.path.exists(AVAILABILITY_MATRIX_FILE):
+        return
+    try:
+        with open(AVAILABILITY_MATRIX_FILE, 'rb') as f:
+            availability_snapshot = availability_matrix.AvailabilityMatrix.from_bytes(f.read())
+    except (OSError, ValueError) as e:
+        logging.warning(f"读取可用性矩阵文件失败: {str(e)}")
+
+def save_availability_snapshot():
+    with open(AVAILABILITY_MATRIX_FILE, 'wb') as f:
+        f.write(availability_snapshot.to_bytes())
+
+# 获取目录；有ETag时发送条件请求，目录未变化时返回 (None, etag)
+# 客户端不支持raw_call或接口不支持条件请求时退回普通请求
+def fetch_catalog(client, zone, etag=None):
+    path = f'/order/catalog/public/eco?ovhSubsidiary={zone}'
+    raw_call = getattr(client, "raw_call", None)
+    if raw_call is not None:
+        try:
+            headers = {"If-None-Match": etag} if etag else None
+            response = raw_call("GET", path, need_auth=False, headers=headers)
+            if response.status_code == 304:
+                return None, etag
+            if response.status_code == 200:
+                return response.json(), response.headers.get("ETag")
+        except Exception as e:
+            add_log("WARNING", f"条件请求目录失败，改用普通请求: {str(e)}")
+    return client.get(path), None
+
 # Load server list from OVH API
 def load_server_list():
-    global config
+    global config, catalog_diff, availability_snapshot
     client = get_ovh_client()
     if not client:
         return []
     
     try:
-        # 保存完整的API原始响应
-        try:
-            # 创建一个目录来存储API数据
-            if not os.path.exists("api_data"):
-                os.makedirs("api_data")
-                
-            # 尝试获取并保存原始目录响应
-            catalog = client.get(f'/order/catalog/public/eco?ovhSubsidiary={config["zone"]}')
-            with open(os.path.join("api_data", "ovh_catalog_raw.json"), "w") as f:
-                json.dump(catalog, f, indent=2)
-            add_log("INFO", "已保存完整的API原始响应")
-        except Exception as e:
-            add_log("WARNING", f"保存API原始响应时出错: {str(e)}")
+        load_started = time.perf_counter()
+        
+        # 目录或解析规则变化后，之前的哈希和ETag不再可用
+        zone = config["zone"]
+        if catalog_state.get("zone") != zone or not server_plans:
+            catalog_state.update({"zone": zone, "etag": None, "fingerprints": {}})
+        
+        # Get server models (目录只请求一次，支持时使用条件请求)
+        phase_started = time.perf_counter()
+        catalog, etag = fetch_catalog(client, zone, catalog_state.get("etag"))
+        catalog_time = time.perf_counter() - phase_started
+        
+        # 调试采集（默认关闭，关闭时不产生任何磁盘读写）
+        capture = None
+        if config.get("debugCapture"):
+            capture = debug_capture.DebugCapture(DEBUG_CAPTURE_DIR, config.get("debugCaptureRetention", 5))
+            capture.add("zone", zone)
+            if catalog is not None:
+                capture.add("catalog", catalog)
         
-        # Get server models
-        catalog = client.get(f'/order/catalog/public/eco?ovhSubsidiary={config["zone"]}')
-        plans = []
+        # catalog为None表示目录未变化
+        catalog_plans = catalog.get("plans", []) if catalog is not None else None
         
-        # 创建一个计数器，记录硬件信息提取成功的服务器数量
+        # Get availability (一次批量请求，缺失的型号再并发单独查询)
+        phase_started = time.perf_counter()
+        if catalog_plans is not None:
+            plan_codes = [plan.get("planCode") for plan in catalog_plans if plan.get("planCode")]
+        else:
+            plan_codes = list(catalog_state["fingerprints"])
+        availabilities_by_plan = fetch_availabilities(client, plan_codes)
+        availability_time = time.perf_counter() - phase_started
+        if capture:
+            capture.add("availabilities", availabilities_by_plan)
+        
+        phase_started = time.perf_counter()
+        
+        # 只解析内容哈希变化的型号（型号较多时在进程池中分块并行），其余沿用上次结果
+        plans, fingerprints, diff = catalog_parser.refresh_catalog(
+            catalog_plans,
+            availabilities_by_plan,
+            server_plans,
+            catalog_state["fingerprints"],
+            workers=int(config.get("parseWorkers", 0)),
+            chunk_size=int(config.get("parseChunkSize", 50)),
+            parallel_threshold=int(config.get("parseParallelThreshold", 2000))
+        )
+        catalog_state.update({"etag": etag, "fingerprints": fingerprints})
+        
+        # 按 FQN × 数据中心 比较两次刷新的可用性，记录变为有货的配置
+        matrix = availability_matrix.AvailabilityMatrix.from_availabilities(availabilities_by_plan)
+        cell_changes = availability_snapshot.diff(matrix) if availability_snapshot.rows else []
+        availability_snapshot = matrix
+        diff["availabilityCells"] = [
+            {"fqn": key, "datacenter": dc, "from": old, "to": new}
+            for key, dc, old, new in cell_changes[:MAX_AVAILABILITY_CELL_CHANGES]
+        ]
+        restocked = sum(1 for _, _, old, new in cell_changes
+                        if availability_matrix.is_stock_level(new) and not availability_matrix.is_stock_level(old))
+        if cell_changes:
+            add_log("INFO", f"可用性变化 {len(cell_changes)} 项（FQN × 数据中心），其中变为有货 {restocked} 项")
+        catalog_diff = diff
+        add_log("INFO", f"目录变化: 新增 {len(diff['added'])}, 移除 {len(diff['removed'])}, "
+                       f"变更 {len(diff['changed'])}, 可用性变化 {len(diff['availabilityChanged'])}"
+                       f"{'（目录未变化，跳过解析）' if catalog_plans is None else ''}")
+        
+        # 统计硬件信息提取成功的服务器数量
         hardware_info_counter = {
-            "total": 0,
-            "cpu_success": 0,
-            "memory_success": 0,
-            "storage_success": 0,
-            "bandwidth_success": 0
+            "total": len(plans),
+            "cpu_success": sum(1 for server_info in plans if server_info["cpu"] != "N/A"),
+            "memory_success": sum(1 for server_info in plans if server_info["memory"] != "N/A"),
+            "storage_success": sum(1 for server_info in plans if server_info["storage"] != "N/A"),
+            "bandwidth_success": sum(1 for server_info in plans if server_info["bandwidth"] != "N/A")
         }
         
-        for plan in catalog.get("plans", []):
-            plan_code = plan.get("planCode")
-            if not plan_code:
-                continue
-            
-            hardware_info_counter["total"] += 1
-            
-            # Get availability
-            availabilities = client.get('/dedicated/server/datacenter/availabilities', planCode=plan_code)
-            datacenters = []
-            
-            for item in availabilities:
-                for dc in item.get("datacenters", []):
-                    datacenters.append({
-                        "datacenter": dc.get("datacenter"),
-                        "availability": dc.get("availability", "unknown")
-                    })
-            
-            # 添加数据中心的名称和区域信息
-            for dc in datacenters:
-                dc_code = dc.get("datacenter", "").lower()[:3]  # 取前三个字符作为数据中心代码
-                
-                # 根据代码设置名称和区域
-                if dc_code == "gra":
-                    dc["dcName"] = "格拉夫尼茨"
-                    dc["region"] = "法国"
-                elif dc_code == "sbg":
-                    dc["dcName"] = "斯特拉斯堡"
-                    dc["region"] = "法国"
-                elif dc_code == "rbx":
-                    dc["dcName"] = "鲁贝"
-                    dc["region"] = "法国"
-                elif dc_code == "bhs":
-                    dc["dcName"] = "博阿尔诺"
-                    dc["region"] = "加拿大"
-                elif dc_code == "hil":
-                    dc["dcName"] = "希尔斯伯勒"
-                    dc["region"] = "美国"
-                elif dc_code == "vin":
-                    dc["dcName"] = "维也纳"
-                    dc["region"] = "美国"
-                elif dc_code == "lim":
-                    dc["dcName"] = "利马索尔"
-                    dc["region"] = "塞浦路斯"
-                elif dc_code == "sgp":
-                    dc["dcName"] = "新加坡"
-                    dc["region"] = "新加坡"
-                elif dc_code == "syd":
-                    dc["dcName"] = "悉尼"
-                    dc["region"] = "澳大利亚"
-                elif dc_code == "waw":
-                    dc["dcName"] = "华沙"
-                    dc["region"] = "波兰"
-                elif dc_code == "fra":
-                    dc["dcName"] = "法兰克福"
-                    dc["region"] = "德国"
-                elif dc_code == "lon":
-                    dc["dcName"] = "伦敦"
-                    dc["region"] = "英国"
-                elif dc_code == "eri":
-                    dc["dcName"] = "厄斯沃尔"
-                    dc["region"] = "英国"
-                else:
-                    dc["dcName"] = dc.get("datacenter", "未知")
-                    dc["region"] = "未知"
-            
-            # Extract server details
-            default_options = []
-            available_options = []
-            
-            # 创建初始服务器信息对象 - 确保在解析特定字段前就已创建
-            server_info = {
-                "planCode": plan_code,
-                "name": plan.get("invoiceName", ""),
-                "description": plan.get("description", ""),
-                "cpu": "N/A",
-                "memory": "N/A",
-                "storage": "N/A",
-                "bandwidth": "N/A",
-                "vrackBandwidth": "N/A",
-                "datacenters": datacenters,
-                "defaultOptions": default_options,
-                "availableOptions": available_options
-            }
-            
-            # 保存服务器详细数据，以便于调试
-            try:
-                # 创建一个目录来存储服务器数据
-                server_data_dir = os.path.join("api_data", plan_code)
-                if not os.path.exists(server_data_dir):
-                    os.makedirs(server_data_dir)
-                
-                # 保存详细的plan数据
-                with open(os.path.join(server_data_dir, "plan_data.json"), "w") as f:
-                    json.dump(plan, f, indent=2)
-                
-                # 保存addonFamilies数据，如果存在
-                if plan.get("addonFamilies") and isinstance(plan.get("addonFamilies"), list):
-                    with open(os.path.join(server_data_dir, "addonFamilies.json"), "w") as f:
-                        json.dump(plan.get("addonFamilies"), f, indent=2)
-                
-                add_log("INFO", f"已保存服务器{plan_code}的详细数据用于调试")
-            except Exception as e:
-                add_log("WARNING", f"保存服务器详细数据时出错: {str(e)}")
-            
-            # 处理特殊系列处理逻辑
-            special_server_processed = False
-            try:
-                # 检查是否为SYSLE系列服务器
-                if "sysle" in plan_code.lower():
-                    add_log("INFO", f"检测到SYSLE系列服务器: {plan_code}")
-                    
-                    # 尝试从plan_code提取信息
-                    # 通常SYSLE的格式为"25sysle021"，可能包含CPU型号或配置信息
-                    # 根据不同型号添加更具体的CPU信息
-                    if "011" in plan_code:
-                        server_info["cpu"] = "SYSLE 011系列 (入门级服务器CPU)"
-                    elif "021" in plan_code:
-                        server_info["cpu"] = "SYSLE 021系列 (中端服务器CPU)"
-                    elif "031" in plan_code:
-                        server_info["cpu"] = "SYSLE 031系列 (高端服务器CPU)"
-                    else:
-                        server_info["cpu"] = "SYSLE系列CPU"
-                    
-                    # 获取服务器显示名称和描述，可能包含CPU信息
-                    display_name = plan.get("displayName", "")
-                    invoice_name = plan.get("invoiceName", "")
-                    description = plan.get("description", "")
-                    
-                    # 检查名称中是否包含具体CPU型号信息
-                    found_cpu = False
-                    for name in [display_name, invoice_name, description]:
-                        if not name:
-                            continue
-                            
-                        # 查找CPU型号关键词
-                        cpu_keywords = ["i7-", "i9-", "i5-", "xeon", "epyc", "ryzen"]
-                        for keyword in cpu_keywords:
-                            if keyword.lower() in name.lower():
-                                # 提取包含CPU型号的部分
-                                start_pos = name.lower().find(keyword.lower())
-                                end_pos = min(start_pos + 30, len(name))  # 提取最多30个字符
-                                cpu_info = name[start_pos:end_pos].split(",")[0].strip()
-                                server_info["cpu"] = cpu_info
-                                add_log("INFO", f"从关键词中提取SYSLE CPU型号: {cpu_info} 给 {plan_code}")
-                                found_cpu = True
-                                break
-                        
-                        if found_cpu:
-                            break
-                    
-                    # 尝试寻找更具体的信息
-                    # 保存原始数据以便分析
-                    try:
-                        with open(f"sysle_server_{plan_code}.json", "w") as f:
-                            json.dump(plan, f, indent=2)
-                        add_log("INFO", f"已保存SYSLE服务器{plan_code}的原始数据")
-                    except Exception as e:
-                        add_log("WARNING", f"保存SYSLE服务器数据时出错: {str(e)}")
-                    
-                    special_server_processed = True
-                
-                # 检查是否为SK系列服务器
-                elif "sk" in plan_code.lower():
-                    add_log("INFO", f"检测到SK系列服务器: {plan_code}")
-                    
-                    # 获取服务器显示名称和描述，可能包含CPU信息
-                    display_name = plan.get("displayName", "")
-                    invoice_name = plan.get("invoiceName", "")
-                    description = plan.get("description", "")
-                    
-                    # 检查名称中是否包含具体CPU型号信息
-                    found_cpu = False
-                    for name in [display_name, invoice_name, description]:
-                        if not name:
-                            continue
-                            
-                        # 查找典型的CPU信息格式，例如"KS-A | Intel i7-6700k"
-                        if "|" in name:
-                            parts = name.split("|")
-                            if len(parts) > 1:
-                                cpu_part = parts[1].strip()
-                                if "intel" in cpu_part.lower() or "amd" in cpu_part.lower() or "xeon" in cpu_part.lower() or "i7" in cpu_part.lower():
-                                    server_info["cpu"] = cpu_part
-                                    add_log("INFO", f"从名称中提取CPU型号: {cpu_part} 给 {plan_code}")
-                                    found_cpu = True
-                        
-                        # 直接查找CPU型号关键词
-                        cpu_keywords = ["i7-", "i9-", "i5-", "xeon", "epyc", "ryzen"]
-                        for keyword in cpu_keywords:
-                            if keyword.lower() in name.lower():
-                                # 提取包含CPU型号的部分
-                                start_pos = name.lower().find(keyword.lower())
-                                end_pos = min(start_pos + 30, len(name))  # 提取最多30个字符
-                                cpu_info = name[start_pos:end_pos].split(",")[0].strip()
-                                server_info["cpu"] = cpu_info
-                                add_log("INFO", f"从关键词中提取CPU型号: {cpu_info} 给 {plan_code}")
-                                found_cpu = True
-                                break
-                        
-                        if found_cpu:
-                            break
-                    
-                    # 如果没有找到详细的CPU型号，使用默认值
-                    if not found_cpu:
-                        server_info["cpu"] = "SK系列专用CPU"
-                    
-                    # 尝试寻找更具体的信息
-                    # 保存原始数据以便分析
-                    try:
-                        with open(f"sk_server_{plan_code}.json", "w") as f:
-                            json.dump(plan, f, indent=2)
-                        add_log("INFO", f"已保存SK服务器{plan_code}的原始数据")
-                    except Exception as e:
-                        add_log("WARNING", f"保存SK服务器数据时出错: {str(e)}")
-                    
-                    special_server_processed = True
-                
-                # 添加更多特殊系列处理...
-                
-                # 确保所有服务器都有CPU信息
-                if server_info["cpu"] == "N/A":
-                    add_log("INFO", f"服务器 {plan_code} 无法从API提取CPU信息，尝试从名称提取")
-                    
-                    # 尝试从名称中提取CPU信息
-                    display_name = plan.get("displayName", "")
-                    invoice_name = plan.get("invoiceName", "")
-                    description = plan.get("description", "")
-                    
-                    found_cpu = False
-                    for name in [display_name, invoice_name, description]:
-                        if not name:
-                            continue
-                            
-                        # 检查是否有CPU型号信息
-                        cpu_keywords = ["i7-", "i9-", "i5-", "xeon", "epyc", "ryzen", "processor", "cpu"]
-                        for keyword in cpu_keywords:
-                            if keyword.lower() in name.lower():
-                                # 提取包含CPU型号的部分
-                                start_pos = name.lower().find(keyword.lower())
-                                end_pos = min(start_pos + 30, len(name))  # 提取最多30个字符
-                                cpu_info = name[start_pos:end_pos].split(",")[0].strip()
-                                server_info["cpu"] = cpu_info
-                                add_log("INFO", f"从名称关键词中提取CPU型号: {cpu_info} 给 {plan_code}")
-                                found_cpu = True
-                                break
-                        
-                        if found_cpu:
-                            break
-                    
-                    # 如果仍然没有找到CPU信息，使用默认值
-                    if not found_cpu:
-                        if "sysle" in plan_code.lower():
-                            server_info["cpu"] = "SYSLE系列专用CPU"
-                        elif "rise" in plan_code.lower():
-                            server_info["cpu"] = "RISE系列专用CPU"
-                        elif "game" in plan_code.lower():
-                            server_info["cpu"] = "GAME系列专用CPU"
-                        else:
-                            server_info["cpu"] = "专用服务器CPU"
-            except Exception as e:
-                add_log("WARNING", f"处理特殊系列服务器时出错: {str(e)}")
-                add_log("WARNING", f"错误详情: {traceback.format_exc()}")
-                
-                # 出错时也确保有默认CPU信息
-                if server_info["cpu"] == "N/A":
-                    server_info["cpu"] = "专用服务器CPU"
-            
-            # 如果是特殊处理的服务器，记录日志
-            if special_server_processed:
-                add_log("INFO", f"已对服务器 {plan_code} 应用特殊处理逻辑")
-            
-            # 获取服务器名称和描述，确保它们不为空
-            if not server_info["name"] and plan.get("displayName"):
-                server_info["name"] = plan.get("displayName")
-            
-            if not server_info["description"] and plan.get("displayName"):
-                server_info["description"] = plan.get("displayName")
-            
-            # 尝试从服务器名称标签中提取CPU信息
-            # 例如"KS-A | Intel i7-6700k"格式
-            if server_info["cpu"] == "N/A" or "系列" in server_info["cpu"]:
-                try:
-                    display_name = plan.get("displayName", "")
-                    invoice_name = plan.get("invoiceName", "")
-                    
-                    for name in [display_name, invoice_name]:
-                        if not name or "|" not in name:
-                            continue
-                            
-                        parts = name.split("|")
-                        if len(parts) > 1:
-                            cpu_part = parts[1].strip()
-                            if "intel" in cpu_part.lower() or "amd" in cpu_part.lower() or "xeon" in cpu_part.lower() or "i7" in cpu_part.lower():
-                                server_info["cpu"] = cpu_part
-                                add_log("INFO", f"从服务器名称标签中提取CPU: {cpu_part} 给 {plan_code}")
-                                break
-                except Exception as e:
-                    add_log("WARNING", f"从名称提取CPU时出错: {str(e)}")
-            
-            # 获取推荐配置和可选配置 - 使用多种方法处理不同格式
-            try:
-                # 方法 1: 检查plan.default.options
-                if plan.get("default") and isinstance(plan.get("default"), dict) and plan.get("default").get("options"):
-                    for default_opt in plan.get("default").get("options"):
-                        if isinstance(default_opt, dict):
-                            option_code = default_opt.get("planCode")
-                            option_name = default_opt.get("description", option_code)
-                            
-                            if option_code:
-                                default_options.append({
-                                    "label": option_name,
-                                    "value": option_code
-                                })
-                
-                # 方法 2: 检查plan.addons
-                if plan.get("addons") and isinstance(plan.get("addons"), list):
-                    for addon in plan.get("addons"):
-                        if not isinstance(addon, dict):
-                            continue
-                            
-                        addon_plan_code = addon.get("planCode")
-                        if not addon_plan_code:
-                            continue
-                        
-                        # 跳过已经在默认选项中的配置
-                        if any(opt["value"] == addon_plan_code for opt in default_options):
-                            continue
-                        
-                        # 添加到可选配置列表
-                        available_options.append({
-                            "label": addon.get("description", addon_plan_code),
-                            "value": addon_plan_code
-                        })
-                
-                # 方法 3: 检查plan.product.options
-                if plan.get("product") and isinstance(plan.get("product"), dict) and plan.get("product").get("options"):
-                    product_options = plan.get("product").get("options")
-                    if isinstance(product_options, list):
-                        for product_opt in product_options:
-                            if not isinstance(product_opt, dict):
-                                continue
-                                
-                            option_code = product_opt.get("planCode")
-                            option_name = product_opt.get("description", option_code)
-                            
-                            if option_code and not any(opt["value"] == option_code for opt in available_options) and not any(opt["value"] == option_code for opt in default_options):
-                                available_options.append({
-                                    "label": option_name,
-                                    "value": option_code
-                                })
-                
-                # 方法 4: 尝试从plan.addonFamilies中提取硬件信息
-                printed_example = False
-                try:
-                    if plan.get("addonFamilies") and isinstance(plan.get("addonFamilies"), list):
-                        # 尝试保存完整的addonFamilies数据用于更深入分析
-                        try:
-                            with open(f"addonFamilies_{plan_code}.json", "w") as f:
-                                json.dump(plan.get("addonFamilies"), f, indent=2)
-                            add_log("INFO", f"已保存服务器 {plan_code} 的addonFamilies数据")
-                        except Exception as e:
-                            add_log("WARNING", f"保存addonFamilies数据时出错: {str(e)}")
-                        
-                        # 打印一个完整的addonFamilies示例用于调试
-                        if len(plan.get("addonFamilies")) > 0 and not printed_example:
-                            try:
-                                add_log("INFO", f"addonFamilies示例: {json.dumps(plan.get('addonFamilies')[0], indent=2)}")
-                                printed_example = True
-                            except Exception as e:
-                                add_log("WARNING", f"无法序列化addonFamilies示例: {str(e)}")
-                        
-                        # 尝试保存所有带宽相关的选项用于调试
-                        try:
-                            bandwidth_options = []
-                            for family in plan.get("addonFamilies"):
-                                family_name = family.get("name", "").lower()
-                                if ("bandwidth" in family_name or "traffic" in family_name or "network" in family_name):
-                                    bandwidth_options.append({
-                                        "family": family.get("name"),
-                                        "default": family.get("default"),
-                                        "addons": family.get("addons")
-                                    })
-                            
-                            if bandwidth_options:
-                                with open(f"bandwidth_options_{plan_code}.json", "w") as f:
-                                    json.dump(bandwidth_options, f, indent=2)
-                                add_log("INFO", f"已保存{plan_code}的带宽选项到bandwidth_options_{plan_code}.json")
-                        except Exception as e:
-                            add_log("WARNING", f"保存带宽选项时出错: {str(e)}")
-                        
-                        # 重置可选配置列表
-                        temp_available_options = []
-                        
-                        # 提取addonFamilies信息
-                        for family in plan.get("addonFamilies"):
-                            if not isinstance(family, dict):
-                                add_log("WARNING", f"addonFamily不是字典类型: {family}")
-                                continue
-                                
-                            family_name = family.get("name", "").lower()  # 注意: 在API响应中是'name'而不是'family'
-                            default_addon = family.get("default")  # 获取默认选项
-                            
-                            # 提取可选配置
-                            if family.get("addons") and isinstance(family.get("addons"), list):
-                                for addon_code in family.get("addons"):
-                                    # 在API响应中，addons是字符串数组而不是对象数组
-                                    if not isinstance(addon_code, str):
-                                        continue
-                            
-                                    # 标记是否为默认选项
-                                    is_default = (addon_code == default_addon)
-                                    
-                                    # 从addon_code解析描述信息
-                                    addon_desc = addon_code
-                                    
-                                    # 过滤掉许可证相关选项
-                                    if (
-                                        # Windows许可证
-                                        "windows-server" in addon_code.lower() or
-                                        # SQL Server许可证
-                                        "sql-server" in addon_code.lower() or
-                                        # cPanel许可证
-                                        "cpanel-license" in addon_code.lower() or
-                                        # Plesk许可证
-                                        "plesk-" in addon_code.lower() or
-                                        # 其他常见许可证
-                                        "-license-" in addon_code.lower() or
-                                        # 操作系统选项
-                                        addon_code.lower().startswith("os-") or
-                                        # 控制面板
-                                        "control-panel" in addon_code.lower() or
-                                        "panel" in addon_code.lower()
-                                    ):
-                                        # 跳过许可证类选项
-                                        continue
-                            
-                                    if addon_code:
-                                        temp_available_options.append({
-                                            "label": addon_desc,
-                                            "value": addon_code,
-                                            "family": family_name,
-                                            "isDefault": is_default
-                                        })
-                                        
-                                        # 如果是默认选项，添加到默认选项列表
-                                        if is_default:
-                                            default_options.append({
-                                                "label": addon_desc,
-                                                "value": addon_code
-                                            })
-                            
-                            # 根据family名称设置对应的硬件信息
-                            if family_name and family.get("addons") and isinstance(family.get("addons"), list):
-                                # 获取默认选项的值
-                                default_value = family.get("default")
-                                
-                                # CPU信息
-                                if ("cpu" in family_name or "processor" in family_name) and server_info["cpu"] == "N/A":
-                                    if default_value:
-                                        server_info["cpu"] = default_value
-                                        add_log("INFO", f"从addonFamilies默认选项提取CPU: {default_value} 给 {plan_code}")
-                                        
-                                        # 尝试从CPU选项中提取更详细信息
-                                        try:
-                                            # 记录CPU选项的完整列表，方便调试
-                                            if family.get("addons") and isinstance(family.get("addons"), list):
-                                                cpu_options = []
-                                                for cpu_addon in family.get("addons"):
-                                                    if isinstance(cpu_addon, str):
-                                                        cpu_options.append(cpu_addon)
-                                                
-                                                if cpu_options:
-                                                    add_log("INFO", f"服务器 {plan_code} 的CPU选项: {', '.join(cpu_options)}")
-                                                    
-                                                    # 保存到文件以便更详细分析
-                                                    try:
-                                                        with open(f"cpu_options_{plan_code}.json", "w") as f:
-                                                            json.dump({"options": cpu_options, "default": default_value}, f, indent=2)
-                                                    except Exception as e:
-                                                        add_log("WARNING", f"保存CPU选项时出错: {str(e)}")
-                                        except Exception as e:
-                                            add_log("WARNING", f"解析CPU选项时出错: {str(e)}")
-                                
-                                # 内存信息
-                                elif ("memory" in family_name or "ram" in family_name) and server_info["memory"] == "N/A":
-                                    if default_value:
-                                        # 尝试提取内存大小
-                                        ram_size = ""
-                                        ram_match = re.search(r'ram-(\d+)g', default_value, re.IGNORECASE)
-                                        if ram_match:
-                                            ram_size = f"{ram_match.group(1)} GB"
-                                            server_info["memory"] = ram_size
-                                            add_log("INFO", f"从addonFamilies默认选项提取内存: {ram_size} 给 {plan_code}")
-                                        else:
-                                            server_info["memory"] = default_value
-                                            add_log("INFO", f"从addonFamilies默认选项提取内存(原始值): {default_value} 给 {plan_code}")
-                                
-                                # 存储信息
-                                elif ("storage" in family_name or "disk" in family_name or "drive" in family_name or "ssd" in family_name or "hdd" in family_name) and server_info["storage"] == "N/A":
-                                    if default_value:
-                                        # 尝试匹配混合RAID格式
-                                        hybrid_storage_match = re.search(r'hybridsoftraid-(\d+)x(\d+)(sa|ssd|hdd)-(\d+)x(\d+)(nvme|ssd|hdd)', default_value, re.IGNORECASE)
-                                        if hybrid_storage_match:
-                                            count1 = hybrid_storage_match.group(1)
-                                            size1 = hybrid_storage_match.group(2)
-                                            type1 = hybrid_storage_match.group(3).upper()
-                                            count2 = hybrid_storage_match.group(4)
-                                            size2 = hybrid_storage_match.group(5)
-                                            type2 = hybrid_storage_match.group(6).upper()
-                                            server_info["storage"] = f"混合RAID {count1}x {size1}GB {type1} + {count2}x {size2}GB {type2}"
-                                            add_log("INFO", f"从addonFamilies默认选项提取混合存储: {server_info['storage']} 给 {plan_code}")
-                                        else:
-                                            # 尝试从存储代码中提取信息
-                                            storage_match = re.search(r'(raid|softraid)-(\d+)x(\d+)(ssd|hdd|nvme|sa)', default_value, re.IGNORECASE)
-                                            if storage_match:
-                                                raid_type = storage_match.group(1).upper()
-                                                count = storage_match.group(2)
-                                                size = storage_match.group(3)
-                                                type_str = storage_match.group(4).upper()
-                                                server_info["storage"] = f"{raid_type} {count}x {size}GB {type_str}"
-                                                add_log("INFO", f"从addonFamilies默认选项提取存储: {server_info['storage']} 给 {plan_code}")
-                                            else:
-                                                server_info["storage"] = default_value
-                                                add_log("INFO", f"从addonFamilies默认选项提取存储(原始值): {default_value} 给 {plan_code}")
-                                
-                                # 带宽信息
-                                elif ("bandwidth" in family_name or "traffic" in family_name or "network" in family_name) and server_info["bandwidth"] == "N/A":
-                                    if default_value:
-                                        add_log("DEBUG", f"处理带宽选项: {default_value}")
-                                        
-                                        # 格式1: traffic-5tb-100-24sk-apac (带宽限制和流量限制)
-                                        traffic_bw_match = re.search(r'traffic-(\d+)(tb|gb|mb)-(\d+)', default_value, re.IGNORECASE)
-                                        if traffic_bw_match:
-                                            size = traffic_bw_match.group(1)
-                                            unit = traffic_bw_match.group(2).upper()
-                                            bw_value = traffic_bw_match.group(3)
-                                            server_info["bandwidth"] = f"{bw_value} Mbps / {size} {unit}流量"
-                                            add_log("INFO", f"从addonFamilies默认选项提取带宽和流量: {server_info['bandwidth']} 给 {plan_code}")
-                                        
-                                        # 格式2: traffic-5tb (仅流量限制)
-                                        elif re.search(r'traffic-(\d+)(tb|gb|mb)$', default_value, re.IGNORECASE):
-                                            simple_traffic_match = re.search(r'traffic-(\d+)(tb|gb|mb)', default_value, re.IGNORECASE)
-                                            size = simple_traffic_match.group(1)
-                                            unit = simple_traffic_match.group(2).upper()
-                                            server_info["bandwidth"] = f"{size} {unit}流量"
-                                            add_log("INFO", f"从addonFamilies默认选项提取流量: {server_info['bandwidth']} 给 {plan_code}")
-                                        
-                                        # 格式3: bandwidth-100 (仅带宽限制)
-                                        elif re.search(r'bandwidth-(\d+)', default_value, re.IGNORECASE):
-                                            bandwidth_match = re.search(r'bandwidth-(\d+)', default_value, re.IGNORECASE)
-                                            bw_value = int(bandwidth_match.group(1))
-                                            if bw_value >= 1000:
-                                                server_info["bandwidth"] = f"{bw_value/1000:.1f} Gbps".replace(".0 ", " ")
-                                            else:
-                                                server_info["bandwidth"] = f"{bw_value} Mbps"
-                                            add_log("INFO", f"从addonFamilies默认选项提取带宽: {server_info['bandwidth']} 给 {plan_code}")
-                                        
-                                        # 格式4: traffic-unlimited (无限流量)
-                                        elif "traffic-unlimited" in default_value.lower() or "unlimited" in default_value.lower():
-                                            # 检查是否有带宽限制
-                                            bw_match = re.search(r'(\d+)', default_value)
-                                            if bw_match:
-                                                bw_value = int(bw_match.group(1))
-                                                server_info["bandwidth"] = f"{bw_value} Mbps / 无限流量"
-                                            else:
-                                                server_info["bandwidth"] = "无限流量"
-                                            add_log("INFO", f"从addonFamilies默认选项提取带宽: {server_info['bandwidth']} 给 {plan_code}")
-                                        
-                                        # 格式5: bandwidth-guarantee (保证带宽)
-                                        elif "guarantee" in default_value.lower() or "guaranteed" in default_value.lower():
-                                            bw_guarantee_match = re.search(r'(\d+)', default_value)
-                                            if bw_guarantee_match:
-                                                bw_value = int(bw_guarantee_match.group(1))
-                                                server_info["bandwidth"] = f"{bw_value} Mbps (保证带宽)"
-                                                add_log("INFO", f"从addonFamilies默认选项提取保证带宽: {server_info['bandwidth']} 给 {plan_code}")
-                                            else:
-                                                server_info["bandwidth"] = "保证带宽"
-                                                add_log("INFO", f"从addonFamilies默认选项提取保证带宽(无具体值) 给 {plan_code}")
-                                        
-                                        # 格式6: vrack-bandwidth (内部网络带宽)
-                                        elif "vrack" in default_value.lower():
-                                            vrack_bw_match = re.search(r'vrack-bandwidth-(\d+)', default_value, re.IGNORECASE)
-                                            if vrack_bw_match:
-                                                bw_value = int(vrack_bw_match.group(1))
-                                                if bw_value >= 1000:
-                                                    server_info["vrackBandwidth"] = f"{bw_value/1000:.1f} Gbps".replace(".0 ", " ")
-                                                else:
-                                                    server_info["vrackBandwidth"] = f"{bw_value} Mbps"
-                                                add_log("INFO", f"从addonFamilies默认选项提取内部网络带宽: {server_info['vrackBandwidth']} 给 {plan_code}")
-                                        
-                                        # 无法识别的格式，使用原始值
-                                        else:
-                                            server_info["bandwidth"] = default_value
-                                            add_log("INFO", f"从addonFamilies默认选项提取带宽(原始值): {default_value} 给 {plan_code}")
-                        
-                        # 将处理好的可选配置添加到服务器信息中
-                        if temp_available_options:
-                            available_options = temp_available_options
-                
-                except Exception as e:
-                    add_log("ERROR", f"解析addonFamilies时出错: {str(e)}")
-                    add_log("ERROR", f"错误详情: {traceback.format_exc()}")
-                
-                # 方法 5: 检查plan.pricings中的配置项
-                if plan.get("pricings") and isinstance(plan.get("pricings"), dict):
-                    for pricing_key, pricing_value in plan.get("pricings").items():
-                        if isinstance(pricing_value, dict) and pricing_value.get("options"):
-                            for option_code, option_details in pricing_value.get("options").items():
-                                # 跳过已经在其他列表中的项目
-                                if any(opt["value"] == option_code for opt in default_options) or any(opt["value"] == option_code for opt in available_options):
-                                    continue
-                                
-                                option_label = option_code
-                                if isinstance(option_details, dict) and option_details.get("description"):
-                                    option_label = option_details.get("description")
-                                
-                                available_options.append({
-                                    "label": option_label,
-                                    "value": option_code
-                                })
-                
-                # 记录找到的选项数量
-                add_log("INFO", f"找到 {len(default_options)} 个默认选项和 {len(available_options)} 个可选配置用于 {plan_code}")
-                
-            except Exception as e:
-                add_log("WARNING", f"解析 {plan_code} 选项时出错: {str(e)}")
-            
-            # 解析方法 1: 尝试从properties中提取硬件详情
-            try:
-                if plan.get("details") and plan.get("details").get("properties"):
-                    for prop in plan.get("details").get("properties"):
-                        # 添加类型检查，确保prop是字典类型
-                        if not isinstance(prop, dict):
-                            add_log("WARNING", f"属性项不是字典类型: {prop}")
-                            continue
-                            
-                        prop_name = prop.get("name", "").lower()
-                        value = prop.get("value", "N/A")
-                        
-                        if value and value != "N/A":
-                            if any(cpu_term in prop_name for cpu_term in ["cpu", "processor"]):
-                                server_info["cpu"] = value
-                                add_log("INFO", f"从properties提取CPU: {value} 给 {plan_code}")
-                            elif any(mem_term in prop_name for mem_term in ["memory", "ram"]):
-                                server_info["memory"] = value
-                                add_log("INFO", f"从properties提取内存: {value} 给 {plan_code}")
-                            elif any(storage_term in prop_name for storage_term in ["storage", "disk", "hdd", "ssd"]):
-                                server_info["storage"] = value
-                                add_log("INFO", f"从properties提取存储: {value} 给 {plan_code}")
-                            elif "bandwidth" in prop_name:
-                                if any(private_term in prop_name for private_term in ["vrack", "private", "internal"]):
-                                    server_info["vrackBandwidth"] = value
-                                    add_log("INFO", f"从properties提取vRack带宽: {value} 给 {plan_code}")
-                                else:
-                                    server_info["bandwidth"] = value
-                                    add_log("INFO", f"从properties提取带宽: {value} 给 {plan_code}")
-            except Exception as e:
-                add_log("WARNING", f"解析 {plan_code} 属性时出错: {str(e)}")
-            
-            # 解析方法 2: 尝试从名称中提取信息
-            try:
-                server_name = server_info["name"]
-                server_desc = server_info["description"] if server_info["description"] else ""
-                
-                # 保存原始数据用于调试
-                try:
-                    with open(f"server_details_{plan_code}.json", "w") as f:
-                        json.dump({
-                            "name": server_name,
-                            "description": server_desc,
-                            "planCode": plan_code
-                        }, f, indent=2)
-                except Exception as e:
-                    add_log("WARNING", f"保存服务器详情时出错: {str(e)}")
-                
-                # 检查是否为KS/RISE系列服务器，它们通常使用 "KS-XX | CPU信息" 格式
-                if "|" in server_name:
-                    parts = server_name.split("|")
-                    if len(parts) > 1 and server_info["cpu"] == "N/A":
-                        cpu_part = parts[1].strip()
-                        server_info["cpu"] = cpu_part
-                        add_log("INFO", f"从服务器名称提取CPU: {cpu_part} 给 {plan_code}")
-                        
-                        # 尝试从CPU部分提取更多信息
-                        if "core" in cpu_part.lower():
-                            # 例如: "4 Core, 8 Thread, xxxx"
-                            core_parts = cpu_part.split(",")
-                            if len(core_parts) > 1:
-                                server_info["cpu"] = core_parts[0].strip()
-                
-                # 提取CPU型号信息
-                if server_info["cpu"] == "N/A":
-                    # 尝试匹配常见的CPU关键词
-                    cpu_keywords = ["i7-", "i9-", "ryzen", "xeon", "epyc", "cpu", "intel", "amd", "processor"]
-                    full_text = f"{server_name} {server_desc}".lower()
-                    
-                    for keyword in cpu_keywords:
-                        if keyword in full_text.lower():
-                            # 找到关键词的位置
-                            pos = full_text.lower().find(keyword)
-                            if pos >= 0:
-                                # 提取关键词周围的文本
-                                start = max(0, pos - 5)
-                                end = min(len(full_text), pos + 25)
-                                cpu_text = full_text[start:end]
-                                
-                                # 尝试清理提取的文本
-                                cpu_text = re.sub(r'[^\w\s\-,.]', ' ', cpu_text)
-                                cpu_text = ' '.join(cpu_text.split())
-                                
-                                if cpu_text:
-                                    server_info["cpu"] = cpu_text
-                                    add_log("INFO", f"从文本中提取CPU关键字: {cpu_text} 给 {plan_code}")
-                                    break
-                
-                # 从服务器名称中提取内存信息
-                if server_info["memory"] == "N/A":
-                    # 寻找内存关键词
-                    mem_match = None
-                    mem_patterns = [
-                        r'(\d+)\s*GB\s*RAM', 
-                        r'RAM\s*(\d+)\s*GB',
-                        r'(\d+)\s*G\s*RAM',
-                        r'RAM\s*(\d+)\s*G',
-                        r'(\d+)\s*GB'
-                    ]
-                    
-                    full_text = f"{server_name} {server_desc}"
-                    for pattern in mem_patterns:
-                        match = re.search(pattern, full_text, re.IGNORECASE)
-                        if match:
-                            mem_match = match
-                            break
-                    
-                    if mem_match:
-                        memory_size = mem_match.group(1)
-                        server_info["memory"] = f"{memory_size} GB"
-                        add_log("INFO", f"从文本中提取内存: {server_info['memory']} 给 {plan_code}")
-                
-                # 从服务器名称中提取存储信息
-                if server_info["storage"] == "N/A":
-                    # 寻找存储关键词
-                    storage_patterns = [
-                        r'(\d+)\s*[xX]\s*(\d+)\s*GB\s*(SSD|HDD|NVMe)',
-                        r'(\d+)\s*(SSD|HDD|NVMe)\s*(\d+)\s*GB',
-                        r'(\d+)\s*TB\s*(SSD|HDD|NVMe)',
-                        r'(\d+)\s*(SSD|HDD|NVMe)'
-                    ]
-                    
-                    full_text = f"{server_name} {server_desc}"
-                    for pattern in storage_patterns:
-                        match = re.search(pattern, full_text, re.IGNORECASE)
-                        if match:
-                            if match.lastindex == 3:  # 匹配了第一种模式
-                                count = match.group(1)
-                                size = match.group(2)
-                                disk_type = match.group(3).upper()
-                                server_info["storage"] = f"{count}x {size}GB {disk_type}"
-                            elif match.lastindex == 2:  # 匹配了最后一种模式
-                                size = match.group(1)
-                                disk_type = match.group(2).upper()
-                                server_info["storage"] = f"{size} {disk_type}"
-                            
-                            add_log("INFO", f"从文本中提取存储: {server_info['storage']} 给 {plan_code}")
-                            break
-            except Exception as e:
-                add_log("WARNING", f"解析 {plan_code} 服务器名称时出错: {str(e)}")
-                add_log("WARNING", f"错误详情: {traceback.format_exc()}")
-            
-            # 解析方法 3: 尝试从产品配置中提取信息
-            try:
-                if plan.get("product") and isinstance(plan.get("product"), dict) and plan.get("product").get("configurations"):
-                    configs = plan.get("product").get("configurations")
-                    if not isinstance(configs, list):
-                        add_log("WARNING", f"产品配置不是列表类型: {configs}")
-                        configs = []
-                        
-                    for config in configs:
-                        # 添加类型检查，确保config是字典类型
-                        if not isinstance(config, dict):
-                            add_log("WARNING", f"产品配置项不是字典类型: {config}")
-                            continue
-                            
-                        config_name = config.get("name", "").lower()
-                        value = config.get("value")
-                        
-                        if value:
-                            if any(cpu_term in config_name for cpu_term in ["cpu", "processor"]):
-                                server_info["cpu"] = value
-                                add_log("INFO", f"从产品配置提取CPU: {value} 给 {plan_code}")
-                            elif any(mem_term in config_name for mem_term in ["memory", "ram"]):
-                                server_info["memory"] = value
-                                add_log("INFO", f"从产品配置提取内存: {value} 给 {plan_code}")
-                            elif any(storage_term in config_name for storage_term in ["storage", "disk", "hdd", "ssd"]):
-                                server_info["storage"] = value
-                                add_log("INFO", f"从产品配置提取存储: {value} 给 {plan_code}")
-                            elif "bandwidth" in config_name:
-                                server_info["bandwidth"] = value
-                                add_log("INFO", f"从产品配置提取带宽: {value} 给 {plan_code}")
-            except Exception as e:
-                add_log("WARNING", f"解析 {plan_code} 产品配置时出错: {str(e)}")
-                add_log("WARNING", f"错误详情: {traceback.format_exc()}")
-            
-            # 解析方法 4: 尝试从description解析信息
-            try:
-                description = plan.get("description", "")
-                if description:
-                    parts = description.split(",")
-                    for part in parts:
-                        part = part.strip().lower()
-                        
-                        # 检查每个部分是否包含硬件信息
-                        if server_info["cpu"] == "N/A" and any(cpu_term in part for cpu_term in ["cpu", "core", "i7", "i9", "xeon", "epyc", "ryzen"]):
-                            server_info["cpu"] = part
-                            add_log("INFO", f"从描述提取CPU: {part} 给 {plan_code}")
-                            
-                        if server_info["memory"] == "N/A" and any(mem_term in part for mem_term in ["ram", "gb", "memory"]):
-                            server_info["memory"] = part
-                            add_log("INFO", f"从描述提取内存: {part} 给 {plan_code}")
-                            
-                        if server_info["storage"] == "N/A" and any(storage_term in part for storage_term in ["hdd", "ssd", "nvme", "storage", "disk"]):
-                            server_info["storage"] = part
-                            add_log("INFO", f"从描述提取存储: {part} 给 {plan_code}")
-                            
-                        if server_info["bandwidth"] == "N/A" and "bandwidth" in part:
-                            server_info["bandwidth"] = part
-                            add_log("INFO", f"从描述提取带宽: {part} 给 {plan_code}")
-            except Exception as e:
-                add_log("WARNING", f"解析 {plan_code} 描述时出错: {str(e)}")
-            
-            # 解析方法 5: 从pricing获取信息
-            try:
-                if plan.get("pricing") and isinstance(plan.get("pricing"), dict) and plan.get("pricing").get("configurations"):
-                    pricing_configs = plan.get("pricing").get("configurations")
-                    if not isinstance(pricing_configs, list):
-                        add_log("WARNING", f"价格配置不是列表类型: {pricing_configs}")
-                        pricing_configs = []
-                        
-                    for price_config in pricing_configs:
-                        # 添加类型检查，确保price_config是字典类型
-                        if not isinstance(price_config, dict):
-                            add_log("WARNING", f"价格配置项不是字典类型: {price_config}")
-                            continue
-                            
-                        config_name = price_config.get("name", "").lower()
-                        value = price_config.get("value")
-                        
-                        if value:
-                            if "processor" in config_name and server_info["cpu"] == "N/A":
-                                server_info["cpu"] = value
-                                add_log("INFO", f"从pricing配置提取CPU: {value} 给 {plan_code}")
-                            elif "memory" in config_name and server_info["memory"] == "N/A":
-                                server_info["memory"] = value
-                                add_log("INFO", f"从pricing配置提取内存: {value} 给 {plan_code}")
-                            elif "storage" in config_name and server_info["storage"] == "N/A":
-                                server_info["storage"] = value
-                                add_log("INFO", f"从pricing配置提取存储: {value} 给 {plan_code}")
-            except Exception as e:
-                add_log("WARNING", f"解析 {plan_code} pricing配置时出错: {str(e)}")
-                add_log("WARNING", f"错误详情: {traceback.format_exc()}")
-            
-            # 清理提取的数据以确保格式一致
-            # 对于CPU，添加一些基本信息如果只有核心数
-            if server_info["cpu"] != "N/A" and server_info["cpu"].isdigit():
-                server_info["cpu"] = f"{server_info['cpu']} 核心"
-            
-            # 更新服务器信息中的配置选项
-            server_info["defaultOptions"] = default_options
-            server_info["availableOptions"] = available_options
-            
-            # 更新硬件信息计数器
-            if server_info["cpu"] != "N/A":
-                hardware_info_counter["cpu_success"] += 1
-            if server_info["memory"] != "N/A":
-                hardware_info_counter["memory_success"] += 1
-            if server_info["storage"] != "N/A":
-                hardware_info_counter["storage_success"] += 1
-            if server_info["bandwidth"] != "N/A":
-                hardware_info_counter["bandwidth_success"] += 1
-            
-            plans.append(server_info)
-        
         # 记录硬件信息提取的成功率
         total = hardware_info_counter["total"]
         if total > 0:
@@ -1523,6 +1143,27 @@ def load_server_list():
             add_log("INFO", f"服务器硬件信息提取成功率: CPU={cpu_rate:.1f}%, 内存={memory_rate:.1f}%, "
                            f"存储={storage_rate:.1f}%, 带宽={bandwidth_rate:.1f}%")
         
+        parse_time = time.perf_counter() - phase_started
+        
+        # 保存新增的硬件选项代码解析结果和目录增量刷新状态
+        try:
+            hardware_parser.addon_cache.save(HARDWARE_CACHE_FILE)
+            save_catalog_state()
+            save_availability_snapshot()
+        except OSError as e:
+            add_log("WARNING", f"保存目录解析缓存失败: {str(e)}")
+        
+        refreshed_at = time.time()
+        for server_info in plans:
+            levels = availability_history.best_levels((dc["datacenter"], dc["availability"]) for dc in server_info["datacenters"])
+            record_availability(server_info["planCode"], levels, refreshed_at)
+        
+        if capture:
+            capture.add("servers", plans)
+            capture.write_in_background()
+        add_log("INFO", f"服务器列表加载完成，共 {len(plans)} 个型号，耗时 {time.perf_counter() - load_started:.2f}s "
+                       f"(目录 {catalog_time:.2f}s, 可用性 {availability_time:.2f}s, 解析 {parse_time:.2f}s)")
+        
         return plans
     except Exception as e:
         add_log("ERROR", f"Failed to load server list: {str(e)}")
@@ -1617,7 +1258,56 @@ def send_telegram_msg(message: str):
         add_log("ERROR", f"错误详情: {traceback.format_exc()}")
         return False
 
+# 返回缓存的JSON响应：ETag未变化时返回304，按Accept-Encoding返回压缩后的内容
+def cached_json_response(collection, build, key=""):
+    entry = responses.get(collection, build, key)
+    if response_cache.etag_matches(request.headers.get("If-None-Match"), entry.etag):
+        response = Response(status=304)
+    else:
+        encoding = response_cache.choose_encoding(request.headers.get("Accept-Encoding"), len(entry.body))
+        response = Response(entry.encoded(encoding), mimetype="application/json")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = entry.etag
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
 # Routes
+# 后台刷新：加载服务器列表并替换快照，失败时保留上一次成功的数据
+def refresh_server_list():
+    global server_plans
+    if not has_api_credentials():
+        return False
+    
+    add_log("INFO", "正在从OVH API重新加载服务器列表...")
+    api_servers = load_server_list()
+    if not api_servers:
+        add_log("WARNING", "从OVH API加载服务器列表失败")
+        return False
+    
+    server_plans = api_servers
+    save_data()
+    rebuild_server_index()
+    count_server_plans()
+    events.publish("servers_refreshed", {"total": len(server_plans)})
+    add_log("INFO", f"从OVH API加载了 {len(server_plans)} 台服务器")
+    
+    # 记录硬件信息统计
+    cpu_count = sum(1 for s in server_plans if s["cpu"] != "N/A")
+    memory_count = sum(1 for s in server_plans if s["memory"] != "N/A")
+    storage_count = sum(1 for s in server_plans if s["storage"] != "N/A")
+    bandwidth_count = sum(1 for s in server_plans if s["bandwidth"] != "N/A")
+    
+    add_log("INFO", f"服务器硬件信息统计: CPU={cpu_count}/{len(server_plans)}, 内存={memory_count}/{len(server_plans)}, "
+           f"存储={storage_count}/{len(server_plans)}, 带宽={bandwidth_count}/{len(server_plans)}")
+    return True
+
+server_refresher = catalog_refresher.CatalogRefresher(
+    refresh_server_list,
+    interval=lambda: int(config.get("catalogRefreshInterval", 1800))
+)
+
 @app.route('/api/settings', methods=['GET'])
 def get_settings():
     return jsonify(config)
@@ -1631,8 +1321,8 @@ def save_settings():
     prev_tg_token = config.get("tgToken")
     prev_tg_chat_id = config.get("tgChatId")
 
-    # Update config
-    config = {
+    # Update config (保留其他非API配置项)
+    config.update({
         "appKey": data.get("appKey", ""),
         "appSecret": data.get("appSecret", ""),
         "consumerKey": data.get("consumerKey", ""),
@@ -1641,7 +1331,7 @@ def save_settings():
         "tgChatId": data.get("tgChatId", ""),
         "iam": data.get("iam", "go-ovh-ie"),
         "zone": data.get("zone", "IE")
-    }
+    })
     
     # Auto-generate IAM if not set
     if not config["iam"]:
@@ -1685,54 +1375,87 @@ def verify_auth():
         add_log("ERROR", f"Authentication verification failed: {str(e)}")
         return jsonify({"valid": False})
 
+# 事件推送（text/event-stream）：log、logs_cleared、queue_item、history_entry、history_cleared、
+# stats、availability、servers_refreshed；断线重连时按 Last-Event-ID 补发，无法补发时发送 reset
+@app.route('/api/events', methods=['GET'])
+def stream_events():
+    last_event_id = request.headers.get("Last-Event-ID") or request.args.get("lastEventId")
+    return Response(
+        events.stream(last_event_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.route('/api/logs', methods=['GET'])
 def get_logs():
-    return jsonify(logs)
+    return cached_json_response("logs", lambda: logs)
 
 @app.route('/api/logs', methods=['DELETE'])
 def clear_logs():
     global logs
     logs = []
     save_data()
+    events.publish("logs_cleared", {})
     add_log("INFO", "Logs cleared")
     return jsonify({"status": "success"})
 
 @app.route('/api/queue', methods=['GET'])
 def get_queue():
-    return jsonify(queue)
+    return cached_json_response("queue", lambda: list(queue.values()))
 
 @app.route('/api/queue', methods=['POST'])
 def add_queue_item():
     data = request.json
     
+    if data.get("scheduleMode", "fixed") not in ("fixed", "adaptive"):
+        return jsonify({"status": "error", "message": "scheduleMode 只能是 fixed 或 adaptive"}), 400
+    
+    # datacenters 为按偏好排序的数据中心列表，一个任务同时监控并在第一个有货的数据中心下单；
+    # 只传 datacenter 时等同于只有一个数据中心
+    datacenters = data.get("datacenters") or [data.get("datacenter", "")]
+    if not isinstance(datacenters, list) or not all(isinstance(dc, str) and dc.strip() for dc in datacenters):
+        return jsonify({"status": "error", "message": "datacenters 必须是非空的数据中心列表"}), 400
+    datacenters = list(dict.fromkeys(dc.strip() for dc in datacenters))
+    
+    quantity = data.get("quantity", 1)
+    if not isinstance(quantity, int) or isinstance(quantity, bool) or quantity < 1:
+        return jsonify({"status": "error", "message": "quantity 必须是不小于1的整数"}), 400
+    
     queue_item = {
         "id": str(uuid.uuid4()),
         "planCode": data.get("planCode", ""),
-        "datacenter": data.get("datacenter", ""),
+        "datacenter": datacenters[0],
+        "datacenters": datacenters,
+        # 需要购买的台数：到货时一次购买还差的全部数量，只买到一部分时继续监控剩余数量
+        "quantity": quantity,
+        "fulfilledQuantity": 0,
+        "creditedOrders": [],
         "options": data.get("options", []),
         "status": "running",  # 直接设置为 running
         "createdAt": datetime.now().isoformat(),
         "updatedAt": datetime.now().isoformat(),
         "retryInterval": data.get("retryInterval", 30),
+        # fixed: 按 retryInterval 固定间隔轮询；adaptive: 根据历史到货时间调整间隔
+        "scheduleMode": data.get("scheduleMode", "fixed"),
         "retryCount": 0, # 初始化为0, process_queue的首次检查会处理
         "lastCheckTime": 0 # 初始化为0, process_queue的首次检查会处理
     }
     
-    queue.append(queue_item)
+    queue[queue_item["id"]] = queue_item
+    count_status_change(QUEUE_STATUS_STATS, None, queue_item["status"])
     save_data()
-    update_stats()
+    publish_queue_item(queue_item, "added")
     
-    add_log("INFO", f"添加任务 {queue_item['id']} ({queue_item['planCode']} 在 {queue_item['datacenter']}) 到队列并立即启动 (状态: running)")
+    add_log("INFO", f"添加任务 {queue_item['id']} ({queue_item['planCode']} 在 {', '.join(datacenters)}，共 {quantity} 台) 到队列并立即启动 (状态: running)")
     return jsonify({"status": "success", "id": queue_item["id"]})
 
 @app.route('/api/queue/<id>', methods=['DELETE'])
 def remove_queue_item(id):
-    global queue
-    item = next((item for item in queue if item["id"] == id), None)
+    item = queue.pop(id, None)
     if item:
-        queue = [item for item in queue if item["id"] != id]
+        count_status_change(QUEUE_STATUS_STATS, item["status"], None)
         save_data()
-        update_stats()
+        publish_queue_item(item, "removed")
         add_log("INFO", f"Removed {item['planCode']} from queue")
     
     return jsonify({"status": "success"})
@@ -1740,13 +1463,13 @@ def remove_queue_item(id):
 @app.route('/api/queue/<id>/status', methods=['PUT'])
 def update_queue_status(id):
     data = request.json
-    item = next((item for item in queue if item["id"] == id), None)
+    item = queue.get(id)
     
     if item:
-        item["status"] = data.get("status", "pending")
+        set_queue_status(item, data.get("status", "pending"))
         item["updatedAt"] = datetime.now().isoformat()
         save_data()
-        update_stats()
+        publish_queue_item(item)
         
         add_log("INFO", f"Updated {item['planCode']} status to {item['status']}")
     
@@ -1754,14 +1477,21 @@ def update_queue_status(id):
 
 @app.route('/api/purchase-history', methods=['GET'])
 def get_purchase_history():
-    return jsonify(purchase_history)
+    return cached_json_response("history", lambda: purchase_history)
 
 @app.route('/api/purchase-history', methods=['DELETE'])
 def clear_purchase_history():
     global purchase_history
     purchase_history = []
+    history_by_task.clear()
+    history_by_order.clear()
+    history_by_cart.clear()
+    with stats_lock:
+        stats["purchaseSuccess"] = 0
+        stats["purchaseFailed"] = 0
     save_data()
-    update_stats()
+    events.publish("history_cleared", {})
+    events.publish("stats", {"purchaseSuccess": 0, "purchaseFailed": 0})
     add_log("INFO", "Purchase history cleared")
     return jsonify({"status": "success"})
 
@@ -1769,66 +1499,70 @@ def clear_purchase_history():
 def get_servers():
     show_api_servers = request.args.get('showApiServers', 'false').lower() == 'true'
     
+    # 不在请求线程中加载目录，直接返回最近一次的快照；只有快照缺失或超过刷新间隔时才触发后台刷新，
+    # 手动刷新使用 POST /api/servers/refresh
     if show_api_servers and get_ovh_client():
-        # Try to reload from API
-        add_log("INFO", "正在从OVH API重新加载服务器列表...")
-        api_servers = load_server_list()
-        if api_servers:
-            global server_plans
-            server_plans = api_servers
-            save_data()
-            update_stats()
-            add_log("INFO", f"从OVH API加载了 {len(server_plans)} 台服务器")
-            
-            # 记录硬件信息统计
-            cpu_count = sum(1 for s in server_plans if s["cpu"] != "N/A")
-            memory_count = sum(1 for s in server_plans if s["memory"] != "N/A")
-            storage_count = sum(1 for s in server_plans if s["storage"] != "N/A")
-            bandwidth_count = sum(1 for s in server_plans if s["bandwidth"] != "N/A")
-            
-            add_log("INFO", f"服务器硬件信息统计: CPU={cpu_count}/{len(server_plans)}, 内存={memory_count}/{len(server_plans)}, "
-                   f"存储={storage_count}/{len(server_plans)}, 带宽={bandwidth_count}/{len(server_plans)}")
-            
-            # 记录几个示例服务器的详细信息，帮助排查
-            if len(server_plans) > 0:
-                sample_server = server_plans[0]
-                add_log("INFO", f"示例服务器信息: {json.dumps(sample_server, indent=2)}")
-        else:
-            add_log("WARNING", "从OVH API加载服务器列表失败")
-    
-    # 确保返回的服务器对象具有所有必要字段
-    validated_servers = []
-    
-    for server in server_plans:
-        # 确保每个字段都有合理的默认值
-        validated_server = {
-            "planCode": server.get("planCode", "未知"),
-            "name": server.get("name", "未命名服务器"),
-            "description": server.get("description", ""),
-            "cpu": server.get("cpu", "N/A"),
-            "memory": server.get("memory", "N/A"),
-            "storage": server.get("storage", "N/A"),
-            "bandwidth": server.get("bandwidth", "N/A"),
-            "vrackBandwidth": server.get("vrackBandwidth", "N/A"),
-            "defaultOptions": server.get("defaultOptions", []),
-            "availableOptions": server.get("availableOptions", []),
-            "datacenters": server.get("datacenters", [])
-        }
-        
-        # 确保数组类型的字段是有效的数组
-        if not isinstance(validated_server["defaultOptions"], list):
-            validated_server["defaultOptions"] = []
-        
-        if not isinstance(validated_server["availableOptions"], list):
-            validated_server["availableOptions"] = []
-        
-        if not isinstance(validated_server["datacenters"], list):
-            validated_server["datacenters"] = []
-        
-        validated_servers.append(validated_server)
+        server_refresher.trigger_if_stale()
     
-    # 返回服务器列表数组，前端将直接处理这个数组
-    return jsonify(validated_servers)
+    try:
+        query = server_index.parse_query(request.args)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    index = server_plan_index
+    status = server_refresher.status()
+    # 刷新状态也是响应的一部分，放进缓存键中
+    key = f"{request.query_string.decode()}|{status['refreshedAt']}|{status['refreshing']}|{status['lastError']}"
+    if query is None:
+        # 返回服务器列表和刷新状态，前端从servers字段读取列表
+        return cached_json_response("servers", lambda: {"servers": index.servers, **status}, key)
+    
+    return cached_json_response("servers", lambda: {**index.query(query), **status}, key)
+
+# 手动刷新服务器列表；已有刷新在进行时直接加入，不会重复请求OVH
+@app.route('/api/servers/refresh', methods=['POST'])
+def refresh_servers():
+    if not get_ovh_client():
+        return jsonify({"status": "error", "message": "API未配置", **server_refresher.status()}), 400
+    started = server_refresher.trigger()
+    return jsonify({"status": "started" if started else "in_progress", **server_refresher.status()}), 202
+
+# 最近一次目录刷新中新增、移除、变更和可用性变化的型号
+@app.route('/api/servers/changes', methods=['GET'])
+def get_server_changes():
+    return jsonify({**catalog_diff, **server_refresher.status()})
+
+# 可用性历史查询的公共参数：planCode、datacenter 和 days（默认7天）
+def history_query_args():
+    days = server_index.parse_int(request.args.get("days"), "days", 7)
+    return request.args.get("planCode") or None, request.args.get("datacenter") or None, time.time() - days * 86400, days
+
+# 可用性变化记录
+@app.route('/api/availability/history', methods=['GET'])
+def get_availability_history():
+    try:
+        plan_code, datacenter, since, days = history_query_args()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"days": days, "transitions": availability_store.transitions(plan_code, datacenter, since)})
+
+# 每个型号/数据中心的到货次数、窗口时长中位数和最近到货时间
+@app.route('/api/availability/stats', methods=['GET'])
+def get_availability_stats():
+    try:
+        plan_code, datacenter, since, days = history_query_args()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"days": days, "stats": availability_store.stats(plan_code, datacenter, since)})
+
+# 按星期几×小时统计的到货次数
+@app.route('/api/availability/heatmap', methods=['GET'])
+def get_availability_heatmap():
+    try:
+        plan_code, datacenter, since, days = history_query_args()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"days": days, "heatmap": availability_store.heatmap(plan_code, datacenter, since)})
 
 @app.route('/api/availability/<plan_code>', methods=['GET'])
 def get_availability(plan_code):
@@ -1840,8 +1574,9 @@ def get_availability(plan_code):
 
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    update_stats()
-    return jsonify(stats)
+    with stats_lock:
+        current_stats = dict(stats)
+    return jsonify(current_stats)
 
 # 确保所有必要的文件都存在
 def ensure_files_exist():
@@ -1885,6 +1620,14 @@ if __name__ == '__main__':
     # Start queue processor
     start_queue_processor()
     
+    # 启动统计一致性检查（由statsCheckInterval控制）
+    start_stats_checker()
+    
+    # 启动服务器目录的后台刷新，并在启动时预热一次
+    if os.path.exists(SERVERS_FILE):
+        server_refresher.mark_refreshed(os.path.getmtime(SERVERS_FILE))
+    server_refresher.start(warm=has_api_credentials())
+    
     # Add initial log
     add_log("INFO", "Server started")
     
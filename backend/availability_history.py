@@ -0,0 +1,259 @@
+"""
+可用性的时间序列记录和到货分析
+
+每次查询到 (型号, 数据中心) 的可用性时，只有状态与上一次不同才追加一条记录
+[时间, 型号, 数据中心, 状态] 到JSONL文件，因此文件大小只与状态变化的次数有关，
+与轮询频率无关。定期压缩：
+  - 超过原始保留期的记录时间取整到分钟，并合并有货状态之间的变化（如1H变为72H）
+  - 超过保留期的记录删除，只保留每个 (型号, 数据中心) 最后一条作为当前状态
+基于这些记录计算到货窗口（从无货变为有货到重新无货），提供到货次数、窗口时长
+中位数和按星期几×小时统计的到货热力图。
+"""
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from datetime import datetime
+
+import availability_matrix
+from availability_matrix import is_stock_level
+
+DAY = 86400
+# 两次压缩之间的最短间隔（秒）
+COMPACT_INTERVAL = 3600
+# 降采样的时间粒度（秒）
+DOWNSAMPLE_STEP = 60
+
+
+def _value(setting):
+    return setting() if callable(setting) else setting
+
+
+def _level_rank(level):
+    # 有货状态按交付时间排序（1H < 24H < ...），未登记的状态排在后面，同级按名称保证与顺序无关
+    if is_stock_level(level):
+        return (0, availability_matrix.LEVEL_CODES.get(level, len(availability_matrix.LEVEL_NAMES)), level)
+    return (1 if level == "unavailable" else 2, 0, "")
+
+
+def best_levels(pairs):
+    """
+    把 (数据中心, 状态) 合并为每个数据中心一个状态。同一型号在一个数据中心有多个FQN行，
+    任一行有货即为有货（取交付最快的状态），否则有 unavailable 时为 unavailable，否则为 unknown；
+    结果与行的顺序无关
+    """
+    levels = {}
+    for datacenter, level in pairs:
+        if not datacenter:
+            continue
+        level = level or "unknown"
+        current = levels.get(datacenter)
+        if current is None or _level_rank(level) < _level_rank(current):
+            levels[datacenter] = level
+    return levels
+
+
+def item_levels(items):
+    """OVH可用性查询结果（每个FQN一项）-> {数据中心: 状态}"""
+    return best_levels(
+        (dc.get("datacenter"), dc.get("availability"))
+        for item in items if isinstance(item, dict)
+        for dc in item.get("datacenters", [])
+    )
+
+
+class AvailabilityHistory:
+    def __init__(self, path, retention_days=90, raw_days=7):
+        """retention_days / raw_days 可以是数值或返回数值的函数（读取配置）"""
+        self.path = path
+        self.retention_days = retention_days
+        self.raw_days = raw_days
+        # (型号, 数据中心) -> [[时间, 状态], ...]，按时间排序
+        self.series = {}
+        self.last_compacted = 0
+        self._lock = threading.Lock()
+        # 同一时间只运行一次后台压缩
+        self._compacting = threading.Lock()
+        self._file = None
+
+    def load(self):
+        """读取历史文件，跳过无法解析的行（例如写入中途崩溃留下的半行）"""
+        if not os.path.exists(self.path):
+            return
+        skipped = 0
+        with self._lock:
+            self.series.clear()
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        ts, plan_code, datacenter, level = json.loads(line)
+                    except (ValueError, TypeError):
+                        skipped += 1
+                        continue
+                    self.series.setdefault((plan_code, datacenter), []).append([ts, level])
+            for series in self.series.values():
+                series.sort(key=lambda entry: entry[0])
+        if skipped:
+            logging.warning(f"可用性历史中有 {skipped} 行无法解析，已跳过")
+        self.compact()
+
+    def _append(self, lines):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        self._file.write("".join(lines))
+        self._file.flush()
+
+    def record(self, plan_code, levels, ts=None):
+        """
+        记录一次查询结果 {数据中心: 状态}，只追加发生变化的状态
+        返回变化列表 [(数据中心, 旧状态, 新状态)]，首次出现的旧状态为None
+        """
+        ts = ts if ts is not None else time.time()
+        changes = []
+        lines = []
+        with self._lock:
+            for datacenter, level in levels.items():
+                if not datacenter:
+                    continue
+                datacenter = datacenter.lower()
+                level = level or "unknown"
+                series = self.series.setdefault((plan_code, datacenter), [])
+                old = series[-1][1] if series else None
+                if old == level:
+                    continue
+                series.append([ts, level])
+                changes.append((datacenter, old, level))
+                lines.append(json.dumps([round(ts, 1), plan_code, datacenter, level], ensure_ascii=False, separators=(",", ":")) + "\n")
+            if lines:
+                self._append(lines)
+        if ts - self.last_compacted >= COMPACT_INTERVAL:
+            self.compact_in_background(ts)
+        return changes
+
+    def compact_in_background(self, now):
+        """在后台线程中压缩，重写文件不阻塞记录的调用方；已经在压缩时不再启动"""
+        if not self._compacting.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.compact(now)
+            except OSError as e:
+                # 下一个压缩间隔后再试
+                self.last_compacted = now
+                logging.warning(f"压缩可用性历史失败: {str(e)}")
+            finally:
+                self._compacting.release()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def compact(self, now=None):
+        """降采样并删除过期记录，重写历史文件"""
+        now = now if now is not None else time.time()
+        retention_cutoff = now - _value(self.retention_days) * DAY
+        raw_cutoff = now - _value(self.raw_days) * DAY
+        with self._lock:
+            for key, series in list(self.series.items()):
+                compacted = []
+                for index, (ts, level) in enumerate(series):
+                    # 保留期之前的记录只留最后一条，作为之后变化的起点
+                    if ts < retention_cutoff and index + 1 < len(series) and series[index + 1][0] < retention_cutoff:
+                        continue
+                    if ts < raw_cutoff:
+                        ts -= ts % DOWNSAMPLE_STEP
+                        if compacted and is_stock_level(compacted[-1][1]) == is_stock_level(level):
+                            continue
+                    compacted.append([ts, level])
+                self.series[key] = compacted
+
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for (plan_code, datacenter), series in self.series.items():
+                    for ts, level in series:
+                        f.write(json.dumps([round(ts, 1), plan_code, datacenter, level], ensure_ascii=False, separators=(",", ":")) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.last_compacted = now
+
+    def _selected(self, plan_code=None, datacenter=None):
+        datacenter = datacenter.lower() if datacenter else None
+        with self._lock:
+            return [(key, list(series)) for key, series in self.series.items()
+                    if (plan_code is None or key[0] == plan_code) and (datacenter is None or key[1] == datacenter)]
+
+    def transitions(self, plan_code=None, datacenter=None, since=None):
+        result = []
+        for (plan, dc), series in self._selected(plan_code, datacenter):
+            for index, (ts, level) in enumerate(series):
+                if since is not None and ts < since:
+                    continue
+                result.append({
+                    "time": ts,
+                    "planCode": plan,
+                    "datacenter": dc,
+                    "from": series[index - 1][1] if index > 0 else None,
+                    "to": level
+                })
+        result.sort(key=lambda entry: entry["time"])
+        return result
+
+    @staticmethod
+    def _windows(series):
+        """[(开始, 结束)]，仍然有货的窗口结束时间为None"""
+        windows = []
+        start = None
+        for ts, level in series:
+            if is_stock_level(level):
+                if start is None:
+                    start = ts
+            elif start is not None:
+                windows.append((start, ts))
+                start = None
+        if start is not None:
+            windows.append((start, None))
+        return windows
+
+    def windows(self, plan_code=None, datacenter=None, since=None):
+        """到货窗口；第一条记录就是有货时不知道何时到货，不计入"""
+        result = []
+        for (plan, dc), series in self._selected(plan_code, datacenter):
+            for start, end in self._windows(series):
+                if start == series[0][0] or (since is not None and start < since):
+                    continue
+                result.append({"planCode": plan, "datacenter": dc, "start": start, "end": end})
+        result.sort(key=lambda entry: entry["start"])
+        return result
+
+    def stats(self, plan_code=None, datacenter=None, since=None):
+        """每个 (型号, 数据中心) 的到货次数、窗口时长中位数（秒）和最近一次到货时间"""
+        grouped = {}
+        for window in self.windows(plan_code, datacenter, since):
+            grouped.setdefault((window["planCode"], window["datacenter"]), []).append(window)
+        result = []
+        for (plan, dc), windows in grouped.items():
+            durations = [window["end"] - window["start"] for window in windows if window["end"] is not None]
+            last = windows[-1]
+            result.append({
+                "planCode": plan,
+                "datacenter": dc,
+                "restocks": len(windows),
+                "medianWindowSeconds": round(statistics.median(durations), 1) if durations else None,
+                "lastRestockAt": datetime.fromtimestamp(last["start"]).isoformat(),
+                "inStock": last["end"] is None
+            })
+        result.sort(key=lambda entry: entry["restocks"], reverse=True)
+        return result
+
+    def heatmap(self, plan_code=None, datacenter=None, since=None):
+        """按本地时间的 星期几(0为周一) × 小时 统计到货次数，返回7×24的列表"""
+        counts = [[0] * 24 for _ in range(7)]
+        for window in self.windows(plan_code, datacenter, since):
+            started = datetime.fromtimestamp(window["start"])
+            counts[started.weekday()][started.hour] += 1
+        return counts
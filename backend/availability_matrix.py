@@ -0,0 +1,241 @@
+"""
+型号 × 数据中心的可用性矩阵
+
+可用性的原始数据是每个型号（或FQN）一组 {datacenter, availability} 字典，同一
+数据中心可能出现多次，查询时需要逐个遍历。这里把行（FQN，没有时用planCode）和
+数据中心都编成整数，可用性状态编成单字节枚举，存放在一个按行排列的 bytearray 中：
+  - 两个快照的比较按整行做字节比较，只在有差异的行中逐格比较
+  - "是否有货"用 bytes.translate 一次把整块矩阵映射成0/1掩码后查找
+  - 序列化为一个JSON头加原始字节
+"""
+import json
+import struct
+
+# 可用性状态编码；0表示该行在该数据中心没有记录。未登记的新状态会追加到末尾
+ABSENT = 0
+LEVEL_NAMES = ["", "unknown", "unavailable",
+               "1H-low", "1H-high", "1H", "24H", "72H", "120H", "240H", "480H"]
+LEVEL_CODES = {name: code for code, name in enumerate(LEVEL_NAMES)}
+# 这些状态视为无货，其余状态都视为有货
+NO_STOCK_LEVELS = ("", "unknown", "unavailable")
+
+# 列数按此步长增长，新增数据中心时不必每次重排整个矩阵
+COLUMN_STEP = 8
+
+
+def _stock_table():
+    return bytes(0 if code >= len(LEVEL_NAMES) or LEVEL_NAMES[code] in NO_STOCK_LEVELS else 1 for code in range(256))
+
+
+STOCK_TABLE = _stock_table()
+
+
+def level_code(level):
+    """状态名 -> 编码，首次出现的状态自动登记"""
+    global STOCK_TABLE
+    level = level or "unknown"
+    code = LEVEL_CODES.get(level)
+    if code is None:
+        if len(LEVEL_NAMES) >= 255:
+            return LEVEL_CODES["unknown"]
+        code = len(LEVEL_NAMES)
+        LEVEL_NAMES.append(level)
+        LEVEL_CODES[level] = code
+        STOCK_TABLE = _stock_table()
+    return code
+
+
+# 统一的有货判断，索引、统计、历史和下单都使用这个函数；None 也视为无货
+def is_stock_level(level):
+    return level not in NO_STOCK_LEVELS and level is not None
+
+
+def level_name(code):
+    return LEVEL_NAMES[code] if code < len(LEVEL_NAMES) else "unknown"
+
+
+class AvailabilityMatrix:
+    def __init__(self):
+        self.rows = []          # 行号 -> 行键（FQN或planCode）
+        self.row_index = {}     # 行键 -> 行号
+        self.row_plan = []      # 行号 -> planCode
+        self.plan_rows = {}     # planCode -> [行号]
+        self.datacenters = []   # 列号 -> 数据中心
+        self.dc_index = {}      # 数据中心 -> 列号
+        self.stride = 0         # 每行占用的字节数（>= 数据中心数）
+        self.cells = bytearray()
+
+    @classmethod
+    def from_availabilities(cls, items):
+        """从可用性接口返回的条目（或按planCode分组的字典）构建矩阵"""
+        matrix = cls()
+        matrix.update_rows(items)
+        return matrix
+
+    def _row(self, key, plan_code):
+        row = self.row_index.get(key)
+        if row is None:
+            row = len(self.rows)
+            self.rows.append(key)
+            self.row_index[key] = row
+            self.row_plan.append(plan_code)
+            self.plan_rows.setdefault(plan_code, []).append(row)
+            self.cells.extend(bytes(self.stride))
+        return row
+
+    def _column(self, datacenter):
+        column = self.dc_index.get(datacenter)
+        if column is None:
+            column = len(self.datacenters)
+            self.datacenters.append(datacenter)
+            self.dc_index[datacenter] = column
+            if column >= self.stride:
+                self._widen(self.stride + COLUMN_STEP)
+        return column
+
+    def _widen(self, stride):
+        cells = bytearray(len(self.rows) * stride)
+        for row in range(len(self.rows)):
+            cells[row * stride:row * stride + self.stride] = self.cells[row * self.stride:(row + 1) * self.stride]
+        self.cells = cells
+        self.stride = stride
+
+    def set(self, key, datacenter, level, plan_code=None):
+        """设置一格，返回 (旧编码, 新编码)"""
+        row = self._row(key, plan_code or key)
+        column = self._column(datacenter)
+        offset = row * self.stride + column
+        old = self.cells[offset]
+        new = level_code(level)
+        self.cells[offset] = new
+        return old, new
+
+    def get(self, key, datacenter):
+        row = self.row_index.get(key)
+        column = self.dc_index.get(datacenter)
+        if row is None or column is None:
+            return None
+        code = self.cells[row * self.stride + column]
+        return level_name(code) if code != ABSENT else None
+
+    def update_rows(self, items):
+        """
+        写入可用性接口返回的条目，返回发生变化的格子 [(行键, 数据中心, 旧状态, 新状态)]
+        items 可以是条目列表，也可以是 {planCode: [条目]} 字典
+        """
+        if isinstance(items, dict):
+            items = [item for plan_items in items.values() for item in plan_items]
+        changes = []
+        for item in items:
+            if not isinstance(item, dict) or not item.get("planCode"):
+                continue
+            plan_code = item["planCode"]
+            key = item.get("fqn") or plan_code
+            for dc in item.get("datacenters", []):
+                datacenter = dc.get("datacenter")
+                if not datacenter:
+                    continue
+                old, new = self.set(key, datacenter, dc.get("availability"), plan_code)
+                if old != new:
+                    changes.append((key, datacenter, level_name(old) if old else None, level_name(new)))
+        return changes
+
+    def stock_mask(self):
+        """整个矩阵的有货掩码，每格1字节"""
+        return self.cells.translate(STOCK_TABLE)
+
+    def plan_has_stock(self, plan_code, datacenter=None):
+        rows = self.plan_rows.get(plan_code, [])
+        if datacenter is not None:
+            column = self.dc_index.get(datacenter)
+            return column is not None and any(STOCK_TABLE[self.cells[row * self.stride + column]] for row in rows)
+        mask = b"".join(self.cells[row * self.stride:row * self.stride + len(self.datacenters)] for row in rows)
+        return mask.translate(STOCK_TABLE).find(1) != -1
+
+    def plans_with_stock(self):
+        """有任意数据中心有货的planCode集合；在掩码中查找，找到后直接跳到下一行"""
+        mask = self.stock_mask()
+        found = set()
+        offset = mask.find(1)
+        while offset != -1:
+            row = offset // self.stride
+            found.add(self.row_plan[row])
+            offset = mask.find(1, (row + 1) * self.stride)
+        return found
+
+    def datacenters_with_stock(self, plan_code):
+        found = set()
+        for row in self.plan_rows.get(plan_code, []):
+            start = row * self.stride
+            for column, datacenter in enumerate(self.datacenters):
+                if STOCK_TABLE[self.cells[start + column]]:
+                    found.add(datacenter)
+        return found
+
+    def diff(self, other):
+        """
+        与另一个快照比较（self为旧快照），返回 [(行键, 数据中心, 旧状态, 新状态)]
+        行和列的编号一致时按整行做字节比较，只展开有差异的行
+        """
+        changes = []
+        same_layout = self.stride == other.stride and self.datacenters == other.datacenters
+        if same_layout:
+            old_view = memoryview(self.cells)
+            new_view = memoryview(other.cells)
+            for row, key in enumerate(other.rows):
+                old_row = self.row_index.get(key)
+                new_start = row * other.stride
+                if old_row is not None:
+                    old_start = old_row * self.stride
+                    if old_view[old_start:old_start + self.stride] == new_view[new_start:new_start + other.stride]:
+                        continue
+                for column, datacenter in enumerate(other.datacenters):
+                    old = self.cells[old_row * self.stride + column] if old_row is not None else ABSENT
+                    new = other.cells[new_start + column]
+                    if old != new:
+                        changes.append((key, datacenter, level_name(old) if old else None, level_name(new) if new else None))
+        else:
+            for key in other.rows:
+                for datacenter in other.datacenters:
+                    old, new = self.get(key, datacenter), other.get(key, datacenter)
+                    if old != new:
+                        changes.append((key, datacenter, old, new))
+        # 新快照中已经不存在的行
+        for key in self.rows:
+            if key not in other.row_index:
+                for datacenter in self.datacenters:
+                    old = self.get(key, datacenter)
+                    if old is not None:
+                        changes.append((key, datacenter, old, None))
+        return changes
+
+    def to_bytes(self):
+        header = json.dumps({
+            "rows": self.rows,
+            "plans": self.row_plan,
+            "datacenters": self.datacenters,
+            "stride": self.stride,
+            "levels": LEVEL_NAMES
+        }, separators=(",", ":")).encode("utf-8")
+        return struct.pack(">I", len(header)) + header + bytes(self.cells)
+
+    @classmethod
+    def from_bytes(cls, data):
+        if len(data) < 4:
+            raise ValueError("可用性矩阵数据不完整")
+        (header_size,) = struct.unpack_from(">I", data)
+        header = json.loads(data[4:4 + header_size].decode("utf-8"))
+        matrix = cls()
+        for key, plan_code in zip(header["rows"], header["plans"]):
+            matrix._row(key, plan_code)
+        for datacenter in header["datacenters"]:
+            matrix._column(datacenter)
+        cells = bytearray(data[4 + header_size:])
+        # 写入时的状态编码可能与当前进程不同，按名称重新映射
+        remap = bytes(level_code(name) if name else ABSENT for name in header["levels"]) + bytes(256 - len(header["levels"]))
+        cells = cells.translate(remap)
+        stride = header["stride"]
+        for row in range(len(matrix.rows)):
+            width = len(matrix.datacenters)
+            matrix.cells[row * matrix.stride:row * matrix.stride + width] = cells[row * stride:row * stride + width]
+        return matrix
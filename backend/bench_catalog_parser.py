@@ -0,0 +1,60 @@
+"""
+目录解析的基准测试：比较串行解析和进程池并行解析
+
+读取 api_data 中的调试采集包（需要同时包含 catalog 和 availabilities），
+也接受旧版导出的目录JSON（此时没有可用性数据）。
+
+用法: python bench_catalog_parser.py [目录] [进程数] [每块型号数] [放大倍数]
+放大倍数用于把目录复制多份，模拟多个子公司合并后的大目录。
+"""
+import sys
+import time
+
+import bench_hardware_parser
+import catalog_parser
+import debug_capture
+import hardware_parser
+
+
+def load_catalogs(directory):
+    """返回 (来源, plans, availabilities_by_plan)"""
+    catalogs = []
+    for path in sorted(debug_capture.list_captures(directory)):
+        entries = debug_capture.load_capture(path).get("entries", {})
+        catalog = entries.get("catalog")
+        if isinstance(catalog, dict) and catalog.get("plans"):
+            catalogs.append((path, catalog["plans"], entries.get("availabilities") or {}))
+    if not catalogs:
+        catalogs = [(source, plans, {}) for source, plans in bench_hardware_parser.load_catalog_plans(directory)]
+    return catalogs
+
+
+def timed(func):
+    hardware_parser.addon_cache.clear()
+    started = time.perf_counter()
+    result = func()
+    return time.perf_counter() - started, result
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else "api_data"
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    scale = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    catalogs = load_catalogs(directory)
+    if not catalogs:
+        print(f"{directory} 中没有找到目录数据，请先开启 debugCapture 刷新一次服务器列表")
+        return 1
+    for source, plans, availabilities in catalogs:
+        plans = plans * scale
+        serial_time, serial = timed(lambda: catalog_parser.parse_catalog(plans, availabilities, workers=1))
+        parallel_time, parallel = timed(lambda: catalog_parser.parse_catalog(
+            plans, availabilities, workers=workers, chunk_size=chunk_size, parallel_threshold=0))
+        same = "一致" if serial == parallel else "不一致"
+        print(f"{source}: {len(plans)} 个型号, 串行 {serial_time * 1000:.1f}ms, "
+              f"并行({catalog_parser.resolve_workers(workers)}进程) {parallel_time * 1000:.1f}ms, 结果{same}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
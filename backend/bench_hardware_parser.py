@@ -0,0 +1,82 @@
+"""
+硬件规格解析的微基准测试
+
+读取 api_data 中的调试采集包（capture-*.json.gz）和旧版导出的目录JSON，
+分别测量冷缓存和热缓存下解析全部型号的耗时。
+
+用法: python bench_hardware_parser.py [目录] [轮数]
+"""
+import glob
+import json
+import os
+import sys
+import time
+
+import debug_capture
+import hardware_parser
+
+
+def load_catalog_plans(directory):
+    """返回 (来源, plans列表)"""
+    catalogs = []
+    for path in sorted(debug_capture.list_captures(directory)):
+        catalog = debug_capture.load_capture(path).get("entries", {}).get("catalog")
+        if isinstance(catalog, dict) and catalog.get("plans"):
+            catalogs.append((os.path.basename(path), catalog["plans"]))
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        if isinstance(data, dict) and isinstance(data.get("plans"), list):
+            catalogs.append((os.path.basename(path), data["plans"]))
+    return catalogs
+
+
+def parse_all(plans, cache):
+    for plan in plans:
+        name = plan.get("invoiceName", "") or plan.get("displayName", "")
+        description = plan.get("description", "") or plan.get("displayName", "")
+        hardware_parser.parse_plan_hardware(plan, name, description, cache)
+
+
+def clear_text_caches():
+    hardware_parser.cpu_from_text.cache_clear()
+    hardware_parser.memory_from_text.cache_clear()
+    hardware_parser.storage_from_text.cache_clear()
+
+
+def bench(plans, rounds):
+    cache = hardware_parser.AddonCache()
+    cold = []
+    for _ in range(rounds):
+        cache.clear()
+        clear_text_caches()
+        started = time.perf_counter()
+        parse_all(plans, cache)
+        cold.append(time.perf_counter() - started)
+    warm = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        parse_all(plans, cache)
+        warm.append(time.perf_counter() - started)
+    return min(cold), min(warm), len(cache.entries), cache.hits, cache.misses
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else "api_data"
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    catalogs = load_catalog_plans(directory)
+    if not catalogs:
+        print(f"{directory} 中没有找到目录数据，请先开启 debugCapture 刷新一次服务器列表")
+        return 1
+    for source, plans in catalogs:
+        cold, warm, entries, hits, misses = bench(plans, rounds)
+        print(f"{source}: {len(plans)} 个型号, 冷缓存 {cold * 1000:.2f}ms, 热缓存 {warm * 1000:.2f}ms, "
+              f"缓存项 {entries}, 命中 {hits}/{hits + misses}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
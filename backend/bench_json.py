@@ -0,0 +1,98 @@
+"""
+JSON 序列化的微基准测试
+
+读取持久化的数据文件（默认 servers.json 和 logs.json），分别测量标准库 json 和
+fast_json 的编码、解码耗时以及输出大小。没有安装 orjson 时 fast_json 回退到
+标准库，两者结果应该接近。
+安装了 pydantic 时还把每条记录转换成模型，比较先 .model_dump() 再用标准库编码
+（main.py 原来的做法）和 fast_json.dumps_models 直接编码模型。
+
+用法: python bench_json.py [文件...] [轮数]
+"""
+import json
+import os
+import sys
+import time
+from typing import Any
+
+import fast_json
+
+try:
+    import pydantic
+except ImportError:  # 可选依赖
+    pydantic = None
+
+
+def best_of(rounds, func, *args):
+    timings = []
+    result = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        result = func(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def stdlib_dumps(data):
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def stdlib_dumps_models(models):
+    return stdlib_dumps([model.model_dump() for model in models])
+
+
+def to_models(data):
+    """按第一条记录的字段建立模型，把数据文件中的记录转换成模型列表"""
+    if pydantic is None or not isinstance(data, list) or not data or not isinstance(data[0], dict):
+        return None
+    fields = {key: (Any, None) for key in data[0]}
+    model = pydantic.create_model("Record", **fields)
+    return [model(**record) for record in data if isinstance(record, dict)]
+
+
+def bench(path, rounds):
+    with open(path, "rb") as f:
+        raw = f.read()
+    data = json.loads(raw)
+    results = {}
+    results["json.dumps"] = best_of(rounds, stdlib_dumps, data)
+    results["fast_json.dumps"] = best_of(rounds, fast_json.dumps, data)
+    results["json.loads"] = best_of(rounds, json.loads, raw)
+    results["fast_json.loads"] = best_of(rounds, fast_json.loads, raw)
+    models = to_models(data)
+    if models is not None:
+        results["model_dump+json"] = best_of(rounds, stdlib_dumps_models, models)
+        results["dumps_models"] = best_of(rounds, fast_json.dumps_models, models)
+    return len(raw), results
+
+
+def main():
+    args = sys.argv[1:]
+    rounds = 20
+    if args and args[-1].isdigit():
+        rounds = int(args.pop())
+    paths = args or ["servers.json", "logs.json"]
+    print(f"fast_json 后端: {fast_json.BACKEND}" + ("" if fast_json.orjson else "（未安装 orjson，pip install -r requirements-optional.txt）"))
+    if pydantic is None:
+        print("未安装 pydantic，跳过模型编码的测试")
+    found = False
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"{path}: 文件不存在，跳过")
+            continue
+        found = True
+        size, results = bench(path, rounds)
+        print(f"{path}: {size / 1024:.1f}KB")
+        for name in ("json.dumps", "fast_json.dumps", "model_dump+json", "dumps_models"):
+            if name not in results:
+                continue
+            elapsed, output = results[name]
+            print(f"  {name:<16} {elapsed * 1000:8.2f}ms  输出 {len(output) / 1024:.1f}KB")
+        for name in ("json.loads", "fast_json.loads"):
+            elapsed, _ = results[name]
+            print(f"  {name:<16} {elapsed * 1000:8.2f}ms")
+    return 0 if found else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+服务器目录解析
+
+把OVH目录中的一个plan和它的可用性数据转换成前端使用的 server_info。
+build_server_info 是纯函数，不访问全局状态，因此可以在进程池中按块并行执行；
+parse_catalog 负责分块、按目录顺序合并结果，并把子进程中新增的硬件解析缓存
+合并回主进程。型号较少时直接串行解析，省去进程启动和序列化的开销。
+"""
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import hardware_parser
+
+# 数据中心代码（前三个字符）对应的名称和区域
+DATACENTER_NAMES = {
+    "gra": ("格拉夫尼茨", "法国"),
+    "sbg": ("斯特拉斯堡", "法国"),
+    "rbx": ("鲁贝", "法国"),
+    "bhs": ("博阿尔诺", "加拿大"),
+    "hil": ("希尔斯伯勒", "美国"),
+    "vin": ("维也纳", "美国"),
+    "lim": ("利马索尔", "塞浦路斯"),
+    "sgp": ("新加坡", "新加坡"),
+    "syd": ("悉尼", "澳大利亚"),
+    "waw": ("华沙", "波兰"),
+    "fra": ("法兰克福", "德国"),
+    "lon": ("伦敦", "英国"),
+    "eri": ("厄斯沃尔", "英国"),
+}
+
+
+def build_datacenters(availability_items):
+    datacenters = []
+    for item in availability_items:
+        for dc in item.get("datacenters", []):
+            datacenter = dc.get("datacenter")
+            # 取前三个字符作为数据中心代码
+            dc_name, region = DATACENTER_NAMES.get((datacenter or "").lower()[:3], (dc.get("datacenter", "未知"), "未知"))
+            datacenters.append({
+                "datacenter": datacenter,
+                "availability": dc.get("availability", "unknown"),
+                "dcName": dc_name,
+                "region": region
+            })
+    return datacenters
+
+
+def build_server_info(plan, availability_items, cache=None):
+    """把一个目录plan转换成 server_info；没有planCode时返回None"""
+    plan_code = plan.get("planCode")
+    if not plan_code:
+        return None
+    
+    datacenters = build_datacenters(availability_items)
+    
+    # Extract server details
+    default_options = []
+    available_options = []
+    
+    # 创建初始服务器信息对象 - 确保在解析特定字段前就已创建
+    server_info = {
+        "planCode": plan_code,
+        "name": plan.get("invoiceName", ""),
+        "description": plan.get("description", ""),
+        "cpu": "N/A",
+        "memory": "N/A",
+        "storage": "N/A",
+        "bandwidth": "N/A",
+        "vrackBandwidth": "N/A",
+        "datacenters": datacenters,
+        "defaultOptions": default_options,
+        "availableOptions": available_options
+    }
+    
+    # 获取服务器名称和描述，确保它们不为空
+    if not server_info["name"] and plan.get("displayName"):
+        server_info["name"] = plan.get("displayName")
+    
+    if not server_info["description"] and plan.get("displayName"):
+        server_info["description"] = plan.get("displayName")
+    
+    # 获取推荐配置和可选配置 - 使用多种方法处理不同格式
+    try:
+        # 方法 1: 检查plan.default.options
+        if plan.get("default") and isinstance(plan.get("default"), dict) and plan.get("default").get("options"):
+            for default_opt in plan.get("default").get("options"):
+                if isinstance(default_opt, dict):
+                    option_code = default_opt.get("planCode")
+                    option_name = default_opt.get("description", option_code)
+                    
+                    if option_code:
+                        default_options.append({
+                            "label": option_name,
+                            "value": option_code
+                        })
+        
+        # 方法 2: 检查plan.addons
+        if plan.get("addons") and isinstance(plan.get("addons"), list):
+            for addon in plan.get("addons"):
+                if not isinstance(addon, dict):
+                    continue
+                    
+                addon_plan_code = addon.get("planCode")
+                if not addon_plan_code:
+                    continue
+                
+                # 跳过已经在默认选项中的配置
+                if any(opt["value"] == addon_plan_code for opt in default_options):
+                    continue
+                
+                # 添加到可选配置列表
+                available_options.append({
+                    "label": addon.get("description", addon_plan_code),
+                    "value": addon_plan_code
+                })
+        
+        # 方法 3: 检查plan.product.options
+        if plan.get("product") and isinstance(plan.get("product"), dict) and plan.get("product").get("options"):
+            product_options = plan.get("product").get("options")
+            if isinstance(product_options, list):
+                for product_opt in product_options:
+                    if not isinstance(product_opt, dict):
+                        continue
+                        
+                    option_code = product_opt.get("planCode")
+                    option_name = product_opt.get("description", option_code)
+                    
+                    if option_code and not any(opt["value"] == option_code for opt in available_options) and not any(opt["value"] == option_code for opt in default_options):
+                        available_options.append({
+                            "label": option_name,
+                            "value": option_code
+                        })
+        
+        # 方法 4: 从plan.addonFamilies中提取可选配置（硬件信息由hardware_parser解析）
+        try:
+            if plan.get("addonFamilies") and isinstance(plan.get("addonFamilies"), list):
+                # 重置可选配置列表
+                temp_available_options = []
+                
+                # 提取addonFamilies信息
+                for family in plan.get("addonFamilies"):
+                    if not isinstance(family, dict):
+                        continue
+                        
+                    family_name = family.get("name", "").lower()  # 注意: 在API响应中是'name'而不是'family'
+                    default_addon = family.get("default")  # 获取默认选项
+                    
+                    # 提取可选配置
+                    if family.get("addons") and isinstance(family.get("addons"), list):
+                        for addon_code in family.get("addons"):
+                            # 在API响应中，addons是字符串数组而不是对象数组
+                            if not isinstance(addon_code, str):
+                                continue
+                    
+                            # 标记是否为默认选项
+                            is_default = (addon_code == default_addon)
+                            
+                            # 从addon_code解析描述信息
+                            addon_desc = addon_code
+                            
+                            # 过滤掉许可证相关选项
+                            if (
+                                # Windows许可证
+                                "windows-server" in addon_code.lower() or
+                                # SQL Server许可证
+                                "sql-server" in addon_code.lower() or
+                                # cPanel许可证
+                                "cpanel-license" in addon_code.lower() or
+                                # Plesk许可证
+                                "plesk-" in addon_code.lower() or
+                                # 其他常见许可证
+                                "-license-" in addon_code.lower() or
+                                # 操作系统选项
+                                addon_code.lower().startswith("os-") or
+                                # 控制面板
+                                "control-panel" in addon_code.lower() or
+                                "panel" in addon_code.lower()
+                            ):
+                                # 跳过许可证类选项
+                                continue
+                    
+                            if addon_code:
+                                temp_available_options.append({
+                                    "label": addon_desc,
+                                    "value": addon_code,
+                                    "family": family_name,
+                                    "isDefault": is_default
+                                })
+                                
+                                # 如果是默认选项，添加到默认选项列表
+                                if is_default:
+                                    default_options.append({
+                                        "label": addon_desc,
+                                        "value": addon_code
+                                    })
+                    
+                # 将处理好的可选配置添加到服务器信息中
+                if temp_available_options:
+                    available_options = temp_available_options
+        
+        except Exception as e:
+            logging.error(f"解析 {plan_code} 的addonFamilies时出错: {str(e)}")
+        
+        # 方法 5: 检查plan.pricings中的配置项
+        if plan.get("pricings") and isinstance(plan.get("pricings"), dict):
+            for pricing_key, pricing_value in plan.get("pricings").items():
+                if isinstance(pricing_value, dict) and pricing_value.get("options"):
+                    for option_code, option_details in pricing_value.get("options").items():
+                        # 跳过已经在其他列表中的项目
+                        if any(opt["value"] == option_code for opt in default_options) or any(opt["value"] == option_code for opt in available_options):
+                            continue
+                        
+                        option_label = option_code
+                        if isinstance(option_details, dict) and option_details.get("description"):
+                            option_label = option_details.get("description")
+                        
+                        available_options.append({
+                            "label": option_label,
+                            "value": option_code
+                        })
+        
+    except Exception as e:
+        logging.warning(f"解析 {plan_code} 选项时出错: {str(e)}")
+    
+    # 解析硬件信息（CPU/内存/存储/带宽），addonFamilies默认选项的解析结果会被缓存
+    server_info.update(hardware_parser.parse_plan_hardware(plan, server_info["name"], server_info["description"], cache))
+    
+    # 更新服务器信息中的配置选项
+    server_info["defaultOptions"] = default_options
+    server_info["availableOptions"] = available_options    
+    return server_info
+
+
+def parse_chunk(chunk, cache_entries=None):
+    """
+    进程池中执行：解析一块 (plan, 可用性) 数据
+    返回 (server_info列表, 本块新增的硬件解析缓存)
+    """
+    cache = hardware_parser.AddonCache()
+    if cache_entries:
+        cache.update(cache_entries)
+    known = set(cache.entries)
+    results = [build_server_info(plan, availability_items, cache) for plan, availability_items in chunk]
+    new_entries = {key: value for key, value in cache.entries.items() if key not in known}
+    return results, new_entries
+
+
+def parse_serial(items):
+    results = [build_server_info(plan, availability_items) for plan, availability_items in items]
+    return [server_info for server_info in results if server_info]
+
+
+def resolve_workers(workers):
+    """workers <= 0 时使用CPU核心数"""
+    if workers and workers > 0:
+        return workers
+    return os.cpu_count() or 1
+
+
+def parse_catalog(plans, availabilities_by_plan, workers=0, chunk_size=50, parallel_threshold=2000):
+    """
+    解析目录中的全部plan，结果保持目录顺序
+    workers 为1、或型号数少于 parallel_threshold 时串行解析
+    """
+    workers = resolve_workers(workers)
+    items = [(plan, availabilities_by_plan.get(plan.get("planCode"), [])) for plan in plans]
+    
+    if workers <= 1 or len(items) < parallel_threshold:
+        return parse_serial(items)
+    
+    chunk_size = max(1, int(chunk_size))
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    cache_entries = dict(hardware_parser.addon_cache.entries)
+    
+    try:
+        # 使用spawn启动子进程，避免在多线程的Flask进程中fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=context) as executor:
+            chunk_results = list(executor.map(parse_chunk, chunks, [cache_entries] * len(chunks)))
+    except (OSError, BrokenProcessPool) as e:
+        logging.warning(f"进程池解析目录失败，改为串行解析: {str(e)}")
+        return parse_serial(items)
+    
+    servers = []
+    for results, new_entries in chunk_results:
+        hardware_parser.addon_cache.update(new_entries)
+        servers.extend(server_info for server_info in results if server_info)
+    return servers
+
+
+def plan_fingerprint(plan):
+    """原始plan对象的内容哈希"""
+    content = json.dumps(plan, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def refresh_catalog(plans, availabilities_by_plan, previous_servers, previous_fingerprints, **parse_options):
+    """
+    增量解析目录：只重新解析内容哈希变化的plan，其余沿用上次的结果并更新可用性
+    plans 为None表示目录未变化（条件请求返回304），全部沿用上次的结果
+    返回 (servers, fingerprints, diff)，diff 包含 added/removed/changed/availabilityChanged
+    """
+    previous_by_code = {server.get("planCode"): server for server in previous_servers}
+    
+    if plans is None:
+        codes = [code for code in previous_by_code if code in previous_fingerprints]
+        fingerprints = {code: previous_fingerprints[code] for code in codes}
+        to_parse = []
+    else:
+        codes = []
+        fingerprints = {}
+        to_parse = []
+        for plan in plans:
+            plan_code = plan.get("planCode")
+            if not plan_code or plan_code in fingerprints:
+                continue
+            codes.append(plan_code)
+            fingerprints[plan_code] = plan_fingerprint(plan)
+            if previous_fingerprints.get(plan_code) != fingerprints[plan_code] or plan_code not in previous_by_code:
+                to_parse.append(plan)
+    
+    parsed = {server["planCode"]: server for server in parse_catalog(to_parse, availabilities_by_plan, **parse_options)}
+    
+    servers = []
+    availability_changed = []
+    for plan_code in codes:
+        server_info = parsed.get(plan_code)
+        if server_info is None:
+            previous = previous_by_code[plan_code]
+            server_info = dict(previous)
+            server_info["datacenters"] = build_datacenters(availabilities_by_plan.get(plan_code, []))
+            if server_info["datacenters"] != previous.get("datacenters"):
+                availability_changed.append(plan_code)
+        servers.append(server_info)
+    
+    diff = {
+        "added": [code for code in codes if code not in previous_fingerprints],
+        "removed": [code for code in previous_fingerprints if code not in fingerprints],
+        "changed": [code for code in codes if code in previous_fingerprints and previous_fingerprints[code] != fingerprints[code]],
+        "availabilityChanged": availability_changed
+    }
+    return servers, fingerprints, diff
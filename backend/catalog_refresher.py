@@ -0,0 +1,116 @@
+"""
+服务器目录的后台刷新
+
+目录刷新（请求OVH目录和可用性并解析）在后台线程中进行，接口始终直接返回
+最近一次成功的快照。同一时间只有一次刷新在执行：刷新进行中再次触发时不会
+发起新的刷新，而是等待（或直接返回）正在进行的那一次。读取快照的接口只在快照
+缺失或超过刷新间隔时通过 trigger_if_stale() 触发刷新，不会绕过刷新间隔。
+"""
+import logging
+import threading
+import time
+from datetime import datetime
+
+# 刷新失败后，trigger_if_stale() 再次发起刷新的最短等待时间（秒）
+RETRY_AFTER = 60
+
+
+class CatalogRefresher:
+    def __init__(self, refresh, interval=1800):
+        """
+        refresh: 执行一次刷新的函数，成功返回True
+        interval: 返回周期刷新间隔（秒）的函数或数值，<=0 表示只在启动和手动触发时刷新
+        """
+        self.refresh = refresh
+        self.interval = interval if callable(interval) else (lambda: interval)
+        self.refreshed_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._done.set()
+        self._thread = None
+        self._last_started = None  # 最近一次发起刷新的时间（time.monotonic）
+
+    @property
+    def refreshing(self):
+        return not self._done.is_set()
+
+    def trigger(self):
+        """
+        开始一次刷新；已有刷新在进行时加入该次刷新
+        返回True表示本次调用发起了新的刷新
+        """
+        with self._lock:
+            if not self._done.is_set():
+                return False
+            self._done.clear()
+            self._last_started = time.monotonic()
+        thread = threading.Thread(target=self._run)
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def is_stale(self):
+        """没有快照，或快照已超过刷新间隔（间隔<=0时只在没有快照时过期）"""
+        if self.refreshed_at is None:
+            return True
+        interval = self.interval()
+        return bool(interval and interval > 0 and (datetime.now() - self.refreshed_at).total_seconds() >= interval)
+
+    def trigger_if_stale(self):
+        """快照过期时发起刷新；刚刚失败过的刷新在 RETRY_AFTER 秒内不重试"""
+        if not self.is_stale():
+            return False
+        if self._last_started is not None and time.monotonic() - self._last_started < RETRY_AFTER:
+            return False
+        return self.trigger()
+
+    def wait(self, timeout=None):
+        """等待正在进行的刷新结束，返回是否已结束"""
+        return self._done.wait(timeout)
+
+    def _run(self):
+        try:
+            if self.refresh():
+                self.refreshed_at = datetime.now()
+                self.last_error = None
+            else:
+                self.last_error = "刷新未返回数据"
+        except Exception as e:
+            self.last_error = str(e)
+            logging.error(f"后台刷新服务器目录失败: {str(e)}")
+        finally:
+            self._done.set()
+
+    def mark_refreshed(self, timestamp):
+        """记录已有快照的时间（例如启动时从文件加载的数据）"""
+        if timestamp and self.refreshed_at is None:
+            self.refreshed_at = datetime.fromtimestamp(timestamp)
+
+    def status(self):
+        return {
+            "refreshedAt": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            "refreshing": self.refreshing,
+            "lastError": self.last_error
+        }
+
+    def start(self, warm=True):
+        """启动周期刷新线程；warm为True时立即刷新一次"""
+        if self._thread and self._thread.is_alive():
+            return self._thread
+        if warm:
+            self.trigger()
+        self._thread = threading.Thread(target=self._loop)
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def _loop(self):
+        # 每次循环重新读取间隔，配置修改后无需重启
+        last_started = time.monotonic()
+        while True:
+            interval = self.interval()
+            if interval and interval > 0 and time.monotonic() - last_started >= interval:
+                self.trigger()
+                last_started = time.monotonic()
+            time.sleep(min(interval, 60) if interval and interval > 0 else 60)
@@ -0,0 +1,335 @@
+"""
+WebSocket 连接的并发推送
+
+每个连接有一个有界的发送队列和独立的写协程，广播只是把序列化一次的消息放进
+各连接的队列，不等待任何客户端，慢客户端不会拖慢其他连接：
+  - 同一对象的状态消息（如同一任务的 task_updated、connection_status）在队列中
+    尚未发出时直接用新内容替换，只发送最新状态
+  - 队列已满时丢弃最早的消息，下次发送前先通知客户端丢失了多少条消息；连接设置了
+    resync 时（丢失的可能是任务/订单的delta，客户端游标已不可信）改为清空队列，
+    由写协程发送 resync(连接) 返回的完整快照
+  - 单条消息发送超时的客户端视为卡死，直接断开
+高频消息（日志、任务和订单的delta）通过 publish() 先在一个短时间窗口内收集，
+同一实体的多条delta合并为一条，窗口结束时作为一个 batch 帧
+{"type": "batch", "data": [消息...]} 广播，减少帧数和事件循环的调度开销。
+
+客户端可以只订阅部分主题（见 message_topics），未订阅时接收全部消息。主题索引
+记录每个主题的订阅连接，每条消息只查一次索引得到接收者；批次中每条消息只序列化
+一次，接收内容相同的连接共用同一个 batch 帧。
+"""
+import asyncio
+import itertools
+import logging
+from collections import deque
+
+import fast_json
+from state_sync import merge_deltas
+
+# 可以合并的消息类型 -> 从 data 中取合并键的字段（None表示整个类型只保留最新一条）
+COALESCE_FIELDS = {
+    "connection_status": None,
+}
+
+
+def dumps(message):
+    return fast_json.dumps_str(message)
+
+
+def coalesce_key(message):
+    message_type = message.get("type")
+    if message_type not in COALESCE_FIELDS:
+        return None
+    field = COALESCE_FIELDS[message_type]
+    if field is None:
+        return (message_type,)
+    data = message.get("data")
+    return (message_type, data.get(field)) if isinstance(data, dict) else None
+
+
+# 订阅全部消息时等价的主题
+ALL_TOPICS = ("tasks", "orders", "logs", "availability", "status")
+
+
+def message_topics(message):
+    """
+    消息所属的主题，订阅其中任意一个即可收到；返回空元组表示发给所有连接
+      tasks / task:<id>、orders、logs / logs:<级别>、availability / availability:<planCode>、status
+    以 ":*" 结尾的主题表示该前缀下的所有订阅（例如清空任务要发给订阅了单个任务的连接）
+    """
+    message_type = message.get("type")
+    data = message.get("data")
+    if not isinstance(data, dict):
+        data = {}
+    if message_type == "log":
+        return ("logs", f"logs:{str(data.get('level', '')).lower()}")
+    if message_type == "delta":
+        if data.get("kind") == "order":
+            return ("orders",)
+        if data.get("id") is None:
+            return ("tasks", "task:*")
+        return ("tasks", f"task:{data.get('id')}")
+    if message_type in ("order_completed", "order_failed"):
+        return ("orders",)
+    if message_type == "availability":
+        return ("availability", f"availability:{data.get('planCode')}")
+    if message_type == "connection_status":
+        return ("status",)
+    return ()
+
+
+def batch_key(message):
+    """批次内的合并键：同一实体的delta，或可以合并的状态消息"""
+    if message.get("type") == "delta":
+        data = message["data"]
+        return ("delta", data.get("kind"), data.get("id"))
+    return coalesce_key(message)
+
+
+class ClientConnection:
+    def __init__(self, websocket, connection_id, max_queue=256, send_timeout=10.0):
+        self.websocket = websocket
+        self.id = connection_id
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        # 队列中是键，消息内容放在 pending 中，合并时只替换内容、保留位置
+        self.queue = deque()
+        self.pending = {}
+        self.dropped = 0
+        self.closed = False
+        # 丢弃消息后生成完整快照文本的函数，None表示只发送 messages_dropped 通知
+        self.resync = None
+        self.needs_resync = False
+        # 订阅的主题，None表示全部
+        self.topics = None
+        self._wakeup = asyncio.Event()
+        self._sequence = itertools.count()
+        self.writer = None
+
+    def enqueue(self, text, key=None):
+        if self.closed:
+            return
+        if key is not None and key in self.pending:
+            self.pending[key] = text
+            return
+        if key is None:
+            key = next(self._sequence)
+        if len(self.queue) >= self.max_queue:
+            if self.resync is not None:
+                # 之前排队的消息都会被快照取代
+                self.queue.clear()
+                self.pending.clear()
+                self.needs_resync = True
+            else:
+                self.pending.pop(self.queue.popleft(), None)
+                self.dropped += 1
+        self.queue.append(key)
+        self.pending[key] = text
+        self._wakeup.set()
+
+    async def run(self):
+        """写协程：依次发送队列中的消息，发送超时或出错时关闭连接"""
+        try:
+            while not self.closed:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                while (self.queue or self.needs_resync) and not self.closed:
+                    if self.needs_resync:
+                        # 快照在发送时生成，包含丢弃期间的全部变化
+                        self.needs_resync = False
+                        await self._send(self.resync(self))
+                        continue
+                    if self.dropped:
+                        dropped, self.dropped = self.dropped, 0
+                        await self._send(dumps({"type": "messages_dropped", "data": {"count": dropped}}))
+                    text = self.pending.pop(self.queue.popleft())
+                    await self._send(text)
+        except asyncio.TimeoutError:
+            logging.warning(f"WebSocket客户端 {self.id} 发送超时（{self.send_timeout}s），断开连接")
+            await self.close(code=1013)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"向WebSocket客户端 {self.id} 发送消息失败: {str(e)}")
+            await self.close()
+
+    async def _send(self, text):
+        await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+
+    async def close(self, code=1000):
+        if self.closed:
+            return
+        self.closed = True
+        self._wakeup.set()
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
+class ConnectionHub:
+    def __init__(self, max_queue=256, send_timeout=10.0, batch_window=0.05):
+        """batch_window: publish() 的合并窗口（秒），<=0 表示不合并"""
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.batch_window = batch_window
+        self.clients = {}
+        self.loop = None
+        self._ids = itertools.count(1)
+        # 主题 -> 订阅的连接id；subscribed_all 为接收全部消息的连接
+        self.index = {}
+        self.subscribed_all = set()
+        # 窗口内待发送的消息，键为合并键或序号
+        self._batch = {}
+        self._batch_ids = itertools.count()
+        self._flush_handle = None
+
+    def __len__(self):
+        return len(self.clients)
+
+    def register(self, websocket):
+        """登记已accept的连接并启动它的写协程"""
+        self.loop = asyncio.get_running_loop()
+        client = ClientConnection(websocket, next(self._ids), self.max_queue, self.send_timeout)
+        client.writer = asyncio.create_task(client.run())
+        self.clients[client.id] = client
+        self.subscribed_all.add(client.id)
+        return client
+
+    async def unregister(self, client):
+        self.clients.pop(client.id, None)
+        self._unindex(client)
+        client.closed = True
+        if client.writer and client.writer is not asyncio.current_task():
+            client.writer.cancel()
+            try:
+                await client.writer
+            except (asyncio.CancelledError, Exception):
+                pass
+
+    def _unindex(self, client):
+        self.subscribed_all.discard(client.id)
+        for topic in client.topics or ():
+            subscribers = self.index.get(topic)
+            if subscribers is not None:
+                subscribers.discard(client.id)
+                if not subscribers:
+                    del self.index[topic]
+
+    def subscribe(self, client, topics):
+        """设置连接订阅的主题；topics 为None或包含 "*" 时接收全部消息，返回订阅后的主题"""
+        self._unindex(client)
+        if topics is None or "*" in topics:
+            client.topics = None
+            self.subscribed_all.add(client.id)
+            return None
+        client.topics = {topic for topic in topics if topic}
+        for topic in client.topics:
+            self.index.setdefault(topic, set()).add(client.id)
+        return sorted(client.topics)
+
+    def unsubscribe(self, client, topics):
+        current = set(ALL_TOPICS) if client.topics is None else set(client.topics)
+        return self.subscribe(client, current - set(topics))
+
+    def recipients(self, message):
+        """通过主题索引得到应该收到消息的连接id"""
+        topics = message_topics(message)
+        if not topics:
+            return set(self.clients)
+        ids = set(self.subscribed_all)
+        for topic in topics:
+            if topic.endswith(":*"):
+                prefix = topic[:-1]
+                for name, subscribers in self.index.items():
+                    if name.startswith(prefix):
+                        ids |= subscribers
+            else:
+                ids |= self.index.get(topic, set())
+        return ids
+
+    def _call_in_loop(self, callback, *args):
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            callback(*args)
+        elif self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def broadcast(self, message):
+        """立即把消息放进所有连接的发送队列；可以在事件循环之外的线程中调用"""
+        if not self.clients:
+            return
+        self._call_in_loop(self._broadcast_now, message)
+
+    def publish(self, message):
+        """在合并窗口结束时随 batch 帧一起广播；可以在事件循环之外的线程中调用"""
+        if not self.clients:
+            return
+        if not self.batch_window or self.batch_window <= 0:
+            self.broadcast(message)
+            return
+        self._call_in_loop(self._add_to_batch, message)
+
+    def _broadcast_now(self, message):
+        # 先发出已收集的批量消息，保持消息顺序
+        self.flush()
+        text = dumps(message)
+        key = coalesce_key(message)
+        for client_id in self.recipients(message):
+            client = self.clients.get(client_id)
+            if client is not None:
+                client.enqueue(text, key)
+
+    def _add_to_batch(self, message):
+        key = batch_key(message)
+        if key is None:
+            key = next(self._batch_ids)
+        if message.get("type") == "delta" and message["data"].get("cleared"):
+            # 清空之前的同类变化不必再发送
+            kind = message["data"].get("kind")
+            for stale in [stale for stale in self._batch if isinstance(stale, tuple) and stale[:2] == ("delta", kind)]:
+                del self._batch[stale]
+        previous = self._batch.pop(key, None)
+        if previous is not None and message.get("type") == "delta":
+            message = {**message, "data": merge_deltas(previous["data"], message["data"])}
+        # 合并后的消息移到批次末尾，保持与其他实体变化（如清空）的先后顺序
+        self._batch[key] = message
+        if self._flush_handle is None:
+            self._flush_handle = self.loop.call_later(self.batch_window, self.flush)
+
+    def flush(self):
+        """立即发送窗口内收集的消息"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._batch:
+            return
+        messages = list(self._batch.values())
+        self._batch.clear()
+        
+        fragments = [dumps(message) for message in messages]
+        selected = {}
+        for position, message in enumerate(messages):
+            for client_id in self.recipients(message):
+                selected.setdefault(client_id, []).append(position)
+        # 收到相同消息的连接共用同一个帧
+        frames = {}
+        for client_id, positions in selected.items():
+            client = self.clients.get(client_id)
+            if client is None:
+                continue
+            key = tuple(positions)
+            text = frames.get(key)
+            if text is None:
+                text = frames[key] = '{"type":"batch","data":[' + ",".join(fragments[position] for position in positions) + "]}"
+            client.enqueue(text)
+
+    def send(self, client, message):
+        """只发给一个连接"""
+        client.enqueue(dumps(message), coalesce_key(message))
+
+    def send_text(self, client, text):
+        """只发给一个连接（已序列化的消息）"""
+        client.enqueue(text)
@@ -0,0 +1,77 @@
+"""
+服务器目录加载的调试采集
+
+开启后，一次目录刷新中收集到的原始目录、可用性和解析结果会被打包成一个
+gzip压缩的JSON文件（capture-<时间>.json.gz），在后台线程写入，并按保留数量
+清理旧文件。关闭时不做任何磁盘读写。
+"""
+import glob
+import gzip
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+
+CAPTURE_PREFIX = "capture-"
+CAPTURE_SUFFIX = ".json.gz"
+
+
+class DebugCapture:
+    def __init__(self, directory, retention=5):
+        self.directory = directory
+        self.retention = max(1, int(retention))
+        self.created_at = datetime.now()
+        self.entries = {}
+
+    def add(self, name, data):
+        """记录一项数据；只保存引用，写入时才序列化"""
+        self.entries[name] = data
+
+    def bundle_path(self):
+        stamp = self.created_at.strftime("%Y%m%d-%H%M%S")
+        return os.path.join(self.directory, f"{CAPTURE_PREFIX}{stamp}{CAPTURE_SUFFIX}")
+
+    def write(self):
+        """同步写入压缩包并清理超出保留数量的旧包，返回写入的路径"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.bundle_path()
+        bundle = {"capturedAt": self.created_at.isoformat(), "entries": self.entries}
+        tmp_path = f"{path}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(bundle, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self.prune()
+        return path
+
+    def prune(self):
+        bundles = sorted(list_captures(self.directory))
+        for old_path in bundles[:-self.retention]:
+            try:
+                os.remove(old_path)
+            except OSError as e:
+                logging.warning(f"删除旧调试采集文件 {old_path} 失败: {str(e)}")
+
+    def write_in_background(self):
+        """在守护线程中写入，不阻塞目录刷新"""
+        def run():
+            try:
+                path = self.write()
+                logging.info(f"调试采集已写入 {path}")
+            except Exception as e:
+                logging.error(f"写入调试采集失败: {str(e)}")
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+def list_captures(directory):
+    return glob.glob(os.path.join(directory, f"{CAPTURE_PREFIX}*{CAPTURE_SUFFIX}"))
+
+
+def load_capture(path):
+    """读取一个调试采集包"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
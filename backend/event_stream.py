@@ -0,0 +1,84 @@
+"""
+Server-Sent Events 推送
+
+数据变化时发布带类型的事件（队列项变化、购买历史、日志、统计变化、可用性变化），
+事件序列化一次后放入固定容量的环形缓冲区，每个 /api/events 连接从缓冲区读取并
+推送给浏览器。事件id单调递增，浏览器断线重连时自动带上 Last-Event-ID，从缓冲区
+补发错过的事件；错过的事件已经被挤出缓冲区时发送 reset 事件，前端收到后重新
+拉取完整数据。事件id带有进程启动时间作为前缀，服务重启后旧的id不会被误认。
+"""
+import threading
+import time
+from collections import deque
+
+import fast_json
+
+# 没有事件时发送注释行的间隔（秒），防止代理断开空闲连接
+HEARTBEAT_INTERVAL = 15
+# 浏览器断线后的重连等待时间（毫秒）
+RETRY_MS = 3000
+
+
+def format_event(epoch, event_id, event_type, data):
+    return f"id: {epoch}-{event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+class EventStream:
+    def __init__(self, capacity=1000):
+        self.events = deque(maxlen=capacity)  # (id, 类型, 已序列化的数据)
+        self.last_id = 0
+        self.epoch = int(time.time())
+        self._cond = threading.Condition()
+
+    def publish(self, event_type, data):
+        """发布一个事件，返回事件id"""
+        payload = fast_json.dumps_str(data)
+        with self._cond:
+            self.last_id += 1
+            self.events.append((self.last_id, event_type, payload))
+            self._cond.notify_all()
+            return self.last_id
+
+    def since(self, last_id):
+        """
+        返回 (id大于last_id的事件, 是否有事件已被挤出缓冲区)
+        """
+        with self._cond:
+            if not self.events or last_id >= self.last_id:
+                return [], False
+            first_id = self.events[0][0]
+            missed = last_id < first_id - 1
+            return [event for event in self.events if event[0] > last_id], missed
+
+    def wait(self, last_id, timeout):
+        """等待id大于last_id的事件，超时返回False"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.last_id > last_id, timeout)
+
+    def parse_id(self, last_event_id):
+        """Last-Event-ID -> 本进程的事件序号；为空返回None，无法续传（例如服务已重启）返回-1"""
+        if not last_event_id:
+            return None
+        epoch, _, event_id = last_event_id.partition("-")
+        if epoch != str(self.epoch) or not event_id.isdigit() or int(event_id) > self.last_id:
+            return -1
+        return int(event_id)
+
+    def stream(self, last_event_id=None):
+        """生成 text/event-stream 响应体；没有 Last-Event-ID 时只推送之后的新事件"""
+        last_id = self.parse_id(last_event_id)
+        if last_id is None or last_id < 0:
+            if last_id is not None:
+                yield format_event(self.epoch, self.last_id, "reset", "{}")
+            last_id = self.last_id
+
+        yield f"retry: {RETRY_MS}\n\n"
+        while True:
+            events, missed = self.since(last_id)
+            if missed:
+                yield format_event(self.epoch, events[0][0] - 1, "reset", "{}")
+            for event_id, event_type, payload in events:
+                yield format_event(self.epoch, event_id, event_type, payload)
+                last_id = event_id
+            if not self.wait(last_id, HEARTBEAT_INTERVAL):
+                yield ": keepalive\n\n"
@@ -0,0 +1,91 @@
+"""
+JSON 序列化
+
+安装了可选依赖 orjson 时使用它编码和解码，否则使用标准库 json，两者输出的都是
+紧凑格式、非ASCII字符不转义的UTF-8。pydantic 模型直接用 model_dump_json() 编码，
+不先转换成字典；模型列表逐个编码后拼接。
+解析错误统一为 json.JSONDecodeError（orjson 的解析错误是它的子类）。
+"""
+import json
+import os
+import tempfile
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+JSONDecodeError = json.JSONDecodeError
+
+
+def _default(obj):
+    """标准库和orjson都不支持的类型"""
+    model_dump = getattr(obj, "model_dump", None) or getattr(obj, "dict", None)
+    if model_dump is not None:
+        return model_dump()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def _model_json(obj):
+    model_dump_json = getattr(obj, "model_dump_json", None)
+    return model_dump_json() if model_dump_json is not None else None
+
+
+def dumps(obj):
+    """编码为UTF-8字节"""
+    text = _model_json(obj)
+    if text is not None:
+        return text.encode("utf-8")
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default).encode("utf-8")
+
+
+def dumps_str(obj):
+    """编码为字符串（WebSocket文本帧、SSE等）"""
+    text = _model_json(obj)
+    if text is not None:
+        return text
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), default=_default)
+
+
+def dumps_models(models):
+    """把pydantic模型序列编码为JSON数组（UTF-8字节），每个模型直接编码"""
+    return b"[" + b",".join(model.model_dump_json().encode("utf-8") for model in models) + b"]"
+
+
+def loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_file(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dump_file(path, obj):
+    """
+    原子写入：先写同目录下的临时文件再替换，obj 为bytes时直接写入
+    每次写入使用唯一的临时文件名，多个线程同时保存同一个文件时互不影响
+    """
+    data = obj if isinstance(obj, bytes) else dumps(obj)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
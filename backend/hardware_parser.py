@@ -0,0 +1,444 @@
+"""
+服务器硬件规格解析
+
+从OVH目录中的plan对象提取CPU、内存、存储和带宽信息。
+addonFamilies 中的默认选项代码（如 ram-32g-...、softraid-2x512nvme-...、
+traffic-5tb-100-...）在各型号之间大量重复，按"类别:选项代码"缓存解析结果，
+缓存可保存到文件，在多次刷新和重启之间复用。
+"""
+import json
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+
+# 解析规则变化时递增，旧的缓存文件会被丢弃
+PARSER_VERSION = 1
+
+NA = "N/A"
+HARDWARE_FIELDS = ("cpu", "memory", "storage", "bandwidth", "vrackBandwidth")
+
+# addonFamilies 选项代码的正则
+RAM_CODE_RE = re.compile(r'ram-(\d+)g', re.IGNORECASE)
+HYBRID_STORAGE_CODE_RE = re.compile(r'hybridsoftraid-(\d+)x(\d+)(sa|ssd|hdd)-(\d+)x(\d+)(nvme|ssd|hdd)', re.IGNORECASE)
+STORAGE_CODE_RE = re.compile(r'(raid|softraid)-(\d+)x(\d+)(ssd|hdd|nvme|sa)', re.IGNORECASE)
+TRAFFIC_BANDWIDTH_CODE_RE = re.compile(r'traffic-(\d+)(tb|gb|mb)-(\d+)', re.IGNORECASE)
+TRAFFIC_ONLY_CODE_RE = re.compile(r'traffic-(\d+)(tb|gb|mb)$', re.IGNORECASE)
+TRAFFIC_CODE_RE = re.compile(r'traffic-(\d+)(tb|gb|mb)', re.IGNORECASE)
+BANDWIDTH_CODE_RE = re.compile(r'bandwidth-(\d+)', re.IGNORECASE)
+VRACK_BANDWIDTH_CODE_RE = re.compile(r'vrack-bandwidth-(\d+)', re.IGNORECASE)
+NUMBER_RE = re.compile(r'(\d+)')
+
+# 名称/描述文本的正则，按顺序尝试
+MEMORY_TEXT_RES = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'(\d+)\s*GB\s*RAM',
+    r'RAM\s*(\d+)\s*GB',
+    r'(\d+)\s*G\s*RAM',
+    r'RAM\s*(\d+)\s*G',
+    r'(\d+)\s*GB'
+)]
+STORAGE_TEXT_RES = [re.compile(pattern, re.IGNORECASE) for pattern in (
+    r'(\d+)\s*[xX]\s*(\d+)\s*GB\s*(SSD|HDD|NVMe)',
+    r'(\d+)\s*(SSD|HDD|NVMe)\s*(\d+)\s*GB',
+    r'(\d+)\s*TB\s*(SSD|HDD|NVMe)',
+    r'(\d+)\s*(SSD|HDD|NVMe)'
+)]
+CPU_TEXT_CLEAN_RE = re.compile(r'[^\w\s\-,.]')
+
+# CPU关键词
+SERIES_CPU_KEYWORDS = ("i7-", "i9-", "i5-", "xeon", "epyc", "ryzen")
+NAME_CPU_KEYWORDS = SERIES_CPU_KEYWORDS + ("processor", "cpu")
+TEXT_CPU_KEYWORDS = ("i7-", "i9-", "ryzen", "xeon", "epyc", "cpu", "intel", "amd", "processor")
+CPU_VENDOR_TERMS = ("intel", "amd", "xeon", "i7")
+
+# addonFamilies 类别名称关键词，按顺序匹配
+FAMILY_KEYWORDS = (
+    ("cpu", ("cpu", "processor")),
+    ("memory", ("memory", "ram")),
+    ("storage", ("storage", "disk", "drive", "ssd", "hdd")),
+    ("bandwidth", ("bandwidth", "traffic", "network")),
+)
+
+
+def format_bandwidth(value):
+    if value >= 1000:
+        return f"{value/1000:.1f} Gbps".replace(".0 ", " ")
+    return f"{value} Mbps"
+
+
+def parse_memory_code(code):
+    match = RAM_CODE_RE.search(code)
+    if match:
+        return {"memory": f"{match.group(1)} GB"}
+    return {"memory": code}
+
+
+def parse_storage_code(code):
+    match = HYBRID_STORAGE_CODE_RE.search(code)
+    if match:
+        count1, size1, type1, count2, size2, type2 = match.groups()
+        return {"storage": f"混合RAID {count1}x {size1}GB {type1.upper()} + {count2}x {size2}GB {type2.upper()}"}
+    match = STORAGE_CODE_RE.search(code)
+    if match:
+        raid_type, count, size, type_str = match.groups()
+        return {"storage": f"{raid_type.upper()} {count}x {size}GB {type_str.upper()}"}
+    return {"storage": code}
+
+
+def parse_bandwidth_code(code):
+    # 格式1: traffic-5tb-100-24sk-apac (带宽限制和流量限制)
+    match = TRAFFIC_BANDWIDTH_CODE_RE.search(code)
+    if match:
+        return {"bandwidth": f"{match.group(3)} Mbps / {match.group(1)} {match.group(2).upper()}流量"}
+    # 格式2: traffic-5tb (仅流量限制)
+    if TRAFFIC_ONLY_CODE_RE.search(code):
+        match = TRAFFIC_CODE_RE.search(code)
+        return {"bandwidth": f"{match.group(1)} {match.group(2).upper()}流量"}
+    # 格式3: bandwidth-100 (仅带宽限制)
+    match = BANDWIDTH_CODE_RE.search(code)
+    if match:
+        return {"bandwidth": format_bandwidth(int(match.group(1)))}
+    lower = code.lower()
+    # 格式4: traffic-unlimited (无限流量)
+    if "unlimited" in lower:
+        match = NUMBER_RE.search(code)
+        return {"bandwidth": f"{int(match.group(1))} Mbps / 无限流量" if match else "无限流量"}
+    # 格式5: bandwidth-guarantee (保证带宽)
+    if "guarantee" in lower:
+        match = NUMBER_RE.search(code)
+        return {"bandwidth": f"{int(match.group(1))} Mbps (保证带宽)" if match else "保证带宽"}
+    # 格式6: vrack-bandwidth (内部网络带宽)
+    if "vrack" in lower:
+        match = VRACK_BANDWIDTH_CODE_RE.search(code)
+        return {"vrackBandwidth": format_bandwidth(int(match.group(1)))} if match else {}
+    # 无法识别的格式，使用原始值
+    return {"bandwidth": code}
+
+
+# 按addonFamily类别分派的解析函数
+ADDON_PARSERS = {
+    "cpu": lambda code: {"cpu": code},
+    "memory": parse_memory_code,
+    "storage": parse_storage_code,
+    "bandwidth": parse_bandwidth_code,
+}
+
+
+class AddonCache:
+    """选项代码解析结果的缓存，键为 "类别:选项代码" """
+
+    def __init__(self):
+        self.entries = {}
+        self.dirty = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def parse(self, kind, code):
+        key = f"{kind}:{code}"
+        result = self.entries.get(key)
+        if result is not None:
+            self.hits += 1
+            return result
+        self.misses += 1
+        result = ADDON_PARSERS[kind](code)
+        with self._lock:
+            self.entries[key] = result
+            self.dirty = True
+        return result
+
+    def update(self, entries):
+        """合并其他进程或文件中的解析结果"""
+        with self._lock:
+            for key, value in entries.items():
+                if key not in self.entries:
+                    self.entries[key] = value
+                    self.dirty = True
+
+    def clear(self):
+        with self._lock:
+            self.entries = {}
+            self.dirty = False
+            self.hits = 0
+            self.misses = 0
+
+    def load(self, path):
+        if not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logging.warning(f"读取硬件解析缓存 {path} 失败: {str(e)}")
+            return 0
+        if data.get("version") != PARSER_VERSION:
+            return 0
+        with self._lock:
+            self.entries.update(data.get("entries", {}))
+        return len(self.entries)
+
+    def save(self, path):
+        """缓存有变化时写入文件"""
+        if not self.dirty:
+            return False
+        with self._lock:
+            data = {"version": PARSER_VERSION, "entries": dict(self.entries)}
+            self.dirty = False
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        return True
+
+
+addon_cache = AddonCache()
+
+
+def match_field(name, mapping, hardware=None):
+    """
+    按顺序返回第一个名称关键词匹配的字段
+    传入hardware时只考虑尚未确定(N/A)的字段，与原先 if/elif 链的行为一致
+    """
+    for field, terms in mapping:
+        if any(term in name for term in terms) and (hardware is None or hardware[field] == NA):
+            return field
+    return None
+
+
+def extract_keyword_span(name, keywords):
+    """按关键词顺序查找，返回从关键词开始最多30个字符、逗号前的部分"""
+    lower = name.lower()
+    for keyword in keywords:
+        start_pos = lower.find(keyword)
+        if start_pos >= 0:
+            return name[start_pos:min(start_pos + 30, len(name))].split(",")[0].strip()
+    return None
+
+
+def cpu_from_label(name):
+    """从 "KS-A | Intel i7-6700k" 格式的名称中提取CPU"""
+    parts = name.split("|")
+    if len(parts) > 1:
+        cpu_part = parts[1].strip()
+        if any(term in cpu_part.lower() for term in CPU_VENDOR_TERMS):
+            return cpu_part
+    return None
+
+
+def cpu_from_series(plan):
+    """按服务器系列确定CPU，总会返回一个值"""
+    plan_code = plan.get("planCode", "")
+    plan_code_lower = plan_code.lower()
+    names = [plan.get("displayName", ""), plan.get("invoiceName", ""), plan.get("description", "")]
+
+    # SYSLE系列，通常格式为"25sysle021"
+    if "sysle" in plan_code_lower:
+        if "011" in plan_code:
+            cpu = "SYSLE 011系列 (入门级服务器CPU)"
+        elif "021" in plan_code:
+            cpu = "SYSLE 021系列 (中端服务器CPU)"
+        elif "031" in plan_code:
+            cpu = "SYSLE 031系列 (高端服务器CPU)"
+        else:
+            cpu = "SYSLE系列CPU"
+        for name in names:
+            if name:
+                found = extract_keyword_span(name, SERIES_CPU_KEYWORDS)
+                if found is not None:
+                    return found
+        return cpu
+
+    # SK系列，名称通常为"KS-A | Intel i7-6700k"
+    if "sk" in plan_code_lower:
+        for name in names:
+            if not name:
+                continue
+            cpu = cpu_from_label(name) if "|" in name else None
+            found = extract_keyword_span(name, SERIES_CPU_KEYWORDS)
+            if found is not None:
+                return found
+            if cpu:
+                return cpu
+        return "SK系列专用CPU"
+
+    # 其他系列，尝试从名称中提取
+    for name in names:
+        if name:
+            found = extract_keyword_span(name, NAME_CPU_KEYWORDS)
+            if found is not None:
+                return found
+    if "rise" in plan_code_lower:
+        return "RISE系列专用CPU"
+    if "game" in plan_code_lower:
+        return "GAME系列专用CPU"
+    return "专用服务器CPU"
+
+
+@lru_cache(maxsize=4096)
+def cpu_from_text(full_text):
+    """从名称和描述的组合文本中查找CPU关键词附近的文本"""
+    for keyword in TEXT_CPU_KEYWORDS:
+        pos = full_text.find(keyword)
+        if pos >= 0:
+            cpu_text = full_text[max(0, pos - 5):min(len(full_text), pos + 25)]
+            cpu_text = ' '.join(CPU_TEXT_CLEAN_RE.sub(' ', cpu_text).split())
+            if cpu_text:
+                return cpu_text
+    return None
+
+
+@lru_cache(maxsize=4096)
+def memory_from_text(full_text):
+    for pattern in MEMORY_TEXT_RES:
+        match = pattern.search(full_text)
+        if match:
+            return f"{match.group(1)} GB"
+    return None
+
+
+@lru_cache(maxsize=4096)
+def storage_from_text(full_text):
+    for pattern in STORAGE_TEXT_RES:
+        match = pattern.search(full_text)
+        if match:
+            if match.lastindex == 3:
+                return f"{match.group(1)}x {match.group(2)}GB {match.group(3).upper()}"
+            return f"{match.group(1)} {match.group(2).upper()}"
+    return None
+
+
+def apply_addon_families(plan, hardware, cache):
+    """用addonFamilies的默认选项填充尚未确定的硬件信息"""
+    families = plan.get("addonFamilies")
+    if not families or not isinstance(families, list):
+        return
+    for family in families:
+        if not isinstance(family, dict):
+            continue
+        family_name = family.get("name", "").lower()
+        default_value = family.get("default")
+        addons = family.get("addons")
+        if not family_name or not addons or not isinstance(addons, list):
+            continue
+        kind = match_field(family_name, FAMILY_KEYWORDS, hardware)
+        if kind and default_value:
+            hardware.update(cache.parse(kind, default_value))
+
+
+PROPERTY_FIELDS = (
+    ("cpu", ("cpu", "processor")),
+    ("memory", ("memory", "ram")),
+    ("storage", ("storage", "disk", "hdd", "ssd")),
+    ("bandwidth", ("bandwidth",)),
+)
+PRICING_FIELDS = (
+    ("cpu", ("processor",)),
+    ("memory", ("memory",)),
+    ("storage", ("storage",)),
+)
+DESCRIPTION_FIELDS = (
+    ("cpu", ("cpu", "core", "i7", "i9", "xeon", "epyc", "ryzen")),
+    ("memory", ("ram", "gb", "memory")),
+    ("storage", ("hdd", "ssd", "nvme", "storage", "disk")),
+    ("bandwidth", ("bandwidth",)),
+)
+PRIVATE_BANDWIDTH_TERMS = ("vrack", "private", "internal")
+
+
+def dict_entries(value):
+    return [entry for entry in value if isinstance(entry, dict)] if isinstance(value, list) else []
+
+
+def parse_plan_hardware(plan, name, description, cache=None):
+    """
+    解析一个plan的硬件信息，返回 cpu/memory/storage/bandwidth/vrackBandwidth
+    name/description 为展示用的名称和描述（已用displayName补全）
+    各来源的优先级与原先逐段解析时保持一致
+    """
+    cache = cache or addon_cache
+    plan_code = plan.get("planCode", "")
+    hardware = dict.fromkeys(HARDWARE_FIELDS, NA)
+
+    # 按系列确定CPU
+    try:
+        hardware["cpu"] = cpu_from_series(plan)
+    except Exception as e:
+        logging.warning(f"处理 {plan_code} 的特殊系列时出错: {str(e)}")
+        hardware["cpu"] = "专用服务器CPU"
+
+    # 系列默认值可以被名称标签中的具体型号替换，例如"KS-A | Intel i7-6700k"
+    if hardware["cpu"] == NA or "系列" in hardware["cpu"]:
+        for label in (plan.get("displayName", ""), plan.get("invoiceName", "")):
+            cpu = cpu_from_label(label) if label and "|" in label else None
+            if cpu:
+                hardware["cpu"] = cpu
+                break
+
+    try:
+        apply_addon_families(plan, hardware, cache)
+    except Exception as e:
+        logging.warning(f"解析 {plan_code} 的addonFamilies时出错: {str(e)}")
+
+    # properties中的值直接覆盖
+    details = plan.get("details")
+    if isinstance(details, dict):
+        for prop in dict_entries(details.get("properties")):
+            value = prop.get("value", NA)
+            if not value or value == NA:
+                continue
+            prop_name = prop.get("name", "").lower()
+            field = match_field(prop_name, PROPERTY_FIELDS)
+            if field == "bandwidth" and any(term in prop_name for term in PRIVATE_BANDWIDTH_TERMS):
+                field = "vrackBandwidth"
+            if field:
+                hardware[field] = value
+
+    # 从名称和描述文本中补全
+    try:
+        if "|" in name and hardware["cpu"] == NA:
+            cpu_part = name.split("|")[1].strip()
+            core_parts = cpu_part.split(",")
+            hardware["cpu"] = core_parts[0].strip() if "core" in cpu_part.lower() and len(core_parts) > 1 else cpu_part
+        full_text = f"{name} {description or ''}"
+        if hardware["cpu"] == NA:
+            hardware["cpu"] = cpu_from_text(full_text.lower()) or NA
+        if hardware["memory"] == NA:
+            hardware["memory"] = memory_from_text(full_text) or NA
+        if hardware["storage"] == NA:
+            hardware["storage"] = storage_from_text(full_text) or NA
+    except Exception as e:
+        logging.warning(f"解析 {plan_code} 服务器名称时出错: {str(e)}")
+
+    # 产品配置中的值直接覆盖
+    product = plan.get("product")
+    if isinstance(product, dict):
+        for config in dict_entries(product.get("configurations")):
+            value = config.get("value")
+            field = match_field(config.get("name", "").lower(), PROPERTY_FIELDS)
+            if value and field:
+                hardware[field] = value
+
+    # 从描述的逗号分隔片段中补全
+    plan_description = plan.get("description", "")
+    if plan_description:
+        for part in plan_description.split(","):
+            part = part.strip().lower()
+            for field, terms in DESCRIPTION_FIELDS:
+                if hardware[field] == NA and any(term in part for term in terms):
+                    hardware[field] = part
+
+    # 从pricing配置中补全
+    pricing = plan.get("pricing")
+    if isinstance(pricing, dict):
+        for price_config in dict_entries(pricing.get("configurations")):
+            value = price_config.get("value")
+            field = match_field(price_config.get("name", "").lower(), PRICING_FIELDS, hardware)
+            if value and field:
+                hardware[field] = value
+
+    # 对于CPU，如果只有核心数则补充单位
+    if hardware["cpu"] != NA and hardware["cpu"].isdigit():
+        hardware["cpu"] = f"{hardware['cpu']} 核心"
+
+    return hardware
@@ -18,6 +18,16 @@ from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings
 from contextlib import asynccontextmanager
 
+import purchase_journal
+import catalog_parser
+import server_index
+import availability_matrix
+import availability_history
+import poll_scheduler
+import connection_hub
+import state_sync
+import fast_json
+
 # Helper function to parse FQN (simple version) - Moved to top
 def parse_fqn(fqn: str) -> Dict[str, Optional[str]]:
     parts = fqn.split('.')
@@ -90,6 +100,22 @@ class Settings(BaseSettings):
     TARGET_OS: str = "none_64.en"
     TARGET_DURATION: str = "P1M"
     TASK_INTERVAL: int = 60  # 单位：秒
+    PERSIST_DEBOUNCE: float = 1.0  # 任务/订单持久化的合并窗口，单位：秒
+    CATALOG_TTL: int = 3600  # 产品目录缓存有效期，单位：秒
+    AVAILABILITY_TTL: int = 60  # /api/servers 过滤查询使用的批量可用性数据的有效期，单位：秒
+    HISTORY_RETENTION_DAYS: int = 90  # 可用性历史保留天数
+    HISTORY_RAW_DAYS: int = 7  # 可用性历史保留原始精度的天数
+    # 自适应轮询（任务 scheduleMode 为 adaptive）
+    ADAPTIVE_FAST_INTERVAL: int = 2  # 到货高发时段的检查间隔，单位：秒
+    ADAPTIVE_SLOW_INTERVAL: int = 300  # 历史上从未到货的时段的检查间隔，单位：秒
+    ADAPTIVE_HOT_THRESHOLD: float = 0.25  # 视为高发时段的每周到货次数
+    ADAPTIVE_LOOKBACK_DAYS: int = 28  # 统计到货时间的历史天数
+    POLL_BUDGET_PER_MINUTE: int = 60  # 自适应任务每分钟的总请求预算，0为不限制
+    WS_QUEUE_SIZE: int = 256  # 每个WebSocket连接最多排队的消息数
+    WS_SEND_TIMEOUT: float = 10.0  # 单条消息发送超时即断开该连接，单位：秒
+    SYNC_HISTORY_SIZE: int = 10000  # 保留的任务/订单变化条数，重连客户端的游标早于该范围时发送完整快照
+    WS_BATCH_WINDOW: float = 0.05  # 日志和任务更新合并为一个batch帧的时间窗口，0为不合并，单位：秒
+    MAX_QUANTITY_PER_CART: int = 0  # 单个购物车最多放入的服务器数量，超出部分在下一次尝试中继续购买，0为不限制
 
     class Config:
         env_file = ".env"
@@ -212,14 +238,16 @@ class AddonOption(BaseModel):
 
 class ServerConfig(BaseModel):
     planCode: str
-    datacenter: str
-    quantity: int = 1
+    datacenter: str = ""
+    datacenters: List[str] = []  # 按偏好排序的数据中心，在第一个有货的数据中心下单；为空时只用 datacenter
+    quantity: int = 1  # 任务需要购买的台数；执行时为本次放入购物车的台数
     os: str = "none_64.en"
     duration: str = "P1M"
     options: List[AddonOption] = []
     name: str
     maxRetries: int = -1  # -1表示无限重试
     taskInterval: int = 60  # 默认60秒检查一次
+    scheduleMode: str = "fixed"  # fixed: 固定间隔；adaptive: 根据历史到货时间调整间隔
 
 class OrderHistory(BaseModel):
     id: str
@@ -228,6 +256,7 @@ class OrderHistory(BaseModel):
     datacenter: str
     orderTime: str
     status: str
+    quantity: int = 1
     orderId: Optional[str] = None
     orderUrl: Optional[str] = None
     error: Optional[str] = None
@@ -246,6 +275,12 @@ class TaskStatus(BaseModel):
     message: Optional[str] = None
     taskInterval: int = 60  # 添加任务间隔属性，默认60秒
     options: List[AddonOption] = []  # 添加选项字段，保存用户选择的配置
+    scheduleMode: str = "fixed"
+    restockLikelihood: Optional[float] = None  # 自适应模式下当前时段平均每周的到货次数
+    datacenters: List[str] = []
+    quantity: int = 1  # 需要购买的台数
+    fulfilledQuantity: int = 0  # 已经买到的台数，部分成交时继续检查剩余数量
+    creditedOrders: List[str] = []  # 已计入 fulfilledQuantity 的订单号，回放购买日志时不再重复计入
 
 # 添加配置持久化
 CONFIG_FILE = "config.json"
@@ -256,6 +291,29 @@ ORDERS_FILE = "orders.json"
 # 添加任务持久化功能
 TASKS_FILE = "tasks.json"
 
+# 购买步骤预写日志，防止结账后崩溃导致重复下单
+ORDER_JOURNAL_FILE = "order_journal.jsonl"
+journal = purchase_journal.PurchaseJournal(ORDER_JOURNAL_FILE)
+
+# 各子公司产品目录的磁盘缓存
+CATALOG_CACHE_DIR = "catalog_cache"
+
+# (型号, 数据中心) 可用性变化的时间序列
+AVAILABILITY_HISTORY_FILE = "availability_history.jsonl"
+availability_store = availability_history.AvailabilityHistory(
+    AVAILABILITY_HISTORY_FILE,
+    retention_days=lambda: settings.HISTORY_RETENTION_DAYS,
+    raw_days=lambda: settings.HISTORY_RAW_DAYS
+)
+scheduler = poll_scheduler.PollScheduler(
+    availability_store,
+    fast_interval=lambda: settings.ADAPTIVE_FAST_INTERVAL,
+    slow_interval=lambda: settings.ADAPTIVE_SLOW_INTERVAL,
+    hot_threshold=lambda: settings.ADAPTIVE_HOT_THRESHOLD,
+    lookback_days=lambda: settings.ADAPTIVE_LOOKBACK_DAYS,
+    budget_per_minute=lambda: settings.POLL_BUDGET_PER_MINUTE
+)
+
 # 添加全局字典，用于记录各服务器型号的问题参数
 # server_problem_params = {}
 # 记录服务器型号尝试次数的字典
@@ -325,15 +383,82 @@ def load_config_from_file():
         except Exception as e:
             add_log("error", f"从文件加载API配置失败: {str(e)}")
 
-# 保存订单到文件
+# 原子地写入JSON文件（在工作线程中执行）
+def write_json_file(path: str, data: Any):
+    """原子写入JSON文件，data 可以是已编码的bytes"""
+    fast_json.dump_file(path, data)
+
+class DebouncedSaver:
+    """合并短时间内的多次保存请求，在工作线程中把不可变快照写入文件"""
+
+    def __init__(self, label: str, path: str, snapshot: Any, delay: float):
+        self.label = label
+        self.path = path
+        self.snapshot = snapshot  # 在事件循环中调用，返回与内存对象无关的快照
+        self.delay = delay
+        self.dirty = False
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._task: Optional[asyncio.Task] = None  # 合并窗口结束后启动的保存任务，保留引用以免被回收
+        self._lock = asyncio.Lock()
+
+    def schedule(self):
+        """标记数据已变更，在合并窗口结束后保存"""
+        self.dirty = True
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有运行中的事件循环（例如启动前或脚本调用），直接同步保存
+            self.dirty = False
+            write_json_file(self.path, self.snapshot())
+            return
+        if self._handle is None:
+            self._handle = loop.call_later(self.delay, self._fire)
+
+    def _fire(self):
+        self._handle = None
+        self._task = asyncio.create_task(self.flush())
+
+    async def flush(self) -> bool:
+        """立即保存未落盘的变更，返回是否实际写入了文件"""
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        async with self._lock:
+            if not self.dirty:
+                return False
+            self.dirty = False
+            data = self.snapshot()
+            try:
+                await asyncio.to_thread(write_json_file, self.path, data)
+            except Exception as e:
+                self.dirty = True
+                add_log("error", f"保存{self.label}到文件失败: {str(e)}")
+                return False
+            add_log("debug", f"{self.label}已保存到文件 {self.path}，{len(data)} 字节")
+            return True
+
+    async def drain(self) -> bool:
+        """等待已经启动的后台保存结束，再写入之后的变更（关闭和购买结果落盘前调用）"""
+        pending = self._task
+        if pending is not None and not pending.done() and pending is not asyncio.current_task():
+            await asyncio.gather(pending, return_exceptions=True)
+        return await self.flush()
+
+def snapshot_orders():
+    # 在事件循环中把订单列表直接编码为JSON（与内存对象无关，可以在工作线程中写入）
+    return fast_json.dumps_models(orders)
+
+def snapshot_tasks():
+    # 在事件循环中把任务直接编码为JSON
+    return fast_json.dumps_models(tasks.values())
+
+orders_saver = DebouncedSaver("订单历史", ORDERS_FILE, snapshot_orders, settings.PERSIST_DEBOUNCE)
+tasks_saver = DebouncedSaver("任务", TASKS_FILE, snapshot_tasks, settings.PERSIST_DEBOUNCE)
+
+# 保存订单到文件（合并后在后台写入）
 def save_orders_to_file():
-    global orders
     try:
-        with open(ORDERS_FILE, "w") as f:
-            # 将订单列表转换为可序列化的字典列表
-            serializable_orders = [order.dict() for order in orders]
-            json.dump(serializable_orders, f)
-        add_log("info", f"订单历史已保存到文件 {ORDERS_FILE}")
+        orders_saver.schedule()
     except Exception as e:
         add_log("error", f"保存订单历史到文件失败: {str(e)}")
 
@@ -342,57 +467,133 @@ def load_orders_from_file():
     global orders
     if os.path.exists(ORDERS_FILE):
         try:
-            with open(ORDERS_FILE, "r") as f:
-                orders_data = json.load(f)
-                orders = [OrderHistory(**order_dict) for order_dict in orders_data]
+            orders_data = fast_json.load_file(ORDERS_FILE)
+            orders = [OrderHistory(**order_dict) for order_dict in orders_data]
+            rebuild_order_indexes()
             add_log("info", f"已从文件 {ORDERS_FILE} 加载 {len(orders)} 条订单历史")
         except Exception as e:
             add_log("error", f"从文件加载订单历史失败: {str(e)}")
 
-# 保存任务到文件
+# 保存任务到文件（合并后在后台写入）
 def save_tasks_to_file():
-    global tasks
     try:
-        with open(TASKS_FILE, "w") as f:
-            # 将任务字典转换为可序列化的字典列表
-            serializable_tasks = [task.dict() for task in tasks.values()]
-            json.dump(serializable_tasks, f)
-        add_log("debug", f"任务已保存到文件 {TASKS_FILE}，共 {len(tasks)} 条")
+        tasks_saver.schedule()
     except Exception as e:
         add_log("error", f"保存任务到文件失败: {str(e)}")
 
+# 立即写入所有未保存的任务和订单
+async def flush_pending_saves():
+    await orders_saver.drain()
+    await tasks_saver.drain()
+
+# 购买结果写入快照后结束该任务的购买日志（日志每一步都fsync，在工作线程中写入，不阻塞事件循环）
+async def finish_purchase_journal(task_id: str):
+    await flush_pending_saves()
+    await asyncio.to_thread(journal.finish, task_id)
+
+# 回放购买预写日志，根据崩溃前到达的步骤修正任务和订单
+def reconcile_purchase_journal():
+    try:
+        pending = journal.replay()
+    except Exception as e:
+        add_log("error", f"读取购买日志失败: {str(e)}")
+        pending = {}
+    
+    for task_id, state in pending.items():
+        task = tasks.get(task_id)
+        step = state.get("step")
+        now = datetime.now().isoformat()
+        if step == purchase_journal.STEP_ORDER_RECEIVED:
+            order_id = state.get("orderId")
+            # 崩溃发生在保存结果之后、结束日志之前时，该订单已经记录过
+            if order_id and (
+                (task and str(order_id) in task.creditedOrders)
+                or any(order.orderId == str(order_id) and order.status == "success" for order in orders)
+            ):
+                add_log("info", f"购买日志中的订单 {order_id} 已记录，跳过恢复")
+                continue
+            add_order(OrderHistory(
+                id=str(uuid.uuid4()), planCode=state.get("planCode", ""), name=state.get("name", ""),
+                datacenter=state.get("datacenter", ""), orderTime=now, status="success",
+                quantity=state.get("quantity", 1), orderId=safe_str(order_id, "N/A"), orderUrl=safe_str(state.get("orderUrl"), "N/A"),
+                error="从购买日志恢复"
+            ))
+            if task:
+                record_task_purchase(task_id, state.get("quantity", 1), f"订单 {order_id} 已成功创建 (从购买日志恢复)", order_id)
+            add_log("warning", f"从购买日志恢复已下单任务 {task_id}，订单ID: {order_id}")
+        elif step == purchase_journal.STEP_CHECKOUT_ISSUED:
+            # 结账请求已发出但未收到结果，无法确定是否已下单，停止该任务避免重复购买
+            error_msg = f"进程在结账过程中中断，无法确认是否已下单，请在OVH后台核实 (购物车ID: {state.get('cartId')})"
+            add_order(OrderHistory(
+                id=str(uuid.uuid4()), planCode=state.get("planCode", ""), name=state.get("name", ""),
+                datacenter=state.get("datacenter", ""), orderTime=now, status="failed",
+                error=error_msg
+            ))
+            if task:
+                update_task_status(task_id, "failed", error_msg)
+            add_log("warning", f"任务 {task_id} 在结账时中断，已停止该任务")
+        elif task:
+            # 尚未结账，不会产生订单，重新排队
+            update_task_status(task_id, "pending", f"进程在 {step} 步骤中断，尚未结账，将重新尝试")
+    
+    # 其余停留在running状态的任务没有进行到购物车步骤，恢复为等待状态
+    for task_id, task in tasks.items():
+        if task.status == "running" and task_id not in pending:
+            update_task_status(task_id, "pending", "服务重启，任务重新排队")
+    
+    journal.checkpoint()
+
 # 从文件加载任务
 def load_tasks_from_file():
     global tasks
     if os.path.exists(TASKS_FILE):
         try:
-            with open(TASKS_FILE, "r") as f:
-                tasks_data = json.load(f)
-                # 将列表转换为以任务ID为键的字典
-                tasks = {task_dict["id"]: TaskStatus(**task_dict) for task_dict in tasks_data}
+            tasks_data = fast_json.load_file(TASKS_FILE)
+            # 将列表转换为以任务ID为键的字典
+            tasks = {task_dict["id"]: TaskStatus(**task_dict) for task_dict in tasks_data}
             add_log("info", f"已从文件 {TASKS_FILE} 加载 {len(tasks)} 条任务")
         except Exception as e:
             add_log("error", f"从文件加载任务失败: {str(e)}")
 
+# 订单去重键: 相同planCode、数据中心和状态的订单只保留一条
+def order_key(order: OrderHistory):
+    return (order.planCode, order.datacenter.lower(), order.status)
+
+# 根据orders列表重建订单索引
+def rebuild_order_indexes():
+    order_slots.clear()
+    orders_by_key.clear()
+    for i, order in enumerate(orders):
+        order_slots[order.id] = i
+        orders_by_key.setdefault(order_key(order), order.id)
+
 # 向订单列表添加新订单并持久化
 def add_order(order: OrderHistory):
     global orders
     
     # 检查是否已有相同planCode和datacenter的订单
-    for i, existing_order in enumerate(orders):
-        if (existing_order.planCode == order.planCode and 
-            existing_order.datacenter.lower() == order.datacenter.lower() and
-            existing_order.status == order.status):
-            # 替换现有订单
-            orders[i] = order
-            save_orders_to_file()
-            add_log("info", f"已更新现有订单记录: {order.id} (替换 {existing_order.id})")
-            return
+    key = order_key(order)
+    existing_id = orders_by_key.get(key)
+    if existing_id is not None:
+        # 替换现有订单，保持其在列表中的位置
+        i = order_slots.pop(existing_id)
+        orders[i] = order
+        order_slots[order.id] = i
+        orders_by_key[key] = order.id
+        save_orders_to_file()
+        if existing_id != order.id:
+            publish_delta(sync.remove("order", existing_id))
+        publish_delta(sync.update("order", order.id, order.dict()))
+        add_log("info", f"已更新现有订单记录: {order.id} (替换 {existing_id})")
+        return
     
     # 如果没有找到匹配的订单，添加新记录
     orders.append(order)
+    order_slots[order.id] = len(orders) - 1
+    orders_by_key[key] = order.id
     # 添加后立即保存到文件
     save_orders_to_file()
+    publish_delta(sync.update("order", order.id, order.dict()))
     add_log("info", f"新订单已添加到历史记录并保存: {order.id}")
 
 # **** 重新加入 task_execution_loop 函数定义 ****
@@ -400,8 +601,8 @@ async def task_execution_loop():
     while True:
         now = datetime.now().timestamp()
         
-        # 检查所有待处理任务
-        active_tasks = list(tasks.items()) # 创建副本以安全迭代
+        # 检查所有待处理任务；自适应任务中到货概率高的先执行，请求预算不足时优先获得令牌
+        active_tasks = sorted(tasks.items(), key=lambda entry: entry[1].restockLikelihood or 0, reverse=True)
         if not active_tasks:
             # add_log("debug", "任务执行循环：当前无活动任务")
             pass # 避免在没有任务时频繁记录日志
@@ -428,6 +629,10 @@ async def task_execution_loop():
                  #     add_log("debug", f"任务 {task_id} ({task.name}) 将在 {int(time_until_retry)} 秒后进行第 {task.retryCount + 1} 次尝试")
                  continue
             
+            # 自适应任务受全局请求预算限制，令牌不足时留到下一轮
+            if task.scheduleMode == "adaptive" and not scheduler.acquire():
+                continue
+            
             # 增加重试计数 (放在实际执行前)
             task.retryCount += 1
             # 更新状态为 'running' 并重置消息
@@ -444,9 +649,13 @@ async def task_execution_loop():
             server_config = ServerConfig(
                 planCode=task.planCode,
                 datacenter=task.datacenter,
+                datacenters=task.datacenters,
+                # 一次购买还差的全部数量，受单个购物车的数量上限限制
+                quantity=cart_quantity(task.quantity - task.fulfilledQuantity),
                 name=task.name,
                 maxRetries=task.maxRetries,
                 taskInterval=task.taskInterval,
+                scheduleMode=task.scheduleMode,
                 options=task.options # 恢复选项信息
             )
             
@@ -461,8 +670,8 @@ async def task_execution_loop():
                 # 启动失败，将任务状态设置回 pending 或 error，以便下次重试
                 update_task_status(task_id, "error", error_msg)
         
-        # 等待下一个检查周期
-        await asyncio.sleep(5)  # 每5秒检查一次任务状态
+        # 等待下一个检查周期；有自适应任务时检查周期不超过快速间隔
+        await asyncio.sleep(min(5, max(1, settings.ADAPTIVE_FAST_INTERVAL)) if any(task.scheduleMode == "adaptive" for task in tasks.values()) else 5)
 
 # 添加心跳检测和连接状态报告机制
 
@@ -493,6 +702,14 @@ async def lifespan(app: FastAPI):
     load_config_from_file()
     load_orders_from_file()
     load_tasks_from_file()  # 加载保存的任务
+    seed_sync_state()  # 以加载的任务和订单作为增量同步的初始状态
+    reconcile_purchase_journal()  # 回放购买日志
+    await flush_pending_saves()
+    await asyncio.to_thread(catalog_cache.load_from_disk)  # 加载产品目录缓存
+    try:
+        await asyncio.to_thread(availability_store.load)  # 加载可用性历史
+    except OSError as e:
+        add_log("warning", f"读取可用性历史失败: {str(e)}")
     
     # 启动任务执行循环和状态广播
     asyncio.create_task(task_execution_loop())
@@ -503,8 +720,7 @@ async def lifespan(app: FastAPI):
     # 关闭事件
     # 保存配置和订单历史
     save_config_to_file()
-    save_orders_to_file()
-    save_tasks_to_file()  # 保存任务
+    await flush_pending_saves()  # 保存订单和任务
     
     add_log("info", "OVH Titan Sniper 后端已关闭，所有数据已保存")
 
@@ -524,7 +740,13 @@ app.add_middleware(
 api_config: Optional[ApiConfig] = None
 tasks: Dict[str, TaskStatus] = {}
 orders: List[OrderHistory] = []
-connections: List[WebSocket] = []
+# 订单索引: id -> 在orders中的位置, 去重键 -> 订单id
+order_slots: Dict[str, int] = {}
+orders_by_key: Dict[tuple, str] = {}
+# 任务和订单的版本号，WebSocket只发送变化的字段
+sync = state_sync.StateSync(settings.SYNC_HISTORY_SIZE)
+# WebSocket连接，每个连接有自己的发送队列和写协程
+connections = connection_hub.ConnectionHub(settings.WS_QUEUE_SIZE, settings.WS_SEND_TIMEOUT, settings.WS_BATCH_WINDOW)
 logs: List[Dict[str, str]] = []
 
 # OVH客户端实例
@@ -532,37 +754,22 @@ ovh_client = None
 
 # WebSocket连接管理
 async def broadcast_message(message: Dict[str, Any]):
-    """广播消息给所有WebSocket连接"""
+    """广播消息给所有WebSocket连接（只放入各连接的发送队列，不等待发送完成）"""
     # 只为非日志消息和非心跳消息记录广播信息
     if message['type'] not in ['log', 'ping', 'pong']:
         add_log("debug", f"广播消息: type={message['type']}")
-    
-    global connections  # 确保我们使用全局连接列表
-    disconnected = []
-    
-    # 在开始前先检查连接是否有效
-    for i, websocket in enumerate(connections):
-        try:
-            # 检查连接是否打开
-            if websocket.client_state != 1:  # CONNECTED状态
-                add_log("debug", f"连接 {i} 已关闭，标记为断开")
-                disconnected.append(websocket)
-                continue
-                
-            await websocket.send_json(message)
-            # 取消每次发送的成功日志，减少日志数量
-        except WebSocketDisconnect:
-            add_log("warning", f"广播消息时发现断开的连接 (索引 {i})")
-            disconnected.append(websocket)
-        except Exception as e:
-            add_log("error", f"广播消息失败 (索引 {i}): {str(e)}")
-            # 任何错误都表示连接可能有问题，添加到断开列表
-            disconnected.append(websocket)
-    
-    # 移除已断开的连接
-    if disconnected:
-        connections = [conn for conn in connections if conn not in disconnected]
-        add_log("info", f"已清理 {len(disconnected)} 个断开的WebSocket连接，剩余 {len(connections)} 个活动连接")
+    connections.broadcast(message)
+
+def publish_delta(delta: Optional[dict]):
+    """把任务或订单的变化放入广播批次"""
+    if delta is not None:
+        connections.publish({"type": "delta", "data": delta})
+
+def seed_sync_state():
+    for task_id, task in tasks.items():
+        sync.update("task", task_id, task.dict())
+    for order in orders:
+        sync.update("order", order.id, order.dict())
 
 def add_log(level: str, message: str):
     timestamp = datetime.now().isoformat()
@@ -577,11 +784,11 @@ def add_log(level: str, message: str):
     if len(logs) > 1000:
         logs.pop(0)
     
-    # 将日志广播给所有连接的客户端
-    asyncio.create_task(broadcast_message({
+    # 将日志广播给所有连接的客户端（在合并窗口内与其他日志一起发送）
+    connections.publish({
         "type": "log",
         "data": log_entry
-    }))
+    })
 
 # 初始化OVH客户端
 def get_ovh_client(task_id=None):
@@ -659,17 +866,150 @@ def send_telegram_msg(message: str):
 
 # 获取服务器列表
 async def fetch_product_catalog(subsidiary: str = 'IE'):
+    subsidiary = subsidiary.upper()
+    if not subsidiary.isalpha() or len(subsidiary) > 4:
+        raise HTTPException(status_code=400, detail=f"无效的子公司代码: {subsidiary}")
     try:
-        response = requests.get(
-            f"https://eu.api.ovh.com/v1/order/catalog/public/eco?ovhSubsidiary={subsidiary}",
-            timeout=30
-        )
-        response.raise_for_status()
-        return response.json()
+        return await catalog_cache.get(subsidiary)
     except Exception as e:
         add_log("error", f"获取产品目录失败: {str(e)}")
         raise HTTPException(status_code=500, detail=f"获取产品目录失败: {str(e)}")
 
+# 下载产品目录（阻塞调用，在工作线程中执行）
+def download_product_catalog(subsidiary: str) -> dict:
+    response = requests.get(
+        f"https://eu.api.ovh.com/v1/order/catalog/public/eco?ovhSubsidiary={subsidiary}",
+        timeout=30
+    )
+    response.raise_for_status()
+    return response.json()
+
+class CatalogCache:
+    """
+    按子公司缓存产品目录：TTL内直接返回，过期后先返回旧数据并在后台刷新，同一子公司同时只下载一次
+    解析后的服务器索引按目录版本缓存，每个版本只解析一次；批量可用性数据过期后重新获取并就地修补索引
+    """
+
+    def __init__(self, directory: str, ttl: int, availability_ttl: int = 60):
+        self.directory = directory
+        self.ttl = ttl
+        self.availability_ttl = availability_ttl
+        self.entries: Dict[str, Dict[str, Any]] = {}  # 子公司 -> {"catalog", "fetchedAt"}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # 子公司 -> {"fetchedAt": 目录版本, "availabilityAt": 已应用的可用性数据时间, "index"}
+        self.indexes: Dict[str, Dict[str, Any]] = {}
+        self._building: Dict[tuple, asyncio.Task] = {}
+        self.availability_by_plan: Dict[str, list] = {}
+        self.availability_at = 0.0
+        self._availability_task: Optional[asyncio.Task] = None
+
+    def path(self, subsidiary: str) -> str:
+        return os.path.join(self.directory, f"catalog-{subsidiary}.json")
+
+    def load_from_disk(self):
+        """启动时读取磁盘上保存的目录，OVH响应慢时也能立即返回"""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if not (name.startswith("catalog-") and name.endswith(".json")):
+                continue
+            try:
+                data = fast_json.load_file(os.path.join(self.directory, name))
+                self.entries[data["subsidiary"]] = {"catalog": data["catalog"], "fetchedAt": data["fetchedAt"]}
+            except Exception as e:
+                add_log("warning", f"读取目录缓存 {name} 失败: {str(e)}")
+        if self.entries:
+            add_log("info", f"已从磁盘加载 {len(self.entries)} 个子公司的产品目录缓存: {', '.join(sorted(self.entries))}")
+
+    async def get(self, subsidiary: str) -> dict:
+        entry = self.entries.get(subsidiary)
+        if entry is None:
+            # 没有任何缓存时只能等待下载完成；shield避免请求取消时中断共享的下载
+            return await asyncio.shield(self.refresh(subsidiary))
+        if time.time() - entry["fetchedAt"] >= self.ttl:
+            self.refresh(subsidiary)
+        return entry["catalog"]
+
+    def refresh(self, subsidiary: str) -> asyncio.Task:
+        """开始（或加入正在进行的）下载"""
+        task = self._inflight.get(subsidiary)
+        if task is None:
+            task = asyncio.create_task(self._download(subsidiary))
+            self._inflight[subsidiary] = task
+            task.add_done_callback(lambda done: self._finished(subsidiary, done))
+        return task
+
+    def _finished(self, subsidiary: str, task: asyncio.Task):
+        self._inflight.pop(subsidiary, None)
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None and subsidiary in self.entries:
+            add_log("warning", f"刷新 {subsidiary} 产品目录失败，继续使用缓存: {str(error)}")
+
+    async def get_index(self, subsidiary: str, with_availability: bool = False) -> server_index.ServerIndex:
+        """返回缓存的服务器索引；with_availability 为True时先确保可用性数据未过期"""
+        catalog = await self.get(subsidiary)
+        fetched_at = self.entries[subsidiary]["fetchedAt"]
+        if with_availability and time.time() - self.availability_at >= self.availability_ttl:
+            await asyncio.shield(self.refresh_availability())
+        
+        cached = self.indexes.get(subsidiary)
+        if cached is None or cached["fetchedAt"] != fetched_at:
+            key = (subsidiary, fetched_at)
+            task = self._building.get(key)
+            if task is None:
+                task = asyncio.create_task(self._build(subsidiary, catalog, fetched_at))
+                self._building[key] = task
+                task.add_done_callback(lambda done: self._building.pop(key, None))
+            cached = await asyncio.shield(task)
+        
+        if cached["availabilityAt"] < self.availability_at:
+            # 只修补可用性变化的格子，不重新解析目录
+            for plan_code, items in self.availability_by_plan.items():
+                for datacenter, level in availability_history.item_levels(items).items():
+                    cached["index"].update_availability(plan_code, datacenter, level)
+            cached["availabilityAt"] = self.availability_at
+        return cached["index"]
+
+    async def _build(self, subsidiary: str, catalog: dict, fetched_at: float) -> Dict[str, Any]:
+        started = time.perf_counter()
+        availability_at = self.availability_at
+        index = await asyncio.to_thread(build_server_index, catalog, self.availability_by_plan)
+        entry = {"fetchedAt": fetched_at, "availabilityAt": availability_at, "index": index}
+        self.indexes[subsidiary] = entry
+        add_log("info", f"已为 {subsidiary} 产品目录建立服务器索引: {len(index.servers)} 个型号，耗时 {time.perf_counter() - started:.2f}s")
+        return entry
+
+    def refresh_availability(self) -> asyncio.Task:
+        """开始（或加入正在进行的）批量可用性查询"""
+        if self._availability_task is None or self._availability_task.done():
+            self._availability_task = asyncio.create_task(self._download_availability())
+        return self._availability_task
+
+    async def _download_availability(self):
+        availabilities = await fetch_availabilities_by_plan()
+        # 查询失败时保留旧数据，也在有效期内不再重试
+        if availabilities:
+            self.availability_by_plan = availabilities
+        self.availability_at = time.time()
+
+    async def _download(self, subsidiary: str) -> dict:
+        started = time.perf_counter()
+        catalog = await asyncio.to_thread(download_product_catalog, subsidiary)
+        fetched_at = time.time()
+        self.entries[subsidiary] = {"catalog": catalog, "fetchedAt": fetched_at}
+        add_log("info", f"已下载 {subsidiary} 产品目录，耗时 {time.perf_counter() - started:.2f}s")
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            await asyncio.to_thread(write_json_file, self.path(subsidiary),
+                                    {"subsidiary": subsidiary, "fetchedAt": fetched_at, "catalog": catalog})
+        except Exception as e:
+            add_log("warning", f"保存 {subsidiary} 产品目录缓存失败: {str(e)}")
+        return catalog
+
+catalog_cache = CatalogCache(CATALOG_CACHE_DIR, settings.CATALOG_TTL, settings.AVAILABILITY_TTL)
+
 # 检查服务器可用性
 async def check_availability(planCode: str, options=None, task_id=None):
     client = get_ovh_client(task_id)
@@ -730,6 +1070,10 @@ async def check_availability(planCode: str, options=None, task_id=None):
                             add_log("warning", f"记录 #{i+1} 没有数据中心信息")
                     else:
                         add_log("warning", f"记录 #{i+1} 不是字典格式: {type(item)}")
+            
+            # 只有不带配置选项的查询代表整个型号的可用性，记入历史
+            if not options:
+                await record_availability(planCode, response)
         
         return response
     except Exception as e:
@@ -737,6 +1081,39 @@ async def check_availability(planCode: str, options=None, task_id=None):
         add_log("error", f"错误详情: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=f"检查可用性失败: {str(e)}")
 
+async def record_availability(plan_code: str, items: list):
+    """把一次可用性查询结果中的状态变化追加到历史记录（在工作线程中写文件）"""
+    # 同一数据中心有多个FQN行，合并为一个状态（任一行有货即为有货），与行的顺序无关
+    levels = availability_history.item_levels(items)
+    try:
+        changes = await asyncio.to_thread(availability_store.record, plan_code, levels)
+    except OSError as e:
+        add_log("warning", f"写入可用性历史失败: {str(e)}")
+        return
+    # 推送给订阅了 availability 或 availability:<planCode> 的客户端（首次记录的状态不算变化）
+    for datacenter, old, new in changes:
+        if old is not None:
+            connections.publish({
+                "type": "availability",
+                "data": {"planCode": plan_code, "datacenter": datacenter, "from": old, "to": new}
+            })
+
+# 可用性历史、到货统计和到货热力图；days 为统计最近多少天
+@app.get("/api/availability/history")
+async def get_availability_history(planCode: Optional[str] = None, datacenter: Optional[str] = None, days: int = 7):
+    since = time.time() - max(days, 1) * 86400
+    return {"days": days, "transitions": availability_store.transitions(planCode, datacenter, since)}
+
+@app.get("/api/availability/stats")
+async def get_availability_stats(planCode: Optional[str] = None, datacenter: Optional[str] = None, days: int = 7):
+    since = time.time() - max(days, 1) * 86400
+    return {"days": days, "stats": availability_store.stats(planCode, datacenter, since)}
+
+@app.get("/api/availability/heatmap")
+async def get_availability_heatmap(planCode: Optional[str] = None, datacenter: Optional[str] = None, days: int = 7):
+    since = time.time() - max(days, 1) * 86400
+    return {"days": days, "heatmap": availability_store.heatmap(planCode, datacenter, since)}
+
 # 添加一个调试端点，返回可用性数据的详细信息
 @app.get("/api/debug/availability/{plan_code}")
 async def debug_availability(plan_code: str):
@@ -797,25 +1174,26 @@ async def order_server(task_id: str, config: ServerConfig):
             update_task_status(task_id, "pending", message)
             return
         
-        target_dc_upper = config.datacenter.upper() if config.datacenter else None
-        task_logger.info(f"将在 {len(availabilities)} 个配置中查找 {target_dc_upper} 的可用性...")
+        # 一次查询覆盖任务的所有数据中心，按偏好顺序选第一个有货的
+        candidates = task_datacenters(config)
+        task_logger.info(f"将在 {len(availabilities)} 个配置中查找 {', '.join(candidates)} 的可用性...")
+        in_stock = {}
         for item in availabilities:
             current_fqn = item.get("fqn") # Still useful for logging/notification
-            datacenters = item.get("datacenters", [])
-            for dc_info in datacenters:
-                availability = dc_info.get("availability")
+            for dc_info in item.get("datacenters", []):
                 datacenter_name = dc_info.get("datacenter")
-                if datacenter_name and target_dc_upper and datacenter_name.upper() == target_dc_upper:
-                    if availability not in ["unavailable", "unknown", None]:
-                        found_available = True
-                        available_dc = datacenter_name
-                        task_logger.info(f"在数据中心 {available_dc} 找到基础 planCode {config.planCode} 可用 (FQN 可能不同: {current_fqn})!")
-                        break
-            if found_available: break
+                if datacenter_name and availability_matrix.is_stock_level(dc_info.get("availability")):
+                    in_stock.setdefault(datacenter_name.upper(), (datacenter_name, current_fqn))
+        for candidate in candidates:
+            if candidate.upper() in in_stock:
+                found_available = True
+                available_dc, current_fqn = in_stock[candidate.upper()]
+                task_logger.info(f"在数据中心 {available_dc} 找到基础 planCode {config.planCode} 可用 (FQN 可能不同: {current_fqn})!")
+                break
         
         if not found_available:
             # ... (handle not found in target DC) ...
-            message = f"计划代码 {config.planCode} 在数据中心 {config.datacenter} 当前无可用服务器。"
+            message = f"计划代码 {config.planCode} 在数据中心 {', '.join(candidates)} 当前无可用服务器。"
             task_logger.info(message)
             update_task_status(task_id, "pending", message)
             return
@@ -832,11 +1210,14 @@ async def order_server(task_id: str, config: ServerConfig):
         task_logger.info(f"为区域 {api_config.zone} 创建购物车...")
         cart_result = client.post('/order/cart', ovhSubsidiary=api_config.zone)
         cart_id = cart_result["cartId"]
+        await asyncio.to_thread(journal.record, task_id, purchase_journal.STEP_CART_CREATED,
+                                cartId=cart_id, planCode=config.planCode, name=config.name,
+                                datacenter=available_dc, quantity=config.quantity)
         task_logger.info(f"购物车创建成功，ID: {cart_id}")
         
         # 2. 添加基础商品 (使用 /eco)
         update_task_status(task_id, "running", f"添加基础商品 {config.planCode}...")
-        task_logger.info(f"将基础商品 {config.planCode} 添加到购物车 {cart_id} (使用 /eco)...")
+        task_logger.info(f"将 {config.quantity} 台基础商品 {config.planCode} 添加到购物车 {cart_id} (使用 /eco)...")
         item_payload = {
             "planCode": config.planCode,
             "pricingMode": "default",
@@ -947,7 +1328,7 @@ async def order_server(task_id: str, config: ServerConfig):
                                 "planCode": avail_opt_plan_code, # Use the exact plan code from the API
                                 "duration": avail_opt.get("duration", config.duration), # Use option's duration or fallback
                                 "pricingMode": avail_opt.get("pricingMode", "default"),
-                                "quantity": 1
+                                "quantity": config.quantity
                             }
                             task_logger.info(f"添加 Eco 选项 payload: {option_payload}")
                             # Use the POST /eco/options endpoint
@@ -982,6 +1363,7 @@ async def order_server(task_id: str, config: ServerConfig):
         update_task_status(task_id, "running", "绑定购物车...")
         task_logger.info(f"在添加完所有项目和选项后，绑定购物车 {cart_id}...")
         client.post(f'/order/cart/{cart_id}/assign')
+        await asyncio.to_thread(journal.record, task_id, purchase_journal.STEP_ASSIGNED)
         task_logger.info("购物车绑定成功")
 
         # 6. 获取结账信息
@@ -993,24 +1375,27 @@ async def order_server(task_id: str, config: ServerConfig):
         # 7. 执行结账
         task_logger.info(f"对购物车 {cart_id} 执行结账...")
         checkout_payload = {"autoPayWithPreferredPaymentMethod": False, "waiveRetractationPeriod": True}
+        await asyncio.to_thread(journal.record, task_id, purchase_journal.STEP_CHECKOUT_ISSUED)
         checkout_result = client.post(f'/order/cart/{cart_id}/checkout', **checkout_payload)
         task_logger.info("结账请求已提交！")
         
         # 8. 处理成功结果
         order_url = checkout_result.get("url", "N/A")
         order_id = checkout_result.get("orderId")
+        await asyncio.to_thread(journal.record, task_id, purchase_journal.STEP_ORDER_RECEIVED, orderId=order_id, orderUrl=order_url)
         task_logger.info(f"订单创建成功! 订单ID: {order_id}, 订单URL: {order_url}")
         
         now = datetime.now().isoformat()
         history_entry = OrderHistory(
             id=str(uuid.uuid4()), planCode=config.planCode, name=config.name,
             datacenter=available_dc, # 使用 API 返回的 DC
-            orderTime=now, status="success",
+            orderTime=now, status="success", quantity=config.quantity,
             orderId=safe_str(order_id, "N/A"), orderUrl=safe_str(order_url, "N/A"),
             error=f"Options added: {added_options_count}" # Indicate options were processed
         )
         add_order(history_entry)
-        update_task_status(task_id, "completed", f"订单 {order_id} (选项数: {added_options_count}) 已成功创建")
+        record_task_purchase(task_id, config.quantity, f"订单 {order_id} ({config.quantity} 台, 选项数: {added_options_count}) 已成功创建", order_id)
+        await finish_purchase_journal(task_id)
         await broadcast_order_completed(history_entry)
         
         # Build display string with actual options added if possible (or just FQN if easier)
@@ -1052,10 +1437,11 @@ async def order_server(task_id: str, config: ServerConfig):
         now = datetime.now().isoformat()
         history_entry = OrderHistory(
             id=str(uuid.uuid4()), planCode=config.planCode, name=config.name,
-            datacenter=config.datacenter, orderTime=now, status="failed",
+            datacenter=available_dc or config.datacenter, orderTime=now, status="failed", quantity=config.quantity,
             error=error_msg
         )
         add_order(history_entry)
+        if cart_id: await finish_purchase_journal(task_id)
         
         # 仅在非不可用错误时广播失败消息
         if not is_unavailable_error:
@@ -1066,7 +1452,7 @@ async def order_server(task_id: str, config: ServerConfig):
         else:
             # 对于不可用错误，只广播消息到前端，不发送Telegram通知
             await broadcast_order_failed(history_entry)
-            add_log("info", f"服务器暂不可用，跳过Telegram通知: {config.planCode} 在 {config.datacenter}")
+            add_log("info", f"服务器暂不可用，跳过Telegram通知: {config.planCode} 在 {available_dc or config.datacenter}")
         
         return history_entry
 
@@ -1081,17 +1467,44 @@ async def order_server(task_id: str, config: ServerConfig):
         now = datetime.now().isoformat()
         history_entry = OrderHistory(
             id=str(uuid.uuid4()), planCode=config.planCode, name=config.name,
-            datacenter=config.datacenter, orderTime=now, status="failed",
+            datacenter=available_dc or config.datacenter, orderTime=now, status="failed", quantity=config.quantity,
             error=error_msg
         )
         add_order(history_entry)
+        if cart_id: await finish_purchase_journal(task_id)
         await broadcast_order_failed(history_entry)
         error_tg_msg = f"{api_config.iam}: 发生意外错误 - {str(e)}"
         if cart_id: error_tg_msg += f"\nCart ID: {cart_id}"
         send_telegram_msg(error_tg_msg)
         return history_entry
 
-def update_task_status(task_id: str, status: str, message: Optional[str] = None):
+def task_datacenters(task) -> List[str]:
+    """任务（或ServerConfig）按偏好顺序排列的数据中心"""
+    return task.datacenters or [task.datacenter]
+
+def cart_quantity(remaining: int) -> int:
+    """本次放入购物车的台数"""
+    remaining = max(remaining, 1)
+    if settings.MAX_QUANTITY_PER_CART > 0:
+        return min(remaining, settings.MAX_QUANTITY_PER_CART)
+    return remaining
+
+def record_task_purchase(task_id: str, quantity: int, message: str, order_id=None):
+    """任务成功下单 quantity 台：买够后完成，部分成交时立即继续购买剩余数量；同一订单只计入一次"""
+    task = tasks.get(task_id)
+    if task is None:
+        return
+    if order_id:
+        if str(order_id) in task.creditedOrders:
+            return
+        task.creditedOrders.append(str(order_id))
+    task.fulfilledQuantity += quantity
+    if task.fulfilledQuantity >= task.quantity:
+        update_task_status(task_id, "completed", message)
+    else:
+        update_task_status(task_id, "pending", f"{message}，已购买 {task.fulfilledQuantity}/{task.quantity} 台", retry_delay=0)
+
+def update_task_status(task_id: str, status: str, message: Optional[str] = None, retry_delay: Optional[float] = None):
     # 实现更新任务状态的逻辑
     if task_id in tasks:
         task = tasks[task_id]
@@ -1102,23 +1515,25 @@ def update_task_status(task_id: str, status: str, message: Optional[str] = None)
         # Calculate next retry time if status is error or pending
         if status in ["error", "pending"]:
             next_retry_delay = task.taskInterval
-            # Implement exponential backoff or other retry strategies if needed
-            # For now, simple interval
+            if retry_delay is not None:
+                next_retry_delay = retry_delay
+            elif task.scheduleMode == "adaptive":
+                # 按到货概率最高的数据中心决定间隔
+                next_retry_delay, task.restockLikelihood = min(
+                    (scheduler.interval(task.planCode, dc, task.taskInterval) for dc in task_datacenters(task)),
+                    key=lambda result: result[0]
+                )
             task.nextRetryAt = datetime.fromtimestamp(datetime.now().timestamp() + next_retry_delay).isoformat()
         else:
             task.nextRetryAt = None # Clear next retry time for completed/running/etc.
         
-        # Broadcast task update
+        # Broadcast task update (只发送变化的字段，在合并窗口内与其他变化一起随batch帧发送)
         try:
-            # Run broadcast in background to avoid blocking
-            asyncio.create_task(broadcast_message({
-            "type": "task_updated",
-            "data": task.dict()
-        }))
+            publish_delta(sync.update("task", task_id, task.dict()))
         except Exception as broadcast_error:
             add_log("error", f"广播任务更新失败: {broadcast_error}")
         
-        # Save tasks to file (maybe less frequently?)
+        # Save tasks to file (debounced, written off the event loop)
         save_tasks_to_file()
     else:
         add_log("warning", f"尝试更新不存在的任务状态: {task_id}")
@@ -1132,10 +1547,7 @@ async def clear_tasks():
     add_log("info", f"已清除 {tasks_count} 个任务")
     
     # 广播所有任务已清除
-    await broadcast_message({
-        "type": "tasks_cleared",
-        "data": {"count": tasks_count}
-    })
+    publish_delta(sync.clear("task"))
     
     return {"message": f"已清除 {tasks_count} 个任务"}
 
@@ -1147,13 +1559,16 @@ async def get_orders():
 async def delete_order(order_id: str):
     global orders
     # 查找订单
-    for i, order in enumerate(orders):
-        if order.id == order_id:
-            # 删除订单
-            removed_order = orders.pop(i)
-            save_orders_to_file()
-            add_log("info", f"已删除订单: {order_id}")
-            return {"message": f"已删除订单: {order_id}"}
+    i = order_slots.pop(order_id, None)
+    if i is not None:
+        # 删除订单
+        removed_order = orders.pop(i)
+        # 后续订单位置前移，重建索引
+        rebuild_order_indexes()
+        save_orders_to_file()
+        publish_delta(sync.remove("order", removed_order.id))
+        add_log("info", f"已删除订单: {order_id}")
+        return {"message": f"已删除订单: {order_id}"}
     
     # 如果没有找到订单，返回404
     raise HTTPException(status_code=404, detail=f"未找到订单: {order_id}")
@@ -1163,7 +1578,9 @@ async def clear_orders():
     global orders
     orders_count = len(orders)
     orders = []
+    rebuild_order_indexes()
     save_orders_to_file()
+    publish_delta(sync.clear("order"))
     add_log("info", f"已清除 {orders_count} 条订单历史记录")
     return {"message": f"已清除 {orders_count} 条订单历史记录"}
 
@@ -1171,11 +1588,47 @@ async def clear_orders():
 async def get_logs(limit: int = 100):
     return logs[-limit:] if limit < len(logs) else logs
 
+def send_state(client, since: Optional[str], safe_config: Optional[dict]) -> Optional[int]:
+    """
+    游标有效时发送 sync 消息（合并后的增量），返回增量条数；
+    否则发送完整的 initial_data 并返回None
+    """
+    deltas = sync.deltas_since(since) if since else None
+    if deltas is not None:
+        connections.send(client, {"type": "sync", "data": {"cursor": sync.cursor, "deltas": deltas}})
+        return len(deltas)
+    
+    connections.send_text(client, initial_data_text(client, safe_config))
+    return None
+
+def initial_data_text(client, safe_config: Optional[dict]) -> str:
+    """完整的 initial_data 消息（首次连接、游标失效，或发送队列溢出丢弃了消息后重新同步）"""
+    # 游标在生成快照之前读取，快照之后的变化会作为增量再次发送（增量是字段的最新值，重复应用无影响）
+    cursor = sync.cursor
+    # 任务和订单按版本号缓存序列化结果，大量客户端同时重连时不会重复序列化
+    tasks_json = sync.snapshot_json("tasks", lambda: fast_json.dumps_models(tasks.values()).decode("utf-8"))
+    orders_json = sync.snapshot_json("orders", lambda: fast_json.dumps_models(orders).decode("utf-8"))
+    rest = connection_hub.dumps({
+        "logs": logs[-100:],
+        "api_config": safe_config,  # 发送安全版本的API配置
+        "connection_status": {
+            "is_connected": True,
+            "connection_id": client.id,
+            "total_connections": len(connections),
+            "server_time": datetime.now().isoformat()
+        },
+        "cursor": cursor
+    })
+    return f'{{"type":"initial_data","data":{{"tasks":{tasks_json},"orders":{orders_json},{rest[1:]}}}'
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    connections.append(websocket)
-    connection_id = len(connections)  # 简单的连接ID
+    client = connections.register(websocket)
+    connection_id = client.id
+    # /ws?topics=tasks,logs:error 只订阅部分主题，不带时接收全部消息
+    if websocket.query_params.get("topics"):
+        connections.subscribe(client, [topic.strip() for topic in websocket.query_params["topics"].split(",")])
     add_log("info", f"新的WebSocket连接已建立 (ID: {connection_id}, 总连接数: {len(connections)})")
     
     try:
@@ -1193,23 +1646,15 @@ async def websocket_endpoint(websocket: WebSocket):
             if safe_config.get("tgToken"):
                 safe_config["tgToken"] = "******"
         
-        # 发送初始数据，包含API配置状态和所有订单
-        await websocket.send_json({
-            "type": "initial_data",
-            "data": {
-                "tasks": [task.dict() for task in tasks.values()],
-                "orders": [order.dict() for order in orders],  # 确保包含所有订单
-                "logs": logs[-100:],
-                "api_config": safe_config,  # 发送安全版本的API配置
-                "connection_status": {
-                    "is_connected": True,
-                    "connection_id": connection_id,
-                    "total_connections": len(connections),
-                    "server_time": datetime.now().isoformat()
-                }
-            }
-        })
-        add_log("info", f"已向客户端 {connection_id} 发送初始数据: {len(tasks)} 个任务, {len(orders)} 个订单, {min(len(logs), 100)} 条日志")
+        # 发送队列溢出丢弃消息（可能包括delta）后，客户端的游标不再可信，改为发送完整快照
+        client.resync = lambda dropped_client: initial_data_text(dropped_client, safe_config)
+        
+        # 客户端带上次的游标（/ws?since=...）重连时只发送缺失的增量，否则发送完整的初始数据
+        resumed = send_state(client, websocket.query_params.get("since"), safe_config)
+        if resumed is None:
+            add_log("info", f"已向客户端 {connection_id} 发送初始数据: {len(tasks)} 个任务, {len(orders)} 个订单, {min(len(logs), 100)} 条日志")
+        else:
+            add_log("debug", f"客户端 {connection_id} 从游标恢复，发送 {resumed} 条增量")
         
         # 立即广播连接状态通知所有客户端
         await broadcast_message({
@@ -1222,8 +1667,8 @@ async def websocket_endpoint(websocket: WebSocket):
         })
         
         while True:
-            # 检测连接健康状态
-            if websocket.client_state != 1:  # 如果不是CONNECTED状态
+            # 检测连接健康状态（写协程发送超时后会关闭连接）
+            if client.closed or websocket.client_state != 1:  # 如果不是CONNECTED状态
                 add_log("warning", f"客户端 {connection_id} 连接状态异常，关闭WebSocket")
                 break
                 
@@ -1237,7 +1682,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     if isinstance(message, dict) and "type" in message:
                         # 处理心跳消息
                         if message["type"] == "ping":
-                            await websocket.send_json({
+                            connections.send(client, {
                                 "type": "pong",
                                 "data": {
                                     "timestamp": datetime.now().isoformat(),
@@ -1245,9 +1690,21 @@ async def websocket_endpoint(websocket: WebSocket):
                                     "connection_id": connection_id
                                 }
                             })
+                        # 订阅/取消订阅主题：tasks、task:<id>、orders、logs、logs:<级别>、
+                        # availability、availability:<planCode>、status，"*" 表示全部
+                        elif message["type"] in ("subscribe", "unsubscribe"):
+                            topics = (message.get("data") or {}).get("topics") or []
+                            if message["type"] == "subscribe":
+                                subscribed = connections.subscribe(client, topics)
+                            else:
+                                subscribed = connections.unsubscribe(client, topics)
+                            connections.send(client, {"type": "subscribed", "data": {"topics": subscribed if subscribed is not None else ["*"]}})
+                        # 客户端请求从游标恢复
+                        elif message["type"] == "resume":
+                            send_state(client, (message.get("data") or {}).get("since"), safe_config)
                         # 处理状态检查请求
                         elif message["type"] == "check_connection":
-                            await websocket.send_json({
+                            connections.send(client, {
                                 "type": "connection_status",
                                 "data": {
                                     "is_connected": True,
@@ -1272,9 +1729,9 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         add_log("error", f"WebSocket错误 (客户端 {connection_id}): {str(e)}")
     finally:
-        # 确保连接被移除
-        if websocket in connections:
-            connections.remove(websocket)
+        # 确保连接被移除，并停止它的写协程
+        if connection_id in connections.clients:
+            await connections.unregister(client)
             add_log("info", f"连接已移除 (客户端 {connection_id}), 剩余连接数: {len(connections)}")
             
             # 广播连接状态更新，告知所有客户端连接数变化
@@ -1401,11 +1858,43 @@ async def set_telegram_config(config: dict):
     add_log("info", "Telegram通知配置已更新")
     return {"message": "Telegram通知配置已更新"}
 
+# 获取全部型号的可用性，按planCode分组；API未配置时返回空字典
+async def fetch_availabilities_by_plan() -> Dict[str, list]:
+    try:
+        client = get_ovh_client()
+        items = await asyncio.to_thread(client.get, '/dedicated/server/datacenter/availabilities')
+    except Exception as e:
+        add_log("warning", f"获取可用性数据失败，数据中心过滤将不生效: {str(e)}")
+        return {}
+    availabilities: Dict[str, list] = {}
+    for item in items or []:
+        if isinstance(item, dict) and item.get("planCode"):
+            availabilities.setdefault(item["planCode"], []).append(item)
+    return availabilities
+
+def build_server_index(catalog: dict, availabilities: Dict[str, list]) -> server_index.ServerIndex:
+    """把原始目录解析成服务器列表并建立查询索引"""
+    servers = catalog_parser.parse_catalog(catalog.get("plans", []), availabilities, workers=1)
+    return server_index.ServerIndex(servers)
+
 # **** 恢复 GET /api/servers 路由 ****
+# 不带查询参数时返回原始目录；带 datacenter/minMemory/storageType/cpu/availableNow/
+# sort/fields/page/limit 参数时返回解析后过滤、排序和分页的服务器列表
 @app.get("/api/servers")
-async def get_servers(subsidiary: str = 'IE'):
+async def get_servers(request: Request, subsidiary: str = 'IE'):
+    try:
+        query = server_index.parse_query(request.query_params)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     catalog = await fetch_product_catalog(subsidiary)
-    return catalog
+    if query is None:
+        return catalog
+    
+    # 索引按目录版本缓存，翻页和改变排序不会重新解析目录
+    with_availability = bool(query["datacenters"] or query["availableNow"] or (query["sort"] or "").lstrip("-") == "availability")
+    index = await catalog_cache.get_index(subsidiary.upper(), with_availability)
+    return index.query(query)
 
 # **** 恢复 GET /api/tasks 路由 ****
 @app.get("/api/tasks")
@@ -1464,7 +1953,15 @@ async def create_task(config: ServerConfig):
     
     add_log("info", f"创建任务请求: planCode={config.planCode}, 数据中心={config.datacenter}, 原始选项=[{', '.join(options_log)}]")
     
-    datacenter = config.datacenter.strip()
+    datacenters = list(dict.fromkeys(dc.strip() for dc in (config.datacenters or [config.datacenter]) if dc.strip()))
+    if not datacenters:
+        raise HTTPException(status_code=400, detail="至少需要一个数据中心")
+    datacenter = datacenters[0]
+    
+    if config.scheduleMode not in ("fixed", "adaptive"):
+        raise HTTPException(status_code=400, detail="scheduleMode 只能是 fixed 或 adaptive")
+    if config.quantity < 1:
+        raise HTTPException(status_code=400, detail="quantity 必须不小于1")
     
     new_task = TaskStatus(
         id=task_id,
@@ -1478,19 +1975,19 @@ async def create_task(config: ServerConfig):
         nextRetryAt=next_check,
         message="任务已创建，等待执行",
         taskInterval=config.taskInterval if config.taskInterval else 60,
-        options=config.options
+        options=config.options,
+        scheduleMode=config.scheduleMode,
+        datacenters=datacenters,
+        quantity=config.quantity
     )
     
     tasks[task_id] = new_task
-    add_log("info", f"创建了新任务: {config.name} ({task_id}), 数据中心: {datacenter}, 重试间隔: {new_task.taskInterval}秒, 最大重试次数: {new_task.maxRetries}, 配置选项: {len(new_task.options)}个")
+    add_log("info", f"创建了新任务: {config.name} ({task_id}), 数据中心: {', '.join(datacenters)}, 购买数量: {config.quantity}台, 重试间隔: {new_task.taskInterval}秒, 最大重试次数: {new_task.maxRetries}, 配置选项: {len(new_task.options)}个")
     
     save_tasks_to_file()
     
     try:
-        await broadcast_message({
-            "type": "task_created",
-            "data": new_task.dict()
-        })
+        publish_delta(sync.update("task", task_id, new_task.dict()))
     except Exception as e:
         add_log("error", f"广播任务创建消息失败: {str(e)}")
         
@@ -1509,10 +2006,7 @@ async def delete_task(task_id: str):
     
     save_tasks_to_file()
     
-    await broadcast_message({
-        "type": "task_deleted",
-        "data": {"id": task_id}
-    })
+    publish_delta(sync.remove("task", task_id))
     
     return {"message": f"任务 {task_id} 已删除"}
 
@@ -0,0 +1,117 @@
+"""
+根据历史到货时间调整轮询间隔
+
+固定间隔轮询把大部分API请求花在从不到货的时段。自适应模式根据可用性历史
+（availability_history）统计每个 (型号, 数据中心) 在一周各小时（星期几×小时）
+的到货频率：
+  - 到货频率达到阈值的时段（前后各一小时也算）使用快速间隔（例如2秒）
+  - 历史上从未到货的时段退到慢速间隔
+  - 历史数据不足时沿用任务自己的间隔
+所有自适应任务共用一个令牌桶，限制每分钟的总请求数，令牌不足时优先让到货
+概率高的任务先查询。
+"""
+import threading
+import time
+from datetime import datetime
+
+from availability_history import DAY
+
+# 每个 (型号, 数据中心) 的到货分布缓存时间（秒）
+PROFILE_TTL = 600
+# 到货次数少于该值时认为历史数据不足
+MIN_RESTOCKS = 3
+
+
+def _value(setting):
+    return setting() if callable(setting) else setting
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute):
+        """rate_per_minute 可以是数值或返回数值的函数，<=0 表示不限制"""
+        self.rate_per_minute = rate_per_minute
+        self.tokens = None
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取一个令牌，令牌不足时返回False"""
+        rate = _value(self.rate_per_minute)
+        if not rate or rate <= 0:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            # 桶容量为一分钟的请求数
+            if self.tokens is None:
+                self.tokens = rate
+            self.tokens = min(rate, self.tokens + (now - self.updated) * rate / 60)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class PollScheduler:
+    def __init__(self, history, fast_interval=2, slow_interval=300, hot_threshold=0.25,
+                 lookback_days=28, budget_per_minute=60):
+        """除 history 外的参数都可以是数值或返回数值的函数（读取配置）"""
+        self.history = history
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.hot_threshold = hot_threshold
+        self.lookback_days = lookback_days
+        self.bucket = TokenBucket(budget_per_minute)
+        # (型号, 数据中心) -> (计算时间, 7×24的每周到货次数或None)
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def _profile(self, plan_code, datacenter, now):
+        key = (plan_code, (datacenter or "").lower())
+        with self._lock:
+            cached = self._profiles.get(key)
+            if cached and now - cached[0] < PROFILE_TTL:
+                return cached[1]
+
+        days = _value(self.lookback_days)
+        since = now - days * DAY
+        profile = None
+        # 该数据中心的到货次数不足时，用该型号在所有数据中心的到货时间
+        for dc in (key[1] or None, None):
+            windows = self.history.windows(plan_code, dc, since)
+            if len(windows) >= MIN_RESTOCKS:
+                weeks = max(days / 7, 1)
+                counts = [[0] * 24 for _ in range(7)]
+                for window in windows:
+                    started = datetime.fromtimestamp(window["start"])
+                    counts[started.weekday()][started.hour] += 1
+                profile = [[count / weeks for count in row] for row in counts]
+                break
+        with self._lock:
+            self._profiles[key] = (now, profile)
+        return profile
+
+    def restock_likelihood(self, plan_code, datacenter, now=None):
+        """当前时段（含前后各一小时）平均每周的到货次数；历史数据不足时返回None"""
+        now = now if now is not None else time.time()
+        profile = self._profile(plan_code, datacenter, now)
+        if profile is None:
+            return None
+        current = datetime.fromtimestamp(now)
+        slot = current.weekday() * 24 + current.hour
+        return max(profile[(slot + offset) % 168 // 24][(slot + offset) % 24] for offset in (-1, 0, 1))
+
+    def interval(self, plan_code, datacenter, default_interval, now=None):
+        """返回 (轮询间隔, 到货频率)"""
+        likelihood = self.restock_likelihood(plan_code, datacenter, now)
+        if likelihood is None:
+            return default_interval, None
+        if likelihood >= _value(self.hot_threshold):
+            return min(_value(self.fast_interval), default_interval), likelihood
+        if likelihood > 0:
+            return default_interval, likelihood
+        return max(_value(self.slow_interval), default_interval), likelihood
+
+    def acquire(self):
+        """从全局请求预算中取一个令牌"""
+        return self.bucket.acquire()
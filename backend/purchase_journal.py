@@ -0,0 +1,121 @@
+"""
+抢购流程的预写日志 (write-ahead journal)
+
+每个购买步骤（创建购物车、绑定、发起结账、拿到订单号）在执行前后追加一行JSON
+并 fsync 到磁盘。进程在结账和保存快照之间崩溃时，重启后回放该日志即可知道哪些
+任务可能已经下单，从而避免重复购买。结果写入持久化快照后调用 finish()，
+当没有进行中的购买时日志会被直接截断。
+"""
+import json
+import os
+import threading
+import time
+
+# 购买步骤
+STEP_CART_CREATED = "cart_created"
+STEP_ASSIGNED = "assigned"
+STEP_CHECKOUT_ISSUED = "checkout_issued"
+STEP_ORDER_RECEIVED = "order_received"
+STEP_FINISHED = "finished"
+
+STEP_ORDER = [STEP_CART_CREATED, STEP_ASSIGNED, STEP_CHECKOUT_ISSUED, STEP_ORDER_RECEIVED]
+
+
+def step_rank(step):
+    return STEP_ORDER.index(step) if step in STEP_ORDER else -1
+
+
+class PurchaseJournal:
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0
+        self.open_tasks = set()
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _open(self, mode="a"):
+        if self._file is None or mode == "w":
+            if self._file is not None:
+                self._file.close()
+            self._file = open(self.path, mode, encoding="utf-8")
+        return self._file
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def record(self, task_id, step, **data):
+        """追加一个步骤并落盘，返回该记录的序号"""
+        with self._lock:
+            self.seq += 1
+            entry = {"seq": self.seq, "ts": time.time(), "taskId": task_id, "step": step}
+            entry.update(data)
+            f = self._open()
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._sync()
+            self.open_tasks.add(task_id)
+            return self.seq
+
+    def finish(self, task_id):
+        """任务结果已写入持久化快照；没有其他进行中的购买时直接截断日志"""
+        with self._lock:
+            self.open_tasks.discard(task_id)
+            if not self.open_tasks:
+                self._truncate()
+                return
+            self.seq += 1
+            entry = {"seq": self.seq, "ts": time.time(), "taskId": task_id, "step": STEP_FINISHED}
+            f = self._open()
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._sync()
+
+    def checkpoint(self):
+        """状态已全部落盘后清空日志（回放并保存后调用）"""
+        with self._lock:
+            self.open_tasks.clear()
+            self._truncate()
+
+    def _truncate(self):
+        self._open("w")
+        self._sync()
+
+    def replay(self):
+        """
+        读取日志，返回未完成任务的最后状态
+        {taskId: {"step": 最后到达的步骤, "steps": [...], 以及各步骤附带的数据}}
+        """
+        pending = {}
+        if not os.path.exists(self.path):
+            return pending
+        with self._lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 崩溃时最后一行可能只写了一半，忽略
+                        continue
+                    self.seq = max(self.seq, entry.get("seq", 0))
+                    task_id = entry.get("taskId")
+                    step = entry.get("step")
+                    if step == STEP_FINISHED:
+                        pending.pop(task_id, None)
+                        continue
+                    state = pending.setdefault(task_id, {"taskId": task_id, "steps": []})
+                    state["steps"].append(step)
+                    for key, value in entry.items():
+                        if key not in ("seq", "ts", "taskId", "step"):
+                            state[key] = value
+                    if step_rank(step) >= step_rank(state.get("step")):
+                        state["step"] = step
+            self.open_tasks = set(pending)
+        return pending
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,111 @@
+"""
+大列表GET接口的响应缓存
+
+每个集合（日志、队列、购买历史、服务器列表）有一个版本号，数据变化时调用
+bump() 使其失效。同一版本的响应只序列化一次，压缩结果（gzip，安装了可选依赖
+brotli 时也支持br）按需生成并缓存；ETag 为响应体的哈希，客户端带
+If-None-Match 请求且内容未变时直接返回304。
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+import fast_json
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+# 小于该大小的响应不压缩
+MIN_COMPRESS_SIZE = 1024
+# 每个集合最多缓存的不同查询
+MAX_KEYS_PER_COLLECTION = 32
+
+
+class CachedResponse:
+    def __init__(self, version, body):
+        self.version = version
+        self.body = body
+        self.etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding):
+        """返回指定编码的响应体，首次请求时压缩并缓存"""
+        if encoding is None:
+            return self.body
+        with self._lock:
+            data = self._encoded.get(encoding)
+            if data is None:
+                if encoding == "br":
+                    data = brotli.compress(self.body)
+                else:
+                    data = gzip.compress(self.body, compresslevel=6)
+                self._encoded[encoding] = data
+            return data
+
+
+def choose_encoding(accept_encoding, size):
+    """根据 Accept-Encoding 选择压缩方式，不压缩时返回None"""
+    if size < MIN_COMPRESS_SIZE or not accept_encoding:
+        return None
+    accepted = set()
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 经过压缩的代理可能会加上W/前缀
+    return any(tag.strip().replace("W/", "", 1) == etag for tag in if_none_match.split(","))
+
+
+class ResponseCache:
+    def __init__(self):
+        self._versions = {}
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def bump(self, *collections):
+        """集合数据已变化"""
+        with self._lock:
+            for collection in collections:
+                self._versions[collection] = self._versions.get(collection, 0) + 1
+
+    def version(self, collection):
+        return self._versions.get(collection, 0)
+
+    def get(self, collection, build, key=""):
+        """
+        返回集合当前版本的缓存响应；版本变化后调用 build() 重新生成数据并序列化
+        build 在版本号读取之后执行，生成期间数据再次变化时下一次请求会重新生成
+        """
+        version = self.version(collection)
+        with self._lock:
+            entries = self._entries.setdefault(collection, OrderedDict())
+            entry = entries.get(key)
+            if entry is not None and entry.version == version:
+                entries.move_to_end(key)
+                return entry
+
+        body = fast_json.dumps(build())
+        entry = CachedResponse(version, body)
+        with self._lock:
+            entries[key] = entry
+            entries.move_to_end(key)
+            while len(entries) > MAX_KEYS_PER_COLLECTION:
+                entries.popitem(last=False)
+        return entry
@@ -0,0 +1,260 @@
+"""
+服务器列表的索引和查询
+
+目录加载后为每个型号预先计算归一化的属性（内存GB数、存储类型、CPU文本），
+并建立倒排索引：
+  数据中心 -> 型号、数据中心 -> 有货的型号、内存GB数/存储类型 -> 型号
+各型号在各数据中心的可用性存放在 型号 × 数据中心 的可用性矩阵中，同一数据中心
+有多个FQN行时合并为一个状态，任一行有货即为有货；"是否有货"和有货型号的计数
+用矩阵的掩码查找完成。
+/api/servers 的过滤、统计中的有货数量以及队列的到货检测都基于这些索引，
+不必扫描全部型号和它们的数据中心列表。单个型号的可用性变化时原地修补索引。
+"""
+import bisect
+import re
+import threading
+import time
+
+from availability_history import best_levels
+from availability_matrix import AvailabilityMatrix, is_stock_level
+
+MEMORY_RE = re.compile(r'(\d+(?:\.\d+)?)\s*(TB|T|GB|G)?', re.IGNORECASE)
+STORAGE_TYPE_RE = re.compile(r'nvme|ssd|hdd|sata|(?<![a-z])sa(?![a-z])', re.IGNORECASE)
+STORAGE_TYPE_ALIASES = {"nvme": "nvme", "ssd": "ssd", "hdd": "hdd", "sata": "hdd", "sa": "hdd"}
+
+SORT_KEYS = ("planCode", "name", "memory", "cpu", "availability")
+MAX_LIMIT = 500
+
+
+def parse_memory_gb(memory):
+    """ "32 GB" -> 32，无法识别时返回None"""
+    if not memory or memory == "N/A":
+        return None
+    match = MEMORY_RE.search(memory)
+    if not match:
+        return None
+    value = float(match.group(1))
+    if (match.group(2) or "").upper().startswith("T"):
+        value *= 1024
+    return int(value)
+
+
+def parse_storage_types(storage):
+    """ "SOFTRAID 2x 512GB NVME" -> {"nvme"} """
+    if not storage or storage == "N/A":
+        return frozenset()
+    return frozenset(STORAGE_TYPE_ALIASES[match.lower()] for match in STORAGE_TYPE_RE.findall(storage))
+
+
+def split_list(value):
+    if not value:
+        return []
+    return [part.strip() for part in value.split(",") if part.strip()]
+
+
+def parse_bool(value):
+    return str(value).lower() in ("1", "true", "yes")
+
+
+def parse_int(value, name, default, minimum=1):
+    if value in (None, ""):
+        return default
+    try:
+        result = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"参数 {name} 必须是整数")
+    if result < minimum:
+        raise ValueError(f"参数 {name} 不能小于 {minimum}")
+    return result
+
+
+def parse_query(args):
+    """
+    把请求参数解析成查询条件；没有任何查询参数时返回None
+    args 只需要支持 get(name)，Flask和FastAPI的请求参数都可以直接传入
+    """
+    names = ("datacenter", "minMemory", "storageType", "cpu", "availableNow", "sort", "fields", "page", "limit")
+    if not any(args.get(name) not in (None, "") for name in names):
+        return None
+
+    # 未指定排序时保持目录顺序
+    sort = args.get("sort") or None
+    if sort and sort.lstrip("-") not in SORT_KEYS:
+        raise ValueError(f"不支持的排序字段: {sort}，可选: {', '.join(SORT_KEYS)}")
+
+    storage_types = set()
+    for storage_type in split_list(args.get("storageType")):
+        if storage_type.lower() not in STORAGE_TYPE_ALIASES:
+            raise ValueError(f"不支持的存储类型: {storage_type}")
+        storage_types.add(STORAGE_TYPE_ALIASES[storage_type.lower()])
+
+    return {
+        "datacenters": [dc.lower() for dc in split_list(args.get("datacenter"))],
+        "minMemory": parse_int(args.get("minMemory"), "minMemory", None, minimum=0),
+        "storageTypes": storage_types,
+        "cpu": (args.get("cpu") or "").strip().lower(),
+        "availableNow": parse_bool(args.get("availableNow")),
+        "sort": sort,
+        "fields": split_list(args.get("fields")),
+        "page": parse_int(args.get("page"), "page", 1),
+        "limit": min(parse_int(args.get("limit"), "limit", MAX_LIMIT), MAX_LIMIT),
+    }
+
+
+class ServerIndex:
+    def __init__(self, servers, previous=None):
+        """previous 为上一次的索引，用于保留持续有货的型号的到货时间"""
+        self.servers = list(servers)
+        self.attrs = [self._attributes(server) for server in self.servers]
+        self.position_by_code = {}
+        # 倒排索引，值为型号在 servers 中的位置
+        self.by_datacenter = {}
+        self.in_stock_by_datacenter = {}
+        self.by_memory = {}
+        self.by_storage = {}
+        # 型号 × 数据中心 的可用性，行键为planCode
+        self.availability = AvailabilityMatrix()
+        # (位置, 数据中心) -> 变为有货的时间
+        self.stock_since = {}
+        self._lock = threading.Lock()
+        
+        built_at = time.time()
+        for position, (server, attrs) in enumerate(zip(self.servers, self.attrs)):
+            plan_code = server.get("planCode")
+            self.position_by_code.setdefault(plan_code, position)
+            for dc, level in attrs.pop("levels").items():
+                self.availability.set(plan_code, dc, level)
+                self.by_datacenter.setdefault(dc, set()).add(position)
+                since = previous.stock_since_time(plan_code, dc) if previous else None
+                self._add_level(position, dc, level, since or built_at)
+            if attrs["memory"] is not None:
+                self.by_memory.setdefault(attrs["memory"], set()).add(position)
+            for storage_type in attrs["storage"]:
+                self.by_storage.setdefault(storage_type, set()).add(position)
+        self.memory_values = sorted(self.by_memory)
+
+    @staticmethod
+    def _attributes(server):
+        return {
+            "memory": parse_memory_gb(server.get("memory")),
+            "storage": parse_storage_types(server.get("storage")),
+            "cpu": (server.get("cpu") or "").lower(),
+            # 建立索引时写入可用性矩阵后移除
+            "levels": best_levels(((dc.get("datacenter") or "").lower(), dc.get("availability"))
+                                  for dc in server.get("datacenters") or []),
+        }
+
+    def _add_level(self, position, dc, level, now):
+        if is_stock_level(level):
+            self.in_stock_by_datacenter.setdefault(dc, set()).add(position)
+            self.stock_since[(position, dc)] = now
+
+    def _remove_level(self, position, dc, level):
+        if is_stock_level(level):
+            self.in_stock_by_datacenter.get(dc, set()).discard(position)
+            self.stock_since.pop((position, dc), None)
+
+    def update_availability(self, plan_code, datacenter, level):
+        """
+        修补单个型号在一个数据中心的可用性（level 为该数据中心合并后的状态）
+        返回 (修补前是否有货, 修补后是否有货, 是否有变化)，型号不存在时返回None
+        """
+        position = self.position_by_code.get(plan_code)
+        if position is None:
+            return None
+        dc = (datacenter or "").lower()
+        level = level or "unknown"
+        with self._lock:
+            had_stock = self.availability.plan_has_stock(plan_code)
+            old_level = self.availability.get(plan_code, dc)
+            if old_level == level:
+                return had_stock, had_stock, False
+            # 有货状态之间的变化（如1H变为72H）不算新到货
+            since = self.stock_since.get((position, dc)) if is_stock_level(old_level) else None
+            
+            self.availability.set(plan_code, dc, level)
+            if old_level is not None:
+                self._remove_level(position, dc, old_level)
+            self.by_datacenter.setdefault(dc, set()).add(position)
+            self._add_level(position, dc, level, since or time.time())
+            
+            # 同步更新返回给前端的数据中心列表（同一数据中心的每一行都改为合并后的状态）
+            datacenters = self.servers[position].setdefault("datacenters", [])
+            found = False
+            for entry in datacenters:
+                if (entry.get("datacenter") or "").lower() == dc:
+                    entry["availability"] = level
+                    found = True
+            if not found:
+                datacenters.append({"datacenter": datacenter, "availability": level})
+            return had_stock, self.availability.plan_has_stock(plan_code), True
+
+    def has_stock(self, plan_code, datacenter=None):
+        """型号在指定数据中心（不指定时为任一数据中心）是否有货"""
+        with self._lock:
+            return self.availability.plan_has_stock(plan_code, datacenter.lower() if datacenter else None)
+
+    def stock_since_time(self, plan_code, datacenter):
+        """型号在数据中心变为有货的时间，无货时返回None"""
+        position = self.position_by_code.get(plan_code)
+        if position is None:
+            return None
+        return self.stock_since.get((position, (datacenter or "").lower()))
+
+    def available_count(self):
+        with self._lock:
+            return len(self.availability.plans_with_stock())
+
+    def candidates(self, query):
+        """用倒排索引求候选集合，返回按目录顺序排列的位置"""
+        sets = []
+        if query["datacenters"]:
+            index = self.in_stock_by_datacenter if query["availableNow"] else self.by_datacenter
+            sets.append(set().union(*(index.get(dc, set()) for dc in query["datacenters"])))
+        elif query["availableNow"]:
+            sets.append({self.position_by_code[plan_code] for plan_code in self.availability.plans_with_stock()})
+        if query["storageTypes"]:
+            sets.append(set().union(*(self.by_storage.get(storage_type, set()) for storage_type in query["storageTypes"])))
+        if query["minMemory"] is not None:
+            start = bisect.bisect_left(self.memory_values, query["minMemory"])
+            sets.append(set().union(*(self.by_memory[value] for value in self.memory_values[start:])))
+        if not sets:
+            return list(range(len(self.servers)))
+        sets.sort(key=len)
+        return sorted(sets[0].intersection(*sets[1:]))
+
+    def _sort_value(self, position, field):
+        """排序用的值；None表示缺失，总是排在最后"""
+        attrs = self.attrs[position]
+        if field == "memory":
+            return attrs["memory"]
+        if field == "cpu":
+            return attrs["cpu"] if attrs["cpu"] not in ("", "n/a") else None
+        if field == "availability":
+            return len(self.availability.datacenters_with_stock(self.servers[position].get("planCode")))
+        return str(self.servers[position].get(field) or "").lower()
+
+    def query(self, query):
+        with self._lock:
+            positions = self.candidates(query)
+            if query["cpu"]:
+                positions = [position for position in positions if query["cpu"] in self.attrs[position]["cpu"]]
+            
+            sort = query["sort"]
+            if sort:
+                field = sort.lstrip("-")
+                values = {position: self._sort_value(position, field) for position in positions}
+                known = [position for position in positions if values[position] is not None]
+                known.sort(key=values.__getitem__, reverse=sort.startswith("-"))
+                positions = known + [position for position in positions if values[position] is None]
+
+        total = len(positions)
+        start = (query["page"] - 1) * query["limit"]
+        page = positions[start:start + query["limit"]]
+
+        fields = query["fields"]
+        if fields:
+            servers = [{key: self.servers[position].get(key) for key in fields} for position in page]
+        else:
+            servers = [self.servers[position] for position in page]
+        return {"servers": servers, "total": total, "page": query["page"], "limit": query["limit"]}
@@ -0,0 +1,122 @@
+"""
+任务和订单状态的版本号与增量同步
+
+每次任务或订单变化时全局版本号加一，只记录与上一次状态相比发生变化的字段，
+通过 WebSocket 以 delta 消息发送：
+  {"type": "delta", "data": {"kind": "task", "id": ..., "rev": 12, "changes": {...}}}
+删除时为 "deleted": true，清空某类实体时为 "cleared": true（id为None）。
+
+客户端保存最后收到的游标（"启动时间:版本号"），重连时带上游标，服务端从最近的
+变化记录中合并出缺失的增量（同一实体多次变化只发一次）；游标过旧或服务已重启时
+发送完整快照。完整快照中的任务和订单按版本号缓存序列化结果，重启后大量客户端
+同时重连时每个版本只序列化一次。
+"""
+import threading
+import time
+from collections import deque
+
+
+class StateSync:
+    def __init__(self, history_size=10000):
+        self.epoch = int(time.time())
+        self.revision = 0
+        self.entities = {}  # (类型, id) -> 最近一次的状态
+        self.changes = deque(maxlen=history_size)  # (版本号, 类型, id, 变化的字段/None表示删除/"cleared")
+        self._snapshots = {}  # 名称 -> (版本号, 序列化结果)
+        self._lock = threading.Lock()
+
+    @property
+    def cursor(self):
+        return f"{self.epoch}:{self.revision}"
+
+    def _delta(self, kind, entity_id, rev, change):
+        delta = {"kind": kind, "id": entity_id, "rev": rev}
+        if change is None:
+            delta["deleted"] = True
+        elif change == "cleared":
+            delta["cleared"] = True
+        else:
+            delta["changes"] = change
+        return delta
+
+    def update(self, kind, entity_id, state):
+        """记录实体的新状态，返回delta；没有变化时返回None"""
+        key = (kind, entity_id)
+        with self._lock:
+            previous = self.entities.get(key)
+            if previous is None:
+                changes = dict(state)
+            else:
+                changes = {field: value for field, value in state.items() if previous.get(field) != value}
+                changes.update({field: None for field in previous if field not in state})
+            if not changes:
+                return None
+            self.revision += 1
+            self.entities[key] = dict(state)
+            self.changes.append((self.revision, kind, entity_id, changes))
+            return self._delta(kind, entity_id, self.revision, changes)
+
+    def remove(self, kind, entity_id):
+        with self._lock:
+            if self.entities.pop((kind, entity_id), None) is None:
+                return None
+            self.revision += 1
+            self.changes.append((self.revision, kind, entity_id, None))
+            return self._delta(kind, entity_id, self.revision, None)
+
+    def clear(self, kind):
+        with self._lock:
+            for key in [key for key in self.entities if key[0] == kind]:
+                del self.entities[key]
+            self.revision += 1
+            self.changes.append((self.revision, kind, None, "cleared"))
+            return self._delta(kind, None, self.revision, "cleared")
+
+    def deltas_since(self, cursor):
+        """
+        返回游标之后的增量列表，同一实体的多次变化合并为一条
+        游标无效、来自服务重启之前或已超出记录范围时返回None（需要完整快照）
+        """
+        epoch, _, revision = (cursor or "").partition(":")
+        if epoch != str(self.epoch) or not revision.isdigit():
+            return None
+        since = int(revision)
+        with self._lock:
+            if since > self.revision:
+                return None
+            if since == self.revision:
+                return []
+            if not self.changes or self.changes[0][0] > since + 1:
+                return None
+            merged = {}
+            for rev, kind, entity_id, change in self.changes:
+                if rev <= since:
+                    continue
+                if change == "cleared":
+                    for key in [key for key in merged if key[0] == kind]:
+                        del merged[key]
+                    merged[(kind, None)] = (rev, change)
+                    continue
+                key = (kind, entity_id)
+                previous = merged.pop(key, None)
+                if change is not None and previous is not None and isinstance(previous[1], dict):
+                    change = {**previous[1], **change}
+                merged[key] = (rev, change)
+        return [self._delta(kind, entity_id, rev, change) for (kind, entity_id), (rev, change) in merged.items()]
+
+    def snapshot_json(self, name, encode):
+        """按当前版本号缓存 encode() 返回的序列化结果"""
+        revision = self.revision
+        cached = self._snapshots.get(name)
+        if cached and cached[0] == revision:
+            return cached[1]
+        text = encode()
+        self._snapshots[name] = (revision, text)
+        return text
+
+
+def merge_deltas(old, new):
+    """合并同一实体在同一批次中的两条delta"""
+    if new.get("deleted") or old.get("deleted") or "changes" not in old:
+        return new
+    return {**new, "changes": {**old["changes"], **new["changes"]}}
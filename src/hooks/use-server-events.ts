@@ -0,0 +1,61 @@
+import * as React from "react"
+
+const EVENTS_URL = 'http://localhost:5000/api/events'
+
+type Handler = (data: any) => void
+
+// 所有组件共用一个 EventSource，没有订阅者时关闭连接
+let source: EventSource | null = null
+const handlers = new Map<string, Set<Handler>>()
+
+function dispatch(type: string, event: MessageEvent) {
+  let data: any = {}
+  try {
+    data = JSON.parse(event.data)
+  } catch {
+    return
+  }
+  handlers.get(type)?.forEach(handler => handler(data))
+}
+
+function subscribe(type: string, handler: Handler) {
+  if (!handlers.has(type)) {
+    handlers.set(type, new Set())
+    source?.addEventListener(type, event => dispatch(type, event as MessageEvent))
+  }
+  handlers.get(type)!.add(handler)
+
+  if (!source) {
+    source = new EventSource(EVENTS_URL)
+    handlers.forEach((_, name) => {
+      source!.addEventListener(name, event => dispatch(name, event as MessageEvent))
+    })
+  }
+
+  return () => {
+    handlers.get(type)?.delete(handler)
+    if (Array.from(handlers.values()).every(set => set.size === 0)) {
+      source?.close()
+      source = null
+      handlers.clear()
+    }
+  }
+}
+
+/**
+ * 订阅后端 /api/events 推送的事件，例如 "log"、"queue_item"、"stats"；
+ * 事件补发不完整时后端会发送 "reset"，订阅者应重新拉取完整数据
+ */
+export function useServerEvents(handlersByType: Record<string, Handler>) {
+  const ref = React.useRef(handlersByType)
+  ref.current = handlersByType
+
+  const types = Object.keys(handlersByType).sort().join(",")
+
+  React.useEffect(() => {
+    const unsubscribes = types.split(",").filter(Boolean).map(type =>
+      subscribe(type, data => ref.current[type]?.(data))
+    )
+    return () => unsubscribes.forEach(unsubscribe => unsubscribe())
+  }, [types])
+}
@@ -4,6 +4,7 @@ import { motion } from "framer-motion";
 import { Link } from "react-router-dom";
 import { useAPI } from "@/context/APIContext";
 import axios from "axios";
+import { useServerEvents } from "@/hooks/use-server-events";
 
 // Backend API URL (update this to match your backend)
 const API_URL = 'http://localhost:5000/api';
@@ -41,12 +42,20 @@ const Dashboard = () => {
 
     fetchStats();
     
-    // Set up polling interval
-    const interval = setInterval(fetchStats, 30000);
+    // 统计变化由后端推送，定时拉取只作为兜底
+    const interval = setInterval(fetchStats, 120000);
     
     return () => clearInterval(interval);
   }, []);
 
+  // 合并推送的统计变化；断线期间的事件无法补发时重新拉取
+  useServerEvents({
+    stats: (delta) => setStats(prev => ({ ...prev, ...delta })),
+    reset: () => {
+      axios.get(`${API_URL}/stats`).then(response => setStats(response.data)).catch(() => {});
+    },
+  });
+
   const containerVariants = {
     hidden: { opacity: 0 },
     visible: {
@@ -3,6 +3,7 @@ import { useState, useEffect, useRef } from "react";
 import { motion } from "framer-motion";
 import axios from "axios";
 import { toast } from "sonner";
+import { useServerEvents } from "@/hooks/use-server-events";
 
 // Backend API URL (update this to match your backend)
 const API_URL = 'http://localhost:5000/api';
@@ -67,7 +68,8 @@ const LogsPage = () => {
     
     let interval: NodeJS.Timeout;
     if (autoRefresh) {
-      interval = setInterval(fetchLogs, 5000);
+      // 新日志由后端推送，定时拉取只作为兜底
+      interval = setInterval(fetchLogs, 60000);
     }
     
     return () => {
@@ -75,6 +77,17 @@ const LogsPage = () => {
     };
   }, [autoRefresh]);
 
+  // 自动刷新开启时追加推送的日志（与后端一样最多保留1000条）
+  useServerEvents({
+    log: (entry: LogEntry) => {
+      if (autoRefresh) {
+        setLogs(prev => [...prev, entry].slice(-1000));
+      }
+    },
+    logs_cleared: () => setLogs([]),
+    reset: () => fetchLogs(),
+  });
+
   // Apply filters
   useEffect(() => {
     if (logs.length === 0) return;
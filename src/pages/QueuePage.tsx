@@ -3,6 +3,7 @@ import { motion } from "framer-motion";
 import { useAPI } from "@/context/APIContext";
 import axios from "axios";
 import { toast } from "sonner";
+import { useServerEvents } from "@/hooks/use-server-events";
 import { XIcon, RefreshCwIcon, PlusIcon, SearchIcon, PlayIcon, PauseIcon, Trash2Icon, ArrowUpDownIcon, HeartIcon } from 'lucide-react';
 import { OVH_DATACENTERS, DatacenterInfo } from "@/config/ovhConstants";
 
@@ -13,6 +14,9 @@ interface QueueItem {
   id: string;
   planCode: string;
   datacenter: string;
+  datacenters?: string[];
+  quantity?: number;
+  fulfilledQuantity?: number;
   options: string[];
   status: "pending" | "running" | "completed" | "failed";
   createdAt: string;
@@ -52,6 +56,7 @@ const QueuePage = () => {
   const [selectedServer, setSelectedServer] = useState<ServerPlan | null>(null);
   const [selectedDatacenters, setSelectedDatacenters] = useState<string[]>([]);
   const [retryInterval, setRetryInterval] = useState<number>(29);
+  const [quantity, setQuantity] = useState<number>(1);
 
   // Fetch queue items
   const fetchQueueItems = async () => {
@@ -90,36 +95,30 @@ const QueuePage = () => {
       return;
     }
 
-    let successCount = 0;
-    let errorCount = 0;
-
-    for (const dc of selectedDatacenters) {
+    let added = false;
     try {
+      // 选中的数据中心放在同一个任务中，按选择顺序优先
       await axios.post(`${API_URL}/queue`, {
-          planCode: planCodeInput.trim(),
-          datacenter: dc,
+        planCode: planCodeInput.trim(),
+        datacenter: selectedDatacenters[0],
+        datacenters: selectedDatacenters,
         retryInterval: retryInterval,
+        quantity: quantity,
       });
-        successCount++;
-      } catch (error) {
-        console.error(`Error adding ${planCodeInput.trim()} in ${dc} to queue:`, error);
-        errorCount++;
-      }
-    }
-
-    if (successCount > 0) {
-      toast.success(`${successCount}个任务已成功添加到抢购队列`);
-    }
-    if (errorCount > 0) {
-      toast.error(`${errorCount}个任务添加到抢购队列失败`);
+      added = true;
+      toast.success(`任务已成功添加到抢购队列，监控 ${selectedDatacenters.length} 个数据中心`);
+    } catch (error) {
+      console.error(`Error adding ${planCodeInput.trim()} to queue:`, error);
+      toast.error("任务添加到抢购队列失败");
     }
 
-    if (successCount > 0 || errorCount === 0) {
+    if (added) {
       fetchQueueItems();
       setShowAddForm(false);
       setPlanCodeInput("");
       setSelectedDatacenters([]);
       setRetryInterval(30);
+      setQuantity(1);
     }
   };
 
@@ -157,12 +156,27 @@ const QueuePage = () => {
     fetchQueueItems();
     fetchServers();
     
-    // Set up polling interval
-    const interval = setInterval(fetchQueueItems, 10000);
+    // 队列变化由后端推送，定时拉取只作为兜底
+    const interval = setInterval(fetchQueueItems, 60000);
     
     return () => clearInterval(interval);
   }, [isAuthenticated]);
 
+  // 按推送的变化更新单个队列项
+  useServerEvents({
+    queue_item: ({ action, item }: { action: string; item: QueueItem }) => {
+      setQueueItems(prev => {
+        if (action === "removed") {
+          return prev.filter(existing => existing.id !== item.id);
+        }
+        return prev.some(existing => existing.id === item.id)
+          ? prev.map(existing => existing.id === item.id ? item : existing)
+          : [...prev, item];
+      });
+    },
+    reset: () => fetchQueueItems(),
+  });
+
   // Update selectedServer when planCodeInput or servers list changes
   useEffect(() => {
     if (planCodeInput.trim()) {
@@ -271,6 +285,17 @@ const QueuePage = () => {
                   className="w-full cyber-input bg-cyber-surface text-cyber-text border-cyber-border focus:ring-cyber-primary focus:border-cyber-primary"
                 />
               </div>
+              <div>
+                <label htmlFor="quantity" className="block text-sm font-medium text-cyber-secondary mb-1">购买数量 (台)</label>
+                <input
+                  type="number"
+                  id="quantity"
+                  value={quantity}
+                  onChange={(e) => setQuantity(Math.max(1, Math.floor(Number(e.target.value) || 1)))}
+                  min="1"
+                  className="w-full cyber-input bg-cyber-surface text-cyber-text border-cyber-border focus:ring-cyber-primary focus:border-cyber-primary"
+                />
+              </div>
             </div>
 
             {/* Right Column: Datacenter Selection */}
@@ -335,7 +360,10 @@ const QueuePage = () => {
                     <span className="px-2 py-0.5 text-xs bg-cyber-primary-accent/20 text-cyber-primary-accent rounded-full font-mono">
                       {item.planCode}
                     </span>
-                    <span className="text-sm text-cyber-text-dimmed">DC: {item.datacenter.toUpperCase()}</span>
+                    <span className="text-sm text-cyber-text-dimmed">DC: {(item.datacenters?.length ? item.datacenters : [item.datacenter]).map(dc => dc.toUpperCase()).join(" > ")}</span>
+                    {(item.quantity ?? 1) > 1 && (
+                      <span className="text-xs text-cyber-muted">已购 {item.fulfilledQuantity ?? 0}/{item.quantity}</span>
+                    )}
                   </div>
                   <p className="text-xs text-cyber-muted">
                     下次尝试: {item.retryCount > 0 ? `${item.retryInterval}秒后 (第${item.retryCount + 1}次)` : `即将开始` } | 创建于: {new Date(item.createdAt).toLocaleString()}
@@ -16,6 +16,7 @@ import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { Cpu, Database, Wifi, HardDrive, CheckSquare, Square, Settings, ArrowRightLeft, Clock } from "lucide-react";
 import { apiEvents } from "@/context/APIContext";
+import { useServerEvents } from "@/hooks/use-server-events";
 import { OVH_DATACENTERS, DatacenterInfo } from "@/config/ovhConstants"; // Import from new location
 
 // Backend API URL (update this to match your backend)
@@ -161,7 +162,8 @@ const ServersPage = () => {
   };
 
   // Fetch servers from the backend
-  const fetchServers = async (forceRefresh = false) => {
+  // snapshotOnly: 只读取后端已有的快照，不让后端因为这次请求去刷新目录（例如响应 servers_refreshed 事件时）
+  const fetchServers = async (forceRefresh = false, snapshotOnly = false) => {
     // 如果不是强制刷新，并且已从缓存加载过数据，并且缓存未过期，则跳过
     if (!forceRefresh && hasLoadedFromCache.current && !isCacheExpired()) {
       console.log("使用现有数据，缓存未过期，跳过API请求");
@@ -179,7 +181,7 @@ const ServersPage = () => {
     try {
       console.log(`开始从API获取服务器数据... (forceRefresh: ${forceRefresh})`);
       const response = await axios.get(`${API_URL}/servers`, {
-        params: { showApiServers: isAuthenticated }
+        params: { showApiServers: isAuthenticated && !snapshotOnly }
       });
       
       // 调试输出查看原始服务器数据
@@ -754,19 +756,17 @@ const ServersPage = () => {
       console.log("用户选择的配置详情:", formattedOptions);
       console.log("提交的配置选项:", userSelectedOptions);
 
-      // 为每个选中的数据中心创建一个抢购请求
-      const promises = datacenters.map(datacenter => 
-        axios.post(`${API_URL}/queue`, {
-          planCode: server.planCode,
-          datacenter,
-          options: userSelectedOptions,
-        })
-      );
-      
-      await Promise.all(promises);
+      // 所有选中的数据中心放在同一个抢购任务中（按选择顺序优先），后端每次只查询一次可用性，
+      // 在第一个有货的数据中心下单
+      await axios.post(`${API_URL}/queue`, {
+        planCode: server.planCode,
+        datacenter: datacenters[0],
+        datacenters,
+        options: userSelectedOptions,
+      });
       
       // 构建成功消息，包含用户选择的配置详情
-      let successMessage = `已将 ${server.planCode} 添加到 ${datacenters.length} 个数据中心的抢购队列`;
+      let successMessage = `已将 ${server.planCode} 添加到抢购队列，监控 ${datacenters.length} 个数据中心`;
       
       // 如果有自定义配置，添加到成功消息中
       if (userSelectedOptions.length > 0 && userSelectedOptions.some(opt => !server.defaultOptions.map(o => o.value).includes(opt))) {
@@ -829,6 +829,11 @@ const ServersPage = () => {
     };
   }, []);
 
+  // 后台刷新完成后重新读取服务器列表快照（不再触发刷新，避免刷新完成事件引起新一轮刷新）
+  useServerEvents({
+    servers_refreshed: () => fetchServers(true, true),
+  });
+
   // Apply filters when search term or datacenter changes
   useEffect(() => {
     if (servers.length === 0) return;